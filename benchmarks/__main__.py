@@ -0,0 +1,77 @@
+import argparse
+import json
+import sys
+
+from .report import build_report, compare_reports, write_report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingest and query paths and write a JSON report"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run")
+    run.add_argument("--rows", type=float, default=1e4, help="rows per individual")
+    run.add_argument("--individuals", type=int, default=4)
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--reads", type=int, default=200)
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--skip-load", action="store_true")
+    run.add_argument("--output", default="bench_report.json")
+
+    startup = subparsers.add_parser(
+        "startup", help="time cold starts, failing if they exceed the budget"
+    )
+    startup.add_argument("--rows", type=float, default=1e5)
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.add_argument("--budget", type=float, default=None, help="seconds")
+    startup.add_argument("--output", default="startup_report.json")
+
+    compare = subparsers.add_parser("compare")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        from .load import run_load_test
+        from .micro import run_micro_benchmarks
+        from .startup import run_startup_benchmarks
+
+        rows = int(args.rows)
+        results = {"micro": run_micro_benchmarks(rows, args.individuals, args.repeat)}
+        if not args.skip_load:
+            results["load"] = run_load_test(
+                rows, args.individuals, args.reads, args.concurrency
+            )
+        results["startup"] = run_startup_benchmarks(rows, args.repeat)
+        report = build_report(vars(args), results)
+        write_report(report, args.output)
+        print(json.dumps(report, indent=2))
+    elif args.command == "startup":
+        from .startup import (
+            DEFAULT_BUDGET_SECONDS,
+            run_startup_benchmarks,
+            within_budget,
+        )
+
+        budget = DEFAULT_BUDGET_SECONDS if args.budget is None else args.budget
+        results = run_startup_benchmarks(int(args.rows), args.repeat, budget)
+        report = build_report(vars(args), {"startup": results})
+        write_report(report, args.output)
+        print(json.dumps(report, indent=2))
+        if not within_budget(results):
+            sys.exit(f"Cold start exceeded the {budget}s budget")
+    else:
+        with open(args.baseline) as baseline, open(args.candidate) as candidate:
+            comparison = compare_reports(json.load(baseline), json.load(candidate))
+        for name, metric in comparison.items():
+            print(
+                f"{name:60} {metric['baseline']:>14.4f} {metric['candidate']:>14.4f}"
+                f" {metric['ratio']:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import os
+import random
+from typing import Iterator
+
+from ..models.models import AlleleEnum, ChromosomeEnum, HeaderOrder
+
+HEADER = "#" + ",".join(member.value for member in HeaderOrder)
+CHROMOSOMES = [member.value for member in ChromosomeEnum]
+ALLELES = [member.value for member in AlleleEnum]
+
+
+def generate_sano_lines(n_rows: int, seed: int = 0) -> Iterator[str]:
+    """
+    Lazily generates a sano file of `n_rows` variants, header included, so any size
+    can be produced in constant memory. Variant i is the same for every seed, so
+    files generated for several individuals share their variants like a real cohort,
+    and only the alternate allele frequencies differ.
+    """
+    rng = random.Random(seed)
+    yield HEADER
+    for i in range(n_rows):
+        yield (
+            f"rs{i},{CHROMOSOMES[i % len(CHROMOSOMES)]},{1000 + i * 13},"
+            f"{ALLELES[i % 4]},{ALLELES[(i + 1 + i // 4) % 4]},{rng.random():.4f}"
+        )
+
+
+def write_sano_file(path: str, n_rows: int, seed: int = 0) -> str:
+    with open(path, "w") as f:
+        for line in generate_sano_lines(n_rows, seed):
+            f.write(line + "\n")
+    return path
+
+
+def write_cohort(directory: str, n_rows: int, n_individuals: int) -> list:
+    """Writes one file per individual, named individual<N>.sano"""
+    os.makedirs(directory, exist_ok=True)
+    return [
+        write_sano_file(
+            os.path.join(directory, f"individual{index}.sano"), n_rows, seed=index
+        )
+        for index in range(n_individuals)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic sano files")
+    parser.add_argument("directory")
+    parser.add_argument("--rows", type=float, default=1e3, help="rows per file")
+    parser.add_argument("--individuals", type=int, default=1)
+    args = parser.parse_args()
+
+    for path in write_cohort(args.directory, int(args.rows), args.individuals):
+        print(path)
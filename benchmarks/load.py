@@ -0,0 +1,135 @@
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from ..endpoints.endpoints import router, set_db_handler
+from .generate_sano import write_sano_file
+from .micro import temporary_db_handler
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+class LocalServer:
+    """Serves the API with uvicorn on a background thread against a scratch database"""
+
+    def __init__(self, directory: str):
+        self.db_handler = temporary_db_handler(directory)
+        set_db_handler(self.db_handler)
+        app = FastAPI()
+        app.include_router(router)
+        self.port = _free_port()
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "LocalServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+        self.db_handler.close()
+
+
+def _latency_summary(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    if not ordered:
+        return {"requests": 0}
+    return {
+        "requests": len(ordered),
+        "p50_seconds": ordered[len(ordered) // 2],
+        "p95_seconds": ordered[int(len(ordered) * 0.95)],
+        "max_seconds": ordered[-1],
+        "mean_seconds": statistics.fmean(ordered),
+    }
+
+
+def run_load_test(
+    n_rows: int, n_individuals: int = 4, n_reads: int = 200, concurrency: int = 8
+) -> Dict[str, Any]:
+    """
+    Uploads one file per individual while `n_reads` reads of already uploaded
+    individuals run alongside, all from `concurrency` client threads. The upload is
+    written to disk once and every request streams its body from the file.
+    """
+    individual_ids = [f"individual{index}" for index in range(n_individuals)]
+    with tempfile.TemporaryDirectory() as directory, LocalServer(directory) as server:
+        path = write_sano_file(os.path.join(directory, "upload.sano"), n_rows)
+        with httpx.Client(base_url=server.url, timeout=600) as client:
+
+            def upload(individual_id: str) -> httpx.Response:
+                with open(path, "rb") as f:
+                    return client.post(
+                        f"/individuals/{individual_id}/genetic_data",
+                        files={"file": (f"{individual_id}.sano", f)},
+                    )
+
+            for individual_id in individual_ids:
+                client.post("/individuals", json={"individual_id": individual_id})
+            # One individual is loaded up front so reads have data from the start
+            upload(individual_ids[0])
+
+            upload_latencies: List[float] = []
+            read_latencies: List[float] = []
+
+            def timed(
+                latencies: List[float], send: Callable[[], httpx.Response]
+            ) -> None:
+                start = time.perf_counter()
+                response = send()
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                futures = [
+                    pool.submit(timed, upload_latencies, partial(upload, individual_id))
+                    for individual_id in individual_ids[1:]
+                ]
+                futures += [
+                    pool.submit(
+                        timed,
+                        read_latencies,
+                        partial(
+                            client.get,
+                            f"/individuals/{individual_ids[0]}/genetic-data",
+                            params={
+                                "variants": f"rs{index % n_rows}",
+                                "fields": "variant_id",
+                            },
+                        ),
+                    )
+                    for index in range(n_reads)
+                ]
+                for future in futures:
+                    future.result()
+            elapsed = time.perf_counter() - start
+
+    return {
+        "elapsed_seconds": elapsed,
+        "uploaded_rows_per_second": n_rows * len(upload_latencies) / elapsed,
+        "uploads": _latency_summary(upload_latencies),
+        "reads": _latency_summary(read_latencies),
+    }
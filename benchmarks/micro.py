@@ -0,0 +1,161 @@
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from itertools import islice
+from typing import Any, Callable, Dict, List
+
+from ..db_utils.database_handler import DatabaseHandler
+from ..models.models import AlleleEnum, ChromosomeEnum, GeneticData
+from ..utils import file_parser
+from .generate_sano import write_sano_file
+
+# Benchmarks building whole results in memory (model construction and
+# get_individual_data) use at most this many rows; the rest stream the file
+MAX_IN_MEMORY_ROWS = 1_000_000
+
+
+def measure(fn: Callable[[], Any], rows: int, repeat: int = 3) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "rows": rows,
+        "min_seconds": best,
+        "median_seconds": statistics.median(timings),
+        "rows_per_second": rows / best if best else 0.0,
+    }
+
+
+def measure_memory(fn: Callable[[], List[Any]]) -> Dict[str, float]:
+    """Bytes allocated per item of the list `fn` builds, the list itself included"""
+    tracemalloc.start()
+    try:
+        items = fn()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"items": len(items), "bytes_per_item": allocated / len(items)}
+
+
+def temporary_db_handler(directory: str) -> DatabaseHandler:
+    config_file = os.path.join(directory, "config.ini")
+    with open(config_file, "w") as f:
+        f.write(f"[database]\ndb_path = {os.path.join(directory, 'bench.db')}\n")
+        f.write("[cache]\ndata_cache_size = 0\n")
+    return DatabaseHandler(config_file)
+
+
+def insert_sano_file(
+    db_handler: DatabaseHandler, path: str, individual_id: str
+) -> None:
+    """Inserts a sano file one batch at a time, as an upload is"""
+    with open(path) as f:
+        for rows in file_parser.iter_row_batches(f):
+            db_handler.insert_genetic_rows_to_db(rows, individual_id)
+
+
+def _read_rows(path: str, n_rows: int) -> List[Any]:
+    # The first `n_rows` rows of a sano file, parsed
+    with open(path) as f:
+        header_order = file_parser.get_header_order(next(f))
+        return file_parser.parse_lines_to_rows(islice(f, n_rows), header_order)
+
+
+def _count_parsed_rows(path: str) -> int:
+    with open(path) as f:
+        return sum(len(rows) for rows in file_parser.iter_row_batches(f))
+
+
+def _count_parsed_genetic_data(path: str) -> int:
+    with open(path) as f:
+        return sum(1 for _ in file_parser.parse_file_to_genetic_data(f))
+
+
+def run_micro_benchmarks(
+    n_rows: int, n_individuals: int = 1, repeat: int = 3
+) -> Dict[str, Dict[str, float]]:
+    """
+    Times parsing, model construction, inserts and reads on `n_rows` rows. The rows
+    are written to a file and parsed and inserted from it in batches, so memory use
+    does not grow with `n_rows`.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_sano_file(os.path.join(directory, "bench.sano"), n_rows)
+        sample_rows = _read_rows(path, min(n_rows, MAX_IN_MEMORY_ROWS))
+
+        def construct_genetic_data() -> List[GeneticData]:
+            return [
+                GeneticData(
+                    row[0],
+                    ChromosomeEnum(row[1]),
+                    row[2],
+                    AlleleEnum(row[3]),
+                    AlleleEnum(row[4]),
+                    row[5],
+                )
+                for row in sample_rows
+            ]
+
+        def construct_trusted_genetic_data() -> List[GeneticData]:
+            return [GeneticData.from_row(row) for row in sample_rows]
+
+        sample_size = len(sample_rows)
+        results = {
+            "parse_dataclass": measure(
+                lambda: _count_parsed_genetic_data(path), n_rows, repeat
+            ),
+            "parse_columnar": measure(lambda: _count_parsed_rows(path), n_rows, repeat),
+            "construct_genetic_data": measure(
+                construct_genetic_data, sample_size, repeat
+            ),
+            "construct_trusted_genetic_data": measure(
+                construct_trusted_genetic_data, sample_size, repeat
+            ),
+            "genetic_data_memory": measure_memory(construct_trusted_genetic_data),
+        }
+        # Freed before the inserts, which only hold a batch at a time
+        del sample_rows
+
+        db_handler = temporary_db_handler(directory)
+        individual_ids = [f"individual{index}" for index in range(n_individuals)]
+        for individual_id in individual_ids:
+            db_handler.insert_new_individual(individual_id)
+
+        def insert_all() -> None:
+            for individual_id in individual_ids:
+                insert_sano_file(db_handler, path, individual_id)
+
+        total_rows = n_rows * n_individuals
+        # Inserted once, since repeating would grow the data the reads below measure
+        results["insert_rows"] = measure(insert_all, total_rows, 1)
+        if n_rows <= MAX_IN_MEMORY_ROWS:
+            results["get_individual_data"] = measure(
+                lambda: db_handler.get_individual_data(individual_ids[0]),
+                n_rows,
+                repeat,
+            )
+        results["get_individual_data_variants"] = measure(
+            lambda: db_handler.get_individual_data(
+                individual_ids[0],
+                ",".join(f"rs{i}" for i in range(0, sample_size, 100)),
+            ),
+            len(range(0, sample_size, 100)),
+            repeat,
+        )
+        results["iter_individual_data"] = measure(
+            lambda: sum(
+                len(batch) for batch in db_handler.iter_individual_data(individual_ids[0])
+            ),
+            n_rows,
+            repeat,
+        )
+        # Closing checkpoints the WAL, so the size includes every committed row
+        db_handler.close()
+        results["database_size_bytes"] = {"bytes": os.path.getsize(db_handler.db_path)}
+
+    return results
@@ -0,0 +1,58 @@
+import datetime
+import json
+import platform
+import subprocess
+from typing import Any, Dict, Iterator, Tuple
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_report(parameters: Dict[str, Any], results: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "results": results,
+    }
+
+
+def write_report(report: Dict[str, Any], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}.")
+        elif isinstance(value, (int, float)):
+            yield name, float(value)
+
+
+def compare_reports(
+    baseline: Dict[str, Any], candidate: Dict[str, Any]
+) -> Dict[str, Dict[str, float]]:
+    """Returns every metric present in both reports with its candidate/baseline ratio"""
+    baseline_metrics = dict(_flatten(baseline["results"]))
+    return {
+        name: {
+            "baseline": baseline_metrics[name],
+            "candidate": value,
+            "ratio": value / baseline_metrics[name] if baseline_metrics[name] else 0.0,
+        }
+        for name, value in _flatten(candidate["results"])
+        if name in baseline_metrics
+    }
@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from ..db_utils.database_handler import DatabaseHandler
+from .generate_sano import write_sano_file
+from .micro import insert_sano_file, temporary_db_handler
+
+# Seconds from launching Python to having imported the application, which every
+# new instance pays before it can serve
+DEFAULT_BUDGET_SECONDS = 1.5
+
+PACKAGE = __package__.rsplit(".", 1)[0]
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run_python(code: str) -> str:
+    # A fresh interpreter each time, so nothing is already imported
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [os.path.dirname(REPOSITORY_DIR), env.get("PYTHONPATH")])
+    )
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPOSITORY_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def _summary(timings: List[float]) -> Dict[str, float]:
+    return {"min_seconds": min(timings), "max_seconds": max(timings)}
+
+
+def time_cold_start(module: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    """Times importing `module` in new interpreters, with and without their launch"""
+    code = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    imports, processes = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        imports.append(float(_run_python(code)))
+        processes.append(time.perf_counter() - start)
+    return {"import": _summary(imports), "process": _summary(processes)}
+
+
+def time_open_database(rows: int, repeat: int) -> Dict[str, float]:
+    """Times opening an existing, up to date database of `rows` rows"""
+    with tempfile.TemporaryDirectory() as directory:
+        db_handler = temporary_db_handler(directory)
+        db_handler.insert_new_individual("individual0")
+        path = write_sano_file(os.path.join(directory, "startup.sano"), rows)
+        insert_sano_file(db_handler, path, "individual0")
+        db_handler.close()
+        config_file = os.path.join(directory, "config.ini")
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            DatabaseHandler(config_file).close()
+            timings.append(time.perf_counter() - start)
+    return {"rows": rows, **_summary(timings)}
+
+
+def run_startup_benchmarks(
+    rows: int, repeat: int = 5, budget_seconds: float = DEFAULT_BUDGET_SECONDS
+) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        "cold_start": time_cold_start(f"{PACKAGE}.main", repeat),
+        "open_database": time_open_database(rows, repeat),
+    }
+    results["budget_seconds"] = budget_seconds
+    return results
+
+
+def within_budget(results: Dict[str, Any]) -> bool:
+    slowest = results["cold_start"]["process"]["max_seconds"]
+    return slowest <= results["budget_seconds"]
@@ -0,0 +1,418 @@
+import asyncio
+import contextvars
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from ..utils import file_parser
+from .database_handler import DatabaseHandler
+from .sharded_database_handler import ShardedDatabaseHandler
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_READER_THREADS = 8
+
+# Rejected rows beyond this many are counted but not listed in an ingest report
+MAX_REPORTED_ERRORS = 1_000
+
+
+class IngestError(Exception):
+    """An upload that stopped part way, with the number of rows committed before"""
+
+    def __init__(self, message: str, rows_ingested: int):
+        super().__init__(message)
+        self.rows_ingested = rows_ingested
+
+
+class InvalidFileError(IngestError, ValueError):
+    """An upload whose header or rows could not be parsed"""
+
+
+class AsyncDatabaseHandler:
+    """
+    Awaitable front for a DatabaseHandler. Writes run on one dedicated thread per
+    shard, so each SQLite file has a single serialised writer, while reads run on a
+    pool of reader threads alongside (WAL lets them proceed during a write). Upload
+    parsing runs on its own thread so a long ingest does not hold the event loop or
+    a reader.
+    """
+
+    def __init__(
+        self,
+        handler: Union[DatabaseHandler, ShardedDatabaseHandler],
+        reader_threads: int = DEFAULT_READER_THREADS,
+        parse_processes: Optional[int] = None,
+    ):
+        self.handler = handler
+        self.reader_threads = reader_threads
+        self.parse_processes = parse_processes or os.cpu_count() or 1
+        self._process_pool: Optional["ProcessPoolExecutor"] = None
+        self._writers = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-writer-{shard}")
+            for shard in range(handler.shard_count)
+        ]
+        # Creating individuals also writes to a sharded handler's catalog, which
+        # the first writer serialises
+        self._writer = self._writers[0]
+        self._readers = ThreadPoolExecutor(
+            max_workers=reader_threads, thread_name_prefix="db-reader"
+        )
+        self._parsers = ThreadPoolExecutor(
+            max_workers=reader_threads, thread_name_prefix="db-parser"
+        )
+
+    async def _run(
+        self,
+        executor: ThreadPoolExecutor,
+        fn: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        # The context is carried over so stage timings keep the request's endpoint
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            executor, partial(context.run, fn, *args, **kwargs)
+        )
+
+    def _writer_for(self, individual_id: Optional[str]) -> ThreadPoolExecutor:
+        if individual_id is None or len(self._writers) == 1:
+            return self._writer
+        return self._writers[self.handler.shard_of(individual_id)]
+
+    def _write_in_context(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        individual_id: Optional[str] = None,
+    ) -> Future[Any]:
+        return self._writer_for(individual_id).submit(
+            contextvars.copy_context().run, fn, *args
+        )
+
+    def write(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        individual_id: Optional[str] = None,
+    ) -> Any:
+        """
+        Runs `fn` on the writer of `individual_id`'s shard, or the first writer, and
+        blocks until it returns, for callers off the event loop
+        """
+        return self._write_in_context(fn, *args, individual_id=individual_id).result()
+
+    async def get_all_users(self) -> Any:
+        return await self._run(self._readers, self.handler.get_all_users)
+
+    async def get_users_page(self, *args: Any) -> Any:
+        return await self._run(self._readers, self.handler.get_users_page, *args)
+
+    async def get_users_state(self) -> Any:
+        return await self._run(self._readers, self.handler.get_users_state)
+
+    async def get_id_for_individual_id(self, individual_id: str) -> Any:
+        return await self._run(
+            self._readers, self.handler.get_id_for_individual_id, individual_id
+        )
+
+    async def get_individual_data(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._run(
+            self._readers, self.handler.get_individual_data, *args, **kwargs
+        )
+
+    async def get_individual_rows(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._run(
+            self._readers, self.handler.get_individual_rows, *args, **kwargs
+        )
+
+    async def get_present_variants(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._run(
+            self._readers, self.handler.get_present_variants, *args, **kwargs
+        )
+
+    async def iter_individual_data(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._run(
+            self._readers, self.handler.iter_individual_data, *args, **kwargs
+        )
+
+    async def export_genetic_data(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._run(
+            self._readers, self.handler.export_genetic_data, *args, **kwargs
+        )
+
+    async def get_cohort_summary(self, *args: Any, **kwargs: Any) -> Any:
+        return await self._run(
+            self._readers, self.handler.get_cohort_summary, *args, **kwargs
+        )
+
+    async def cache_stats(self) -> Any:
+        return await self._run(self._readers, self.handler.cache_stats)
+
+    async def pool_stats(self) -> Any:
+        stats = await self._run(self._readers, self.handler.pool_stats)
+        return {
+            **stats,
+            "reader_threads": self.reader_threads,
+            "parse_processes": self.parse_processes,
+        }
+
+    async def insert_new_individual(self, new_individual_id: str) -> Any:
+        return await self._run(
+            self._writer, self.handler.insert_new_individual, new_individual_id
+        )
+
+    async def insert_new_individuals(self, new_individual_ids: List[str]) -> Any:
+        return await self._run(
+            self._writer, self.handler.insert_new_individuals, new_individual_ids
+        )
+
+    async def insert_genetic_rows_to_db(
+        self, rows: List[Tuple[str, str, int, str, str, float]], individual_id: str
+    ) -> Any:
+        return await self._run(
+            self._writer_for(individual_id),
+            self.handler.insert_genetic_rows_to_db,
+            rows,
+            individual_id,
+        )
+
+    def _ingest(
+        self,
+        file_contents: Iterable[str],
+        individual_id: str,
+        batch_size: int,
+        rejected: Optional[Dict[str, Any]] = None,
+    ) -> int:
+        # Keeps one batch in flight on the writer while the next one is parsed.
+        # Given a `rejected` report, bad rows are recorded in it instead of raising
+        batches: Iterable[List[Tuple[str, str, int, str, str, float]]]
+        if rejected is None:
+            batches = file_parser.iter_row_batches(file_contents, batch_size)
+        else:
+            batches = self._reject_errors(
+                file_parser.iter_checked_row_batches(file_contents, batch_size),
+                rejected,
+            )
+        rows_inserted = 0
+        pending: Optional[Future[int]] = None
+        try:
+            try:
+                for rows in self._parse_errors_as_invalid(batches):
+                    if pending:
+                        rows_inserted += pending.result()
+                    pending = self._write_in_context(
+                        self.handler.insert_genetic_rows_to_db,
+                        rows,
+                        individual_id,
+                        individual_id=individual_id,
+                    )
+            except InvalidFileError as e:
+                # The batch before the bad one is still committed, and counted
+                if pending:
+                    rows_inserted += pending.result()
+                self._save_variant_filter(individual_id, rows_inserted)
+                raise InvalidFileError(str(e), rows_inserted) from e.__cause__
+            if pending:
+                rows_inserted += pending.result()
+        except sqlite3.DatabaseError as e:
+            raise IngestError("Failed to insert data", rows_inserted) from e
+        self._save_variant_filter(individual_id, rows_inserted)
+        return rows_inserted
+
+    def _save_variant_filter(self, individual_id: str, rows_inserted: int) -> None:
+        # Queued behind the upload's inserts without waiting, as the response does
+        # not depend on it
+        if rows_inserted:
+            self._write_in_context(
+                self.handler.save_variant_filter,
+                individual_id,
+                individual_id=individual_id,
+            )
+
+    @staticmethod
+    def _parse_errors_as_invalid(batches: Iterable[List[Any]]) -> Iterator[List[Any]]:
+        # Tells errors parsing the file apart from errors committing its rows
+        try:
+            yield from batches
+        except ValueError as e:
+            raise InvalidFileError(str(e), 0) from e
+
+    @staticmethod
+    def _reject_errors(
+        checked_batches: Iterable[Tuple[List[Any], List[Dict[str, Any]]]],
+        rejected: Dict[str, Any],
+    ) -> Iterator[List[Any]]:
+        for rows, errors in checked_batches:
+            rejected["rows_rejected"] += len(errors)
+            room = MAX_REPORTED_ERRORS - len(rejected["errors"])
+            rejected["errors"].extend(errors[:room])
+            if rows:
+                yield rows
+
+    async def ingest_file(
+        self,
+        file_contents: Iterable[str],
+        individual_id: str,
+        batch_size: int = file_parser.DEFAULT_BATCH_SIZE,
+    ) -> int:
+        """
+        Parses and inserts an uploaded file, returning the number of rows inserted.
+        Raises IngestError with the rows already committed if an insert fails, and
+        InvalidFileError if the file cannot be parsed
+        """
+        return await self._run(
+            self._parsers, self._ingest, file_contents, individual_id, batch_size
+        )
+
+    def _ingest_partially(
+        self, file_contents: Iterable[str], individual_id: str, batch_size: int
+    ) -> Dict[str, Any]:
+        rejected: Dict[str, Any] = {"rows_rejected": 0, "errors": []}
+        rows_ingested = self._ingest(file_contents, individual_id, batch_size, rejected)
+        return {"rows_ingested": rows_ingested, **rejected}
+
+    async def ingest_file_partially(
+        self,
+        file_contents: Iterable[str],
+        individual_id: str,
+        batch_size: int = file_parser.DEFAULT_BATCH_SIZE,
+    ) -> Dict[str, Any]:
+        """
+        Parses and inserts the valid rows of an uploaded file, and reports the rows
+        rejected with their line numbers and reasons, so that only corrected rows
+        need to be resubmitted
+        """
+        return await self._run(
+            self._parsers,
+            self._ingest_partially,
+            file_contents,
+            individual_id,
+            batch_size,
+        )
+
+    async def get_upload(self, individual_id: str, content_hash: str) -> Any:
+        return await self._run(
+            self._readers, self.handler.get_upload, individual_id, content_hash
+        )
+
+    async def get_ingest_job(self, job_id: str) -> Any:
+        return await self._run(self._readers, self.handler.get_ingest_job, job_id)
+
+    async def record_upload(self, individual_id: str, *args: Any) -> Any:
+        return await self._run(
+            self._writer_for(individual_id),
+            self.handler.record_upload,
+            individual_id,
+            *args,
+        )
+
+    def _get_process_pool(self) -> "ProcessPoolExecutor":
+        # Spawned rather than forked, as forking a process with running threads
+        # can deadlock the child. Imported here, as only bulk uploads need it
+        if self._process_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.parse_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._process_pool
+
+    def _bulk_ingest(
+        self, uploads: List[Tuple[str, str, Iterable[str]]], batch_size: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Shards the uploads by file and by chunks of `batch_size` lines across the
+        process pool, and commits the parsed chunks from this thread through the
+        single writer in submission order. At most two chunks per process are
+        in flight, which bounds memory.
+        """
+        pool = self._get_process_pool()
+        results = [
+            {"filename": filename, "individual_id": individual_id, "rows_ingested": 0}
+            for filename, individual_id, _ in uploads
+        ]
+        in_flight: Deque[Tuple[Dict[str, Any], Future[Any]]] = deque()
+
+        def commit_oldest() -> None:
+            result, parsed = in_flight.popleft()
+            try:
+                rows = parsed.result()
+            except ValueError as e:
+                result["error"] = str(e)
+                return
+            if "error" not in result:
+                try:
+                    result["rows_ingested"] += self._write_in_context(
+                        self.handler.insert_genetic_rows_to_db,
+                        rows,
+                        result["individual_id"],
+                        individual_id=result["individual_id"],
+                    ).result()
+                except ValueError as e:
+                    result["error"] = str(e)
+                except sqlite3.DatabaseError:
+                    result["error"] = "Failed to insert data"
+
+        for result, (_, individual_id, file_contents) in zip(results, uploads):
+            if not self.handler.get_id_for_individual_id(individual_id):
+                result["error"] = "Individual not found"
+                continue
+            lines = iter(file_contents)
+            try:
+                header_order = file_parser.read_header_order(lines)
+            except ValueError as e:
+                result["error"] = str(e)
+                continue
+            for chunk in file_parser.iter_batches(lines, batch_size):
+                if "error" in result:
+                    break
+                parsed = pool.submit(
+                    file_parser.parse_lines_to_rows, chunk, header_order
+                )
+                in_flight.append((result, parsed))
+                if len(in_flight) >= 2 * self.parse_processes:
+                    commit_oldest()
+        while in_flight:
+            commit_oldest()
+        for result in results:
+            self._save_variant_filter(result["individual_id"], result["rows_ingested"])
+        return results
+
+    async def bulk_ingest(
+        self,
+        uploads: List[Tuple[str, str, Iterable[str]]],
+        batch_size: int = file_parser.DEFAULT_BATCH_SIZE,
+    ) -> List[Dict[str, Any]]:
+        """
+        Ingests several (filename, individual_id, lines) uploads, parsing them in
+        parallel processes, and reports rows ingested or the error for each file
+        """
+        return await self._run(self._parsers, self._bulk_ingest, uploads, batch_size)
+
+    def close(self) -> None:
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True)
+        self._parsers.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        for writer in self._writers:
+            writer.shutdown(wait=True)
+        self.handler.close()
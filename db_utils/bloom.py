@@ -0,0 +1,84 @@
+import math
+import struct
+from hashlib import blake2b
+from typing import Iterable, List
+
+
+class BloomFilter:
+    """
+    Set membership with no false negatives and a bounded rate of false positives.
+    Sized for `capacity` items at `error_rate`, it reports its `count` of added
+    items so that callers can rebuild it larger once it fills up. Positions are
+    32-bit words of one blake2b digest, so a filter can be persisted and read back
+    by another process, and holds at most 16 hashes and 2**32 bits.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        num_hashes: int,
+        bits: bytearray,
+        count: int = 0,
+    ):
+        self.capacity = capacity
+        self.num_hashes = num_hashes
+        self.bits = bits
+        self.num_bits = len(bits) * 8
+        self.count = count
+        self._words = struct.Struct(f"<{num_hashes}I")
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float) -> "BloomFilter":
+        capacity = max(capacity, 1)
+        num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        num_hashes = min(16, max(1, round(num_bits / capacity * math.log(2))))
+        return cls(capacity, num_hashes, bytearray(math.ceil(num_bits / 8)))
+
+    @classmethod
+    def from_bytes(
+        cls, capacity: int, num_hashes: int, bits: bytes, count: int
+    ) -> "BloomFilter":
+        return cls(capacity, num_hashes, bytearray(bits), count)
+
+    def _positions(self, item: str) -> List[int]:
+        digest = blake2b(item.encode(), digest_size=self._words.size).digest()
+        num_bits = self.num_bits
+        return [word % num_bits for word in self._words.unpack(digest)]
+
+    def add(self, item: str) -> bool:
+        """Adds `item`, returning False if it may already have been present"""
+        bits = self.bits
+        added = False
+        for position in self._positions(item):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def update(self, items: Iterable[str]) -> None:
+        # `add` inlined, as filters are built from every row of an individual
+        unpack, size = self._words.unpack, self._words.size
+        bits, num_bits = self.bits, self.num_bits
+        for item in items:
+            added = False
+            for word in unpack(blake2b(item.encode(), digest_size=size).digest()):
+                position = word % num_bits
+                mask = 1 << (position & 7)
+                if not bits[position >> 3] & mask:
+                    bits[position >> 3] |= mask
+                    added = True
+            if added:
+                self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def is_full(self) -> bool:
+        return self.count > self.capacity
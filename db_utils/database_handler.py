@@ -1,42 +1,552 @@
+import json
+import logging
 import os
 import sqlite3
+import threading
+import time
+from collections import Counter
 from configparser import ConfigParser
-from typing import Any, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from ..models.models import AlleleEnum, ChromosomeEnum, GeneticData, User
+from ..models.models import (
+    ALLELE_CODES,
+    CHROMOSOME_CODES,
+    GeneticData,
+    User,
+)
+from ..utils.metrics import metrics
+from ..utils.query_profiler import (
+    DEFAULT_SLOW_LOG_BACKUPS,
+    DEFAULT_SLOW_LOG_MAX_BYTES,
+    ProfilingConnection,
+    query_profiler,
+)
+from .bloom import BloomFilter
+from .cache import MISSING, TTLCache
+
+logger = logging.getLogger(__name__)
+
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+DEFAULT_FETCH_SIZE = 5_000
+
+# Checking an ID against a variant filter costs about as much as probing the index
+# for it, so a filter only pays off by skipping a query's fixed cost on short lists
+VARIANT_FILTER_MAX_IDS = 16
+# Filters are loaded under one of these locks, picked by individual, so concurrent
+# lookups of an individual load their filter once
+VARIANT_FILTER_LOCKS = 64
+
+
+def _encode_sql(column: str, codes: Dict[str, int]) -> str:
+    cases = " ".join(f"WHEN '{value}' THEN {code}" for value, code in codes.items())
+    return f"CASE {column} {cases} END"
+
+
+def _decode_sql(column: str, codes: Dict[str, int]) -> str:
+    cases = " ".join(f"WHEN {code} THEN '{value}'" for value, code in codes.items())
+    return f"CASE {column} {cases} END"
+
+
+# Adds the rows past an id to the summary. NOT INDEXED keeps the planner from
+# grouping through idx_genetic_data_variant, which reads the whole table for every
+# batch, so only the new rows are read by rowid and grouped in a temporary b-tree
+VARIANT_SUMMARY_UPSERT = """
+    INSERT INTO variant_summary (
+        variant_key, row_count, frequency_sum, min_frequency, max_frequency
+    )
+    SELECT
+        variant_key,
+        COUNT(*),
+        SUM(alternate_allele_frequency),
+        MIN(alternate_allele_frequency),
+        MAX(alternate_allele_frequency)
+    FROM genetic_data_table NOT INDEXED
+    WHERE id > ?
+    GROUP BY variant_key
+    ON CONFLICT (variant_key) DO UPDATE SET
+        row_count = row_count + excluded.row_count,
+        frequency_sum = frequency_sum + excluded.frequency_sum,
+        min_frequency = MIN(min_frequency, excluded.min_frequency),
+        max_frequency = MAX(max_frequency, excluded.max_frequency)
+"""
+
+VARIANT_SUMMARY_REBUILD = """
+    INSERT INTO variant_summary (
+        variant_key, row_count, frequency_sum, min_frequency, max_frequency
+    )
+    SELECT
+        variant_key,
+        COUNT(*),
+        SUM(alternate_allele_frequency),
+        MIN(alternate_allele_frequency),
+        MAX(alternate_allele_frequency)
+    FROM genetic_data_table
+    GROUP BY variant_key
+"""
+
+# Recomputes the summary of the variant keys in a JSON array, after their rows change
+VARIANT_SUMMARY_REBUILD_KEYS = """
+    INSERT INTO variant_summary (
+        variant_key, row_count, frequency_sum, min_frequency, max_frequency
+    )
+    SELECT
+        variant_key,
+        COUNT(*),
+        SUM(alternate_allele_frequency),
+        MIN(alternate_allele_frequency),
+        MAX(alternate_allele_frequency)
+    FROM genetic_data_table
+    WHERE variant_key IN (SELECT value FROM json_each(?))
+    GROUP BY variant_key
+"""
+
+# Statements that upgrade the schema to each version, applied in order inside one
+# transaction per version. Version 1 is the original layout created by
+# `initialise_users_table` and `initialise_genetic_data_table`.
+SCHEMA_MIGRATIONS: Dict[int, List[str]] = {
+    2: [
+        # Merge duplicate individuals onto their oldest id so individual_id can be
+        # made unique
+        """
+        UPDATE genetic_data_table
+        SET user_id = (
+            SELECT MIN(duplicate.id)
+            FROM users AS original
+            JOIN users AS duplicate
+                ON duplicate.individual_id = original.individual_id
+            WHERE original.id = genetic_data_table.user_id
+        )
+        WHERE user_id IN (SELECT id FROM users)
+        AND user_id NOT IN (SELECT MIN(id) FROM users GROUP BY individual_id)
+        """,
+        """
+        DELETE FROM users
+        WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY individual_id)
+        """,
+        # Covers the id lookup too, since every index entry carries the rowid
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_users_individual_id
+        ON users (individual_id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_genetic_data_user_variant
+        ON genetic_data_table (
+            user_id,
+            variant_id,
+            chromosome,
+            position,
+            reference_allele,
+            alternate_allele,
+            alternate_allele_frequency
+        )
+        """,
+    ],
+    3: [
+        # Index entries end with the rowid, so this serves keyset pages of one
+        # individual's rows ordered by id without a sort
+        """
+        CREATE INDEX IF NOT EXISTS idx_genetic_data_user
+        ON genetic_data_table (user_id)
+        """,
+    ],
+    4: [
+        """
+        CREATE INDEX IF NOT EXISTS idx_genetic_data_user_position
+        ON genetic_data_table (user_id, chromosome, position)
+        """,
+        # Without statistics the planner prefers the variant index for OR-ed regions
+        "ANALYZE",
+    ],
+    5: [
+        # Each distinct variant is stored once in a shared catalog, with integer
+        # codes for chromosomes and alleles, and an individual's rows only refer to it
+        """
+        CREATE TABLE variants (
+            variant_key INTEGER PRIMARY KEY,
+            variant_id TEXT NOT NULL,
+            chromosome INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            reference_allele INTEGER NOT NULL,
+            alternate_allele INTEGER NOT NULL
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX idx_variants_identity ON variants (
+            variant_id, chromosome, position, reference_allele, alternate_allele
+        )
+        """,
+        "CREATE INDEX idx_variants_position ON variants (chromosome, position)",
+        f"""
+        INSERT OR IGNORE INTO variants (
+            variant_id, chromosome, position, reference_allele, alternate_allele
+        )
+        SELECT
+            variant_id,
+            {_encode_sql("chromosome", CHROMOSOME_CODES)},
+            position,
+            {_encode_sql("reference_allele", ALLELE_CODES)},
+            {_encode_sql("alternate_allele", ALLELE_CODES)}
+        FROM genetic_data_table
+        ORDER BY chromosome, position
+        """,
+        """
+        CREATE TABLE genetic_data_table_v5 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            variant_key INTEGER NOT NULL,
+            alternate_allele_frequency REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (variant_key) REFERENCES variants(variant_key)
+        )
+        """,
+        f"""
+        INSERT INTO genetic_data_table_v5 (
+            id, user_id, variant_key, alternate_allele_frequency
+        )
+        SELECT g.id, g.user_id, v.variant_key, g.alternate_allele_frequency
+        FROM genetic_data_table AS g
+        JOIN variants AS v
+            ON v.variant_id = g.variant_id
+            AND v.chromosome = {_encode_sql("g.chromosome", CHROMOSOME_CODES)}
+            AND v.position = g.position
+            AND v.reference_allele = {_encode_sql("g.reference_allele", ALLELE_CODES)}
+            AND v.alternate_allele = {_encode_sql("g.alternate_allele", ALLELE_CODES)}
+        """,
+        "DROP TABLE genetic_data_table",
+        "ALTER TABLE genetic_data_table_v5 RENAME TO genetic_data_table",
+        """
+        CREATE INDEX idx_genetic_data_user_variant
+        ON genetic_data_table (user_id, variant_key, alternate_allele_frequency)
+        """,
+        "CREATE INDEX idx_genetic_data_user ON genetic_data_table (user_id)",
+        "ANALYZE",
+    ],
+    6: [
+        # Background ingestion jobs. lines_committed counts the data lines whose rows
+        # are committed, so an interrupted job resumes after its last batch.
+        # Times are seconds since the epoch.
+        """
+        CREATE TABLE ingest_jobs (
+            id TEXT PRIMARY KEY,
+            individual_id TEXT NOT NULL,
+            spool_path TEXT NOT NULL,
+            status TEXT CHECK(
+                status IN ('queued', 'running', 'completed', 'failed')
+            ) NOT NULL,
+            lines_committed INTEGER NOT NULL DEFAULT 0,
+            rows_inserted INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            updated_at REAL,
+            finished_at REAL
+        )
+        """,
+        "CREATE INDEX idx_ingest_jobs_status ON ingest_jobs (status)",
+    ],
+    7: [
+        # Cohort queries group by variant, which this covers without the table rows
+        """
+        CREATE INDEX idx_genetic_data_variant
+        ON genetic_data_table (variant_key, alternate_allele_frequency, user_id)
+        """,
+        # Running per-variant totals, kept up to date on insert when enabled
+        """
+        CREATE TABLE variant_summary (
+            variant_key INTEGER PRIMARY KEY,
+            row_count INTEGER NOT NULL,
+            frequency_sum REAL NOT NULL,
+            min_frequency REAL NOT NULL,
+            max_frequency REAL NOT NULL,
+            FOREIGN KEY (variant_key) REFERENCES variants(variant_key)
+        )
+        """,
+        VARIANT_SUMMARY_REBUILD,
+        "ANALYZE",
+    ],
+    8: [
+        # An individual holds each variant once; the earliest row of a duplicate wins.
+        # variant_summary no longer matches afterwards, so it is rebuilt before it is
+        # next read
+        """
+        DELETE FROM genetic_data_table
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM genetic_data_table GROUP BY user_id, variant_key
+        )
+        """,
+        "DROP INDEX idx_genetic_data_user_variant",
+        """
+        CREATE UNIQUE INDEX idx_genetic_data_user_variant
+        ON genetic_data_table (user_id, variant_key)
+        """,
+        # Content hashes of the files already ingested for each individual
+        """
+        CREATE TABLE uploads (
+            user_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            rows_inserted INTEGER NOT NULL,
+            rows_rejected INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (user_id, content_hash),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+        "ALTER TABLE ingest_jobs ADD COLUMN content_hash TEXT",
+        "ANALYZE",
+    ],
+    9: [
+        # Per-individual Bloom filters of variant IDs (see bloom.BloomFilter). Filters
+        # of individuals without a row are built from their data when first needed
+        """
+        CREATE TABLE variant_filters (
+            user_id INTEGER PRIMARY KEY,
+            capacity INTEGER NOT NULL,
+            item_count INTEGER NOT NULL,
+            num_hashes INTEGER NOT NULL,
+            bits BLOB NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+    ],
+    10: [
+        # Filters record the last row they cover and are topped up with later rows,
+        # rather than rewritten by every insert. Until now every insert updated its
+        # individual's filter, so stored filters cover all of their rows
+        "ALTER TABLE variant_filters ADD COLUMN max_row_id INTEGER NOT NULL DEFAULT 0",
+        """
+        UPDATE variant_filters SET max_row_id = COALESCE((
+            SELECT MAX(id) FROM genetic_data_table
+            WHERE user_id = variant_filters.user_id
+        ), 0)
+        """,
+    ],
+}
+SCHEMA_VERSION = max(SCHEMA_MIGRATIONS)
+
+INGEST_JOB_UPDATABLE_COLUMNS = {"status", "error", "started_at", "finished_at"}
+
+MAX_REGIONS = 200
+MAX_POSITION = 2**63 - 1
+
+GENETIC_DATA_COLUMNS = (
+    "variant_id",
+    "chromosome",
+    "position",
+    "reference_allele",
+    "alternate_allele",
+    "alternate_allele_frequency",
+)
+
+# How each column is read from genetic_data_table (g) joined to variants (v)
+GENETIC_DATA_SELECT = {
+    "variant_id": "v.variant_id",
+    "chromosome": _decode_sql("v.chromosome", CHROMOSOME_CODES),
+    "position": "v.position",
+    "reference_allele": _decode_sql("v.reference_allele", ALLELE_CODES),
+    "alternate_allele": _decode_sql("v.alternate_allele", ALLELE_CODES),
+    "alternate_allele_frequency": "g.alternate_allele_frequency",
+}
+
+# Per-variant columns of a cohort summary, after those identifying the variant
+COHORT_COLUMNS = (
+    "count",
+    "mean_frequency",
+    "min_frequency",
+    "max_frequency",
+)
+
+
+def parse_regions(region: str) -> List[Tuple[str, int, int]]:
+    """
+    Parses regions such as "1:100000-250000,X:5000-6000" into
+    (chromosome, start, end) tuples. A bare chromosome covers all of it.
+    """
+    regions = []
+    for part in region.split(","):
+        chromosome, _, span = part.strip().partition(":")
+        if chromosome not in CHROMOSOME_CODES:
+            raise ValueError(f"Unsupported chromosome in region: {part}")
+        try:
+            start, end = map(int, span.split("-")) if span else (0, MAX_POSITION)
+        except ValueError:
+            raise ValueError(f"Invalid region, expected chromosome:start-end: {part}")
+        if start > end:
+            raise ValueError(f"Region start is after its end: {part}")
+        regions.append((chromosome, start, end))
+
+    if len(regions) > MAX_REGIONS:
+        raise ValueError(f"At most {MAX_REGIONS} regions can be queried at once")
+    return regions
+
+
+def _region_filter(region: str) -> Tuple[str, List[Any]]:
+    # Conditions on variants (v), which idx_variants_position serves as a multi-index OR
+    regions = parse_regions(region)
+    conditions = " OR ".join(
+        "(v.chromosome = ? AND v.position BETWEEN ? AND ?)" for _ in regions
+    )
+    args: List[Any] = []
+    for chromosome, start, end in regions:
+        args.extend((CHROMOSOME_CODES[chromosome], start, end))
+    return f" AND ({conditions})", args
+
+
+def load_config(config_file: str) -> ConfigParser:
+    config = ConfigParser()
+    if not os.path.exists(config_file):
+        raise FileNotFoundError(f"Configuration file {config_file} not found.")
+    config.read(config_file)
+    return config
 
 
 class DatabaseHandler:
-    def __init__(self, config_file: str):
+    # One database file is a single shard, so all of its writes share one writer.
+    # See ShardedDatabaseHandler for individuals spread over several files
+    shard_count = 1
+
+    def __init__(self, config_file: str, db_path: Optional[str] = None):
         if not config_file:
             raise Exception("No Config file provided")
         self.config: ConfigParser = self._load_config(config_file)
-        self.db_path: str = self.config.get("database", "db_path")
+        self.db_path: str = db_path or self.config.get("database", "db_path")
 
         if not self.db_path:
             raise ValueError("Database path not specified in the config file.")
 
+        self.synchronous: str = self.config.get(
+            "database", "synchronous", fallback="NORMAL"
+        ).upper()
+        if self.synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unsupported synchronous mode: {self.synchronous}")
+        self.cache_size: int = self.config.getint(
+            "database", "cache_size", fallback=-64000
+        )
+        self.mmap_size: int = self.config.getint(
+            "database", "mmap_size", fallback=268435456
+        )
+
         db_dir = os.path.dirname(self.db_path)
         if not os.path.exists(db_dir):
             os.makedirs(db_dir)
 
+        # individual_id -> users.id, and whole results of get_individual_data
+        self._id_cache = TTLCache(
+            self.config.getint("cache", "id_cache_size", fallback=10_000),
+            self.config.getfloat("cache", "id_cache_ttl", fallback=300),
+        )
+        self._data_cache = TTLCache(
+            self.config.getint("cache", "data_cache_size", fallback=256),
+            self.config.getfloat("cache", "data_cache_ttl", fallback=60),
+        )
+        # Bumped for an individual whenever their rows or id change, so a result
+        # read while a write committed is not cached after the write's invalidation
+        self._individual_generations: Dict[str, int] = {}
+        self._individual_generations_lock = threading.Lock()
+        # Count and largest id of users, the version of the individuals listing
+        self._users_state_cache = TTLCache(
+            1, self.config.getfloat("cache", "users_state_ttl", fallback=60)
+        )
+        # Larger results are not cached so the cache's memory stays bounded
+        self.max_cached_rows: int = self.config.getint(
+            "cache", "max_cached_rows", fallback=50_000
+        )
+
+        # Whether inserts keep variant_summary up to date for cohort queries
+        self.variant_summary: bool = self.config.getboolean(
+            "cohort", "variant_summary", fallback=True
+        )
+        self._variant_summary_synced = False
+        self._variant_summary_lock = threading.Lock()
+
+        # Bloom filters of each individual's variant IDs, which let lookups skip
+        # the query for IDs the individual definitely does not have
+        self.variant_filter: bool = self.config.getboolean(
+            "variant_filter", "enabled", fallback=True
+        )
+        self.variant_filter_error_rate: float = self.config.getfloat(
+            "variant_filter", "error_rate", fallback=0.01
+        )
+        self.variant_filter_min_capacity: int = self.config.getint(
+            "variant_filter", "min_capacity", fallback=10_000
+        )
+        self._variant_filters = TTLCache(
+            self.config.getint("variant_filter", "cache_size", fallback=1_024),
+            self.config.getfloat("variant_filter", "cache_ttl", fallback=300),
+        )
+        # Bumped for an individual whenever rows are committed for them, so a filter
+        # loaded while an insert committed is not cached
+        self._variant_filter_generations: Dict[int, int] = {}
+        self._variant_filters_lock = threading.Lock()
+        self._variant_filter_locks = [
+            threading.Lock() for _ in range(VARIANT_FILTER_LOCKS)
+        ]
+
+        # Opt-in timing of every statement, with plans of the slow ones
+        self.profile_queries: bool = self.config.getboolean(
+            "profiling", "enabled", fallback=False
+        )
+        if self.profile_queries:
+            profiling = self.config["profiling"]
+            query_profiler.configure(
+                threshold=profiling.getfloat("slow_query_ms", fallback=100) / 1000,
+                slow_log_path=profiling.get("slow_log", fallback=None),
+                max_bytes=profiling.getint(
+                    "slow_log_max_bytes", fallback=DEFAULT_SLOW_LOG_MAX_BYTES
+                ),
+                backups=profiling.getint(
+                    "slow_log_backups", fallback=DEFAULT_SLOW_LOG_BACKUPS
+                ),
+            )
+
+        # One persistent connection per thread, tracked so `close` can release them
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
         self._initialise_tables_if_not_exist()
 
     def _load_config(self, config_file: str) -> ConfigParser:
-        config = ConfigParser()
-        if not os.path.exists(config_file):
-            raise FileNotFoundError(f"Configuration file {config_file} not found.")
-        config.read(config_file)
-        return config
+        return load_config(config_file)
+
+    def _new_connection(self) -> sqlite3.Connection:
+        with metrics.stage("db_connect"):
+            conn = sqlite3.connect(
+                self.db_path,
+                check_same_thread=False,
+                factory=(
+                    ProfilingConnection if self.profile_queries else sqlite3.Connection
+                ),
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute(f"PRAGMA cache_size={self.cache_size}")
+            conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
 
     def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
+        conn: Optional[sqlite3.Connection] = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._new_connection()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
         return conn
 
     def _close(self, conn: sqlite3.Connection) -> None:
-        if conn:
+        # The calling thread's connection is kept open for reuse until `close`
+        if conn and conn is not getattr(self._local, "conn", None):
             conn.close()
 
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.execute("PRAGMA optimize")
+                conn.close()
+            self._connections = []
+            self._local = threading.local()
+
     def initialise_genetic_data_table(
         self, conn: sqlite3.Connection, cursor: sqlite3.Cursor
     ) -> None:
@@ -58,7 +568,7 @@ class DatabaseHandler:
             cursor.execute(create_table_query)
             conn.commit()
         except sqlite3.DatabaseError as e:
-            print(f"Error executing query: {e}")
+            logger.error("Error executing query: %s", e)
             conn.rollback()
 
     def initialise_users_table(
@@ -76,16 +586,116 @@ class DatabaseHandler:
             cursor.execute(create_table_query)
             conn.commit()
         except sqlite3.DatabaseError as e:
-            print(f"Error executing query: {e}")
+            logger.error("Error executing query: %s", e)
             conn.rollback()
 
+    def initialise_schema_migrations_table(
+        self, conn: sqlite3.Connection, cursor: sqlite3.Cursor
+    ) -> None:
+        create_table_query = """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+
+        try:
+            cursor.execute(create_table_query)
+            conn.commit()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+
+    def get_schema_version(self) -> int:
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT MAX(version) FROM schema_migrations")
+            version = cursor.fetchone()[0]
+        finally:
+            self._close(conn)
+        return version or 0
+
+    def _apply_migration(
+        self, conn: sqlite3.Connection, cursor: sqlite3.Cursor, version: int
+    ) -> None:
+        try:
+            cursor.execute("BEGIN")
+            for statement in SCHEMA_MIGRATIONS.get(version, []):
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version) VALUES (?)", (version,)
+            )
+            conn.commit()
+        except sqlite3.DatabaseError as e:
+            conn.rollback()
+            raise RuntimeError(f"Schema migration to version {version} failed") from e
+
+    def _stored_schema_version(self, cursor: sqlite3.Cursor) -> int:
+        # 0 for a new database, which has no schema_migrations table yet
+        try:
+            cursor.execute("SELECT MAX(version) FROM schema_migrations")
+        except sqlite3.OperationalError:
+            return 0
+        return cursor.fetchone()[0] or 0
+
     def _initialise_tables_if_not_exist(self) -> None:
         conn = self._connect()
         cursor = conn.cursor()
 
+        # An up to date database needs no DDL, so opening it is a single query
+        if self._stored_schema_version(cursor) == SCHEMA_VERSION:
+            self.schema_version = SCHEMA_VERSION
+            self._close(conn)
+            return
+
+        self.initialise_schema_migrations_table(conn, cursor)
         self.initialise_users_table(conn, cursor)
         self.initialise_genetic_data_table(conn, cursor)
-        conn.close()
+
+        current_version = self.get_schema_version()
+        for version in range(current_version + 1, SCHEMA_VERSION + 1):
+            self._apply_migration(conn, cursor, version)
+
+        self.schema_version = self.get_schema_version()
+        logger.info(
+            "Database %s running schema version %s", self.db_path, self.schema_version
+        )
+        self._close(conn)
+
+    def _sync_variant_summary(self) -> None:
+        # Rows inserted while the summary was disabled leave it behind, so it is
+        # rebuilt if its totals no longer match the data. Counting every row is slow
+        # on a large database, so this runs once, before the first summary read
+        if self._variant_summary_synced:
+            return
+        with self._variant_summary_lock:
+            if self._variant_summary_synced:
+                return
+            conn = self._connect()
+            try:
+                self._rebuild_variant_summary_if_behind(conn, conn.cursor())
+            finally:
+                self._close(conn)
+            self._variant_summary_synced = True
+
+    def _rebuild_variant_summary_if_behind(
+        self, conn: sqlite3.Connection, cursor: sqlite3.Cursor
+    ) -> None:
+        cursor.execute("SELECT COALESCE(SUM(row_count), 0) FROM variant_summary")
+        summarised = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM genetic_data_table")
+        if cursor.fetchone()[0] == summarised:
+            return
+        logger.info("Rebuilding variant_summary")
+        try:
+            cursor.execute("BEGIN")
+            cursor.execute("DELETE FROM variant_summary")
+            cursor.execute(VARIANT_SUMMARY_REBUILD)
+            conn.commit()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
 
     def get_all_users(self) -> Optional[List[User]]:
         conn = self._connect()
@@ -94,92 +704,715 @@ class DatabaseHandler:
         fetch_all_users_query = """
             SELECT individual_id, id, created_at FROM users
         """
+        users: List[User] = []
 
         try:
-            cursor.execute(fetch_all_users_query)
+            with metrics.stage("query"):
+                cursor.execute(fetch_all_users_query)
+                rows = cursor.fetchall()
             users = [
-                User(username=row[0], id=row[1], date_created=row[2])
-                for row in cursor.fetchall()
+                User(username=row[0], id=row[1], date_created=row[2]) for row in rows
             ]
             # Convert each row to an instance of the User class
         except sqlite3.DatabaseError as e:
-            print(f"Error executing query: {e}")
+            logger.error("Error executing query: %s", e)
             conn.rollback()
         finally:
             self._close(conn)
 
         return None if not users else users
 
+    def get_users_page(
+        self, limit: int, after: Optional[int] = None
+    ) -> Optional[Tuple[List[User], Optional[int]]]:
+        """
+        Returns up to `limit` users in id order after the id `after`, and the id to
+        pass as `after` for the next page (None on the last page), or None if the
+        query failed
+        """
+        fetch_users_page = """
+            SELECT individual_id, id, created_at FROM users
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        """
+        conn = self._connect()
+        try:
+            with metrics.stage("query"):
+                rows = conn.execute(fetch_users_page, (after or 0, limit)).fetchall()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+            return None
+        finally:
+            self._close(conn)
+
+        users = [User(username=row[0], id=row[1], date_created=row[2]) for row in rows]
+        next_cursor = rows[-1][1] if len(rows) == limit else None
+        return users, next_cursor
+
+    def get_users_state(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns the number of users and their largest id, or None if the query
+        failed. Ids are never reused, so the pair changes whenever an individual is
+        added. Cached until this handler adds an individual or the TTL expires.
+        """
+        cached = self._users_state_cache.get("users")
+        if cached is not MISSING:
+            return cached
+
+        conn = self._connect()
+        try:
+            with metrics.stage("query"):
+                count, last_id = conn.execute(
+                    "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM users"
+                ).fetchone()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+            return None
+        finally:
+            self._close(conn)
+        self._users_state_cache.set("users", (count, last_id))
+        return count, last_id
+
+    def shard_of(self, individual_id: str) -> int:
+        return 0
+
+    def pool_stats(self) -> Dict[str, int]:
+        with self._connections_lock:
+            return {"open_connections": len(self._connections)}
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            "individual_ids": self._id_cache.stats(),
+            "genetic_data": self._data_cache.stats(),
+        }
+
+    def _individual_generation(self, individual_id: str) -> int:
+        with self._individual_generations_lock:
+            return self._individual_generations.get(individual_id, 0)
+
+    def _cache_individual(
+        self, individual_id: str, cache: TTLCache, key: Any, value: Any, generation: int
+    ) -> None:
+        # Only if nothing was committed for the individual since it was read
+        with self._individual_generations_lock:
+            if self._individual_generations.get(individual_id, 0) == generation:
+                cache.set(key, value)
+
+    def _invalidate_individual(self, individual_id: str) -> None:
+        with self._individual_generations_lock:
+            generations = self._individual_generations
+            generations[individual_id] = generations.get(individual_id, 0) + 1
+            self._id_cache.discard(individual_id)
+            self._data_cache.discard_where(lambda key: key[0] == individual_id)
+
     def get_id_for_individual_id(self, individual_id: str) -> Optional[str]:
+        cached_id = self._id_cache.get(individual_id)
+        if cached_id is not MISSING:
+            return cached_id
+
+        generation = self._individual_generation(individual_id)
         conn = self._connect()
         cursor = conn.cursor()
 
         fetch_user_id = """
             SELECT id FROM users WHERE individual_id = ?
         """
+        id = None
         try:
-            cursor.execute(fetch_user_id, (individual_id,))
-            id = cursor.fetchone()
+            with metrics.stage("query"):
+                cursor.execute(fetch_user_id, (individual_id,))
+                id = cursor.fetchone()
         except sqlite3.DatabaseError as e:
-            print(f"Error executing query: {e}")
+            logger.error("Error executing query: %s", e)
             conn.rollback()
-            conn.close()
-        return None if not id else id[0]
+        finally:
+            self._close(conn)
+        if not id:
+            return None
+        self._cache_individual(
+            individual_id, self._id_cache, individual_id, id[0], generation
+        )
+        return id[0]
+
+    def _new_variant_filter(self, variant_ids: List[str]) -> BloomFilter:
+        # Sized with room to grow, so it is not rebuilt on every upload
+        variant_filter = BloomFilter.for_capacity(
+            max(self.variant_filter_min_capacity, 2 * len(variant_ids)),
+            self.variant_filter_error_rate,
+        )
+        variant_filter.update(variant_ids)
+        return variant_filter
+
+    def _read_variant_filter(
+        self, cursor: sqlite3.Cursor, user_id: int
+    ) -> Tuple[BloomFilter, int]:
+        """
+        Returns the individual's stored filter topped up with the rows added since
+        it was stored, or built from all of their rows if there is none or it is
+        full, with the largest row id it covers
+        """
+        cursor.execute(
+            """
+            SELECT capacity, num_hashes, bits, item_count, max_row_id
+            FROM variant_filters WHERE user_id = ?
+            """,
+            (user_id,),
+        )
+        stored = cursor.fetchone()
+        max_row_id = stored[4] if stored else 0
+        variant_ids, max_row_id = self._variant_ids_since(cursor, user_id, max_row_id)
+        if stored:
+            variant_filter = BloomFilter.from_bytes(*stored[:4])
+            variant_filter.update(variant_ids)
+            if not variant_filter.is_full():
+                return variant_filter, max_row_id
+            variant_ids, max_row_id = self._variant_ids_since(cursor, user_id, 0)
+        return self._new_variant_filter(variant_ids), max_row_id
+
+    def _variant_ids_since(
+        self, cursor: sqlite3.Cursor, user_id: int, after: int
+    ) -> Tuple[List[str], int]:
+        # Variant IDs of the individual's rows past row id `after`, and the largest
+        # row id among them
+        cursor.execute(
+            """
+            SELECT g.id, v.variant_id
+            FROM genetic_data_table AS g
+            JOIN variants AS v ON v.variant_key = g.variant_key
+            WHERE g.user_id = ? AND g.id > ?
+            """,
+            (user_id, after),
+        )
+        rows = cursor.fetchall()
+        return [row[1] for row in rows], max((row[0] for row in rows), default=after)
+
+    def _cache_variant_filter(
+        self, user_id: int, variant_filter: BloomFilter, generation: int
+    ) -> None:
+        # Only if no rows were committed for the individual since it was loaded
+        with self._variant_filters_lock:
+            if self._variant_filter_generations.get(user_id, 0) == generation:
+                self._variant_filters.set(user_id, variant_filter)
+
+    def _variant_filter_generation(self, user_id: int) -> int:
+        with self._variant_filters_lock:
+            return self._variant_filter_generations.get(user_id, 0)
+
+    def _invalidate_variant_filter(self, user_id: int) -> None:
+        with self._variant_filters_lock:
+            generations = self._variant_filter_generations
+            generations[user_id] = generations.get(user_id, 0) + 1
+            self._variant_filters.discard(user_id)
+
+    def _get_variant_filter(self, user_id: int) -> Optional[BloomFilter]:
+        """Returns the individual's variant filter, or None if it can't be read"""
+        variant_filter = self._variant_filters.get(user_id)
+        if variant_filter is not MISSING:
+            return variant_filter
+        with self._variant_filter_locks[user_id % VARIANT_FILTER_LOCKS]:
+            variant_filter = self._variant_filters.get(user_id)
+            if variant_filter is not MISSING:
+                return variant_filter
+            generation = self._variant_filter_generation(user_id)
+            conn = self._connect()
+            try:
+                with metrics.stage("query"):
+                    variant_filter, _ = self._read_variant_filter(
+                        conn.cursor(), user_id
+                    )
+            except sqlite3.DatabaseError as e:
+                logger.error("Error executing query: %s", e)
+                conn.rollback()
+                return None
+            finally:
+                self._close(conn)
+            # Rows committed while it loaded may be missing from it, which is
+            # fine for this lookup, which began before them, but not for later ones
+            self._cache_variant_filter(user_id, variant_filter, generation)
+            return variant_filter
+
+    def save_variant_filter(self, individual_id: str) -> None:
+        """
+        Stores the individual's variant filter with the rows added since it was
+        last stored. Called once at the end of an upload, so inserts themselves
+        do not hash variant IDs or rewrite the filter.
+        """
+        if not self.variant_filter:
+            return
+        id = self.get_id_for_individual_id(individual_id)
+        if not id:
+            return
+        generation = self._variant_filter_generation(id)
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            with metrics.stage("insert"):
+                variant_filter, max_row_id = self._read_variant_filter(cursor, id)
+                cursor.execute(
+                    """
+                    INSERT OR REPLACE INTO variant_filters (
+                        user_id, capacity, item_count, num_hashes, bits, max_row_id
+                    ) VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        id,
+                        variant_filter.capacity,
+                        variant_filter.count,
+                        variant_filter.num_hashes,
+                        bytes(variant_filter.bits),
+                        max_row_id,
+                    ),
+                )
+                conn.commit()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+            return
+        finally:
+            self._close(conn)
+        self._cache_variant_filter(id, variant_filter, generation)
+
+    def _may_hold_any(self, user_id: int, variants: str) -> bool:
+        """
+        Whether the individual may hold any of the comma separated `variants`. False
+        means none of them can match, so the query can be skipped. Lists longer than
+        VARIANT_FILTER_MAX_IDS are always queried.
+        """
+        variant_ids = variants.split(",")
+        if not self.variant_filter or len(variant_ids) > VARIANT_FILTER_MAX_IDS:
+            return True
+        variant_filter = self._get_variant_filter(user_id)
+        if variant_filter is None:
+            return True
+        may_hold = any(variant_id in variant_filter for variant_id in variant_ids)
+        metrics.inc(
+            "sano_variant_filter_total", result="queried" if may_hold else "skipped"
+        )
+        return may_hold
+
+    def _select_columns(self, fields: Optional[str]) -> Tuple[str, ...]:
+        if not fields:
+            return GENETIC_DATA_COLUMNS
+        columns = tuple(field.strip() for field in fields.split(","))
+        unknown = set(columns) - set(GENETIC_DATA_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown fields requested: {sorted(unknown)}")
+        return columns
+
+    def _genetic_data_query(
+        self,
+        user_id: int,
+        variants: Optional[str] = None,
+        columns: Tuple[str, ...] = GENETIC_DATA_COLUMNS,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+        region: Optional[str] = None,
+    ) -> Tuple[str, Tuple[Any, ...]]:
+        # Paginated queries also select the row id, which is the keyset cursor
+        select_columns = [GENETIC_DATA_SELECT[column] for column in columns]
+        if limit:
+            select_columns.insert(0, "g.id")
+        fetch_genetic_data = f"""
+            SELECT {", ".join(select_columns)}
+            FROM genetic_data_table AS g
+            JOIN variants AS v ON v.variant_key = g.variant_key
+            WHERE g.user_id = ?
+        """
+        args: List[Any] = [user_id]
+
+        if variants:
+            # Passed as one JSON array so long lists don't hit the bound variable limit
+            fetch_genetic_data += """
+                AND g.variant_key IN (
+                    SELECT variant_key FROM variants
+                    WHERE variant_id IN (SELECT value FROM json_each(?))
+                )
+            """
+            args.append(json.dumps(variants.split(",")))
+
+        if region:
+            region_conditions, region_args = _region_filter(region)
+            fetch_genetic_data += region_conditions
+            args.extend(region_args)
+
+        if after is not None:
+            fetch_genetic_data += " AND g.id > ?"
+            args.append(after)
+
+        if limit:
+            fetch_genetic_data += " ORDER BY g.id LIMIT ?"
+            args.append(limit)
+
+        return fetch_genetic_data, tuple(args)
 
     def get_individual_data(
-        self, individual_id: str, variants: Optional[str] = None
+        self,
+        individual_id: str,
+        variants: Optional[str] = None,
+        fields: Optional[str] = None,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+        region: Optional[str] = None,
     ) -> Optional[Any]:
+        """
+        Returns an individual's genetic data as GeneticData, or as dicts of the
+        requested `fields` only, optionally restricted to variant IDs and/or regions
+        (see `parse_regions`). With a `limit` one keyset page is returned instead,
+        as {"data": [...], "next_cursor": <id to pass as `after`, or None>}.
+        Results are cached until the individual's data changes or the TTL expires.
+        """
+        columns = self._select_columns(fields)
+        cache_key = (individual_id, variants, fields, limit, after, region)
+        cached = self._data_cache.get(cache_key)
+        if cached is not MISSING:
+            return cached
+
+        generation = self._individual_generation(individual_id)
+        id = self.get_id_for_individual_id(individual_id)
+        if not id:
+            return "User not found"
+
+        fetched = self._fetch_individual_rows(
+            id, variants, columns, limit, after, region
+        )
+        records, next_cursor = fetched or ([], None)
+        with metrics.stage("serialize"):
+            if fields:
+                genetic_data = [dict(zip(columns, record)) for record in records]
+            else:
+                # Rows were validated on insert, so they are not checked again
+                genetic_data = [GeneticData.from_row(record) for record in records]
+
+        result: Any = genetic_data
+        if limit:
+            result = {"data": genetic_data, "next_cursor": next_cursor}
+        if fetched and len(records) <= self.max_cached_rows:
+            self._cache_individual(
+                individual_id, self._data_cache, cache_key, result, generation
+            )
+        return result
+
+    def get_individual_rows(
+        self,
+        individual_id: str,
+        variants: Optional[str] = None,
+        fields: Optional[str] = None,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+        region: Optional[str] = None,
+    ) -> Optional[Tuple[Tuple[str, ...], List[Tuple[Any, ...]], Optional[int]]]:
+        """
+        Takes the arguments of `get_individual_data` and returns the column names,
+        the rows as tuples and the next cursor (None unless paginating and more rows
+        follow), or None if the individual does not exist. Cached like
+        `get_individual_data`, for serialisers that need no objects.
+        """
+        columns = self._select_columns(fields)
+        cache_key = (individual_id, variants, fields, limit, after, region, "rows")
+        cached = self._data_cache.get(cache_key)
+        if cached is not MISSING:
+            return cached
+
+        generation = self._individual_generation(individual_id)
+        id = self.get_id_for_individual_id(individual_id)
+        if not id:
+            return None
+
+        fetched = self._fetch_individual_rows(
+            id, variants, columns, limit, after, region
+        )
+        records, next_cursor = fetched or ([], None)
+        result = (columns, records, next_cursor)
+        if fetched and len(records) <= self.max_cached_rows:
+            self._cache_individual(
+                individual_id, self._data_cache, cache_key, result, generation
+            )
+        return result
+
+    def _fetch_individual_rows(
+        self,
+        user_id: int,
+        variants: Optional[str],
+        columns: Tuple[str, ...],
+        limit: Optional[int],
+        after: Optional[int],
+        region: Optional[str],
+    ) -> Optional[Tuple[List[Tuple[Any, ...]], Optional[int]]]:
+        # Returns the rows and next cursor, or None if the query failed
+        if variants and not self._may_hold_any(user_id, variants):
+            return [], None
+        fetch_genetic_data, args = self._genetic_data_query(
+            user_id, variants, columns, limit, after, region
+        )
         conn = self._connect()
-        cursor = conn.cursor()
+        try:
+            with metrics.stage("query"):
+                rows = conn.execute(fetch_genetic_data, args).fetchall()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+            return None
+        finally:
+            self._close(conn)
+        metrics.inc("sano_rows_total", len(rows), kind="read")
 
+        if not limit:
+            return rows, None
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return [row[1:] for row in rows], next_cursor
+
+    def iter_individual_data(
+        self,
+        individual_id: str,
+        variants: Optional[str] = None,
+        batch_size: int = DEFAULT_FETCH_SIZE,
+        fields: Optional[str] = None,
+        region: Optional[str] = None,
+    ) -> Optional[Iterator[List[Tuple[Any, ...]]]]:
+        """
+        Returns a generator of row batches of at most `batch_size` for an individual,
+        or None if the individual does not exist
+        """
+        columns = self._select_columns(fields)
         id = self.get_id_for_individual_id(individual_id)
+        if not id:
+            return None
 
-        variants_list = None
-        if variants:
-            variants_list = variants.split(",")
+        if variants and not self._may_hold_any(id, variants):
+            return iter(())
+        fetch_genetic_data, args = self._genetic_data_query(
+            id, variants, columns, region=region
+        )
+        return self._iter_query_batches(fetch_genetic_data, args, batch_size)
 
-        if id:
-            fetch_genetic_data = """
-                SELECT
-                    variant_id,
-                    chromosome,
-                    position,
-                    reference_allele,
-                    alternate_allele,
-                    alternate_allele_frequency
-                FROM genetic_data_table
-                WHERE user_id = ?
-            """
-            args = [id]
+    def get_present_variants(
+        self, individual_id: str, variants: str
+    ) -> Optional[Dict[str, bool]]:
+        """
+        Returns whether the individual holds each of the comma separated `variants`,
+        as {variant_id: bool}, or None if the individual does not exist. When the
+        variant filter rules all of them out there is no query.
+        """
+        id = self.get_id_for_individual_id(individual_id)
+        if not id:
+            return None
 
-            if variants_list:
-                placeholders = ", ".join("?" for _ in variants_list)
-                fetch_genetic_data += f"AND variant_id IN ({placeholders})"
-                args.extend(variants_list)
+        variant_ids = variants.split(",")
+        present = dict.fromkeys(variant_ids, False)
+        if not self._may_hold_any(id, variants):
+            return present
 
+        fetch_present_variants = """
+            SELECT v.variant_id
+            FROM variants AS v
+            WHERE v.variant_id IN (SELECT value FROM json_each(?))
+            AND EXISTS (
+                SELECT 1 FROM genetic_data_table AS g
+                WHERE g.user_id = ? AND g.variant_key = v.variant_key
+            )
+        """
+        conn = self._connect()
+        try:
+            with metrics.stage("query"):
+                rows = conn.execute(
+                    fetch_present_variants,
+                    (json.dumps(variant_ids), id),
+                ).fetchall()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+            return None
+        finally:
+            self._close(conn)
+        for (variant_id,) in rows:
+            present[variant_id] = True
+        return present
+
+    def export_genetic_data(
+        self,
+        individual_ids: Optional[List[str]] = None,
+        batch_size: int = DEFAULT_FETCH_SIZE,
+    ) -> Optional[Tuple[Dict[int, str], Iterator[List[Tuple[Any, ...]]]]]:
+        """
+        Returns {users.id: individual_id} for the exported individuals and a generator
+        of row batches (user_id, variant_id, chromosome, position, reference_allele,
+        alternate_allele, alternate_allele_frequency), with the chromosome and alleles
+        left as their integer codes. Exports every individual when `individual_ids`
+        is None, and returns None if any of them does not exist.
+        """
+        fetch_genetic_data = """
+            SELECT
+                g.user_id,
+                v.variant_id,
+                v.chromosome,
+                v.position,
+                v.reference_allele,
+                v.alternate_allele,
+                g.alternate_allele_frequency
+            FROM genetic_data_table AS g
+            JOIN variants AS v ON v.variant_key = g.variant_key
+        """
+        args: Tuple[Any, ...] = ()
+        conn = None
+
+        if individual_ids is None:
+            # Everyone is listed in the read transaction the rows are then streamed
+            # from, so rows of an individual created in between are not exported
+            # without them
+            conn = self._new_connection()
             try:
-                cursor.execute(fetch_genetic_data, tuple(args))
-                print(cursor.rowcount)
-                genetic_data = [
-                    GeneticData(
-                        variant_id=row[0],
-                        chromosome=ChromosomeEnum(row[1]),
-                        position=row[2],
-                        reference_allele=AlleleEnum(row[3]),
-                        alternate_allele=AlleleEnum(row[4]),
-                        alternate_allele_frequency=row[5],
+                with metrics.stage("query"):
+                    conn.execute("BEGIN")
+                    individuals = dict(
+                        conn.execute("SELECT id, individual_id FROM users").fetchall()
                     )
-                    for row in cursor.fetchall()
-                ]
             except sqlite3.DatabaseError as e:
-                print(f"Error executing query: {e}")
-                conn.rollback()
-            finally:
+                logger.error("Error executing query: %s", e)
                 conn.close()
+                raise
+        else:
+            individuals = {}
+            for individual_id in individual_ids:
+                id = self.get_id_for_individual_id(individual_id)
+                if not id:
+                    return None
+                individuals[id] = individual_id
+            fetch_genetic_data += """
+                WHERE g.user_id IN (SELECT value FROM json_each(?))
+                ORDER BY g.user_id
+            """
+            args = (json.dumps(list(individuals)),)
+
+        return individuals, self._iter_query_batches(
+            fetch_genetic_data, args, batch_size, conn
+        )
+
+    def _iter_query_batches(
+        self,
+        query: str,
+        args: Tuple[Any, ...],
+        batch_size: int,
+        conn: Optional[sqlite3.Connection] = None,
+    ) -> Iterator[List[Tuple[Any, ...]]]:
+        # A dedicated connection, as a streaming response may resume on any thread.
+        # One passed in, perhaps inside a read transaction, is closed like it
+        conn = conn or self._new_connection()
+        try:
+            with metrics.stage("query"):
+                cursor = conn.execute(query, args)
+            while True:
+                with metrics.stage("query"):
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                metrics.inc("sano_rows_total", len(rows), kind="read")
+                yield rows
+        except sqlite3.DatabaseError as e:
+            # Raised on, so a streamed response is aborted rather than cut short
+            # into a well-formed but truncated body
+            logger.error("Error executing query: %s", e)
+            raise
+        finally:
+            conn.close()
 
-            return genetic_data
+    def get_cohort_summary(
+        self,
+        variants: Optional[str] = None,
+        region: Optional[str] = None,
+        carrier_threshold: Optional[float] = None,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Any:
+        """
+        Aggregates alternate_allele_frequency across every individual, one dict per
+        variant with its count, mean, min and max, optionally restricted to variant
+        IDs and/or regions. With a `carrier_threshold` each variant also reports the
+        number of individuals whose frequency is above it. With a `limit` one page is
+        returned as {"data": [...], "next_cursor": ...}, as in `get_individual_data`.
+        Plain aggregates are read from variant_summary when it is maintained; the
+        rest run as one grouped query over idx_genetic_data_variant.
+        """
+        identity_columns = GENETIC_DATA_COLUMNS[:-1]
+        select_columns = ["v.variant_key"] + [
+            GENETIC_DATA_SELECT[column] for column in identity_columns
+        ]
+        args: List[Any] = []
+        grouped = not self.variant_summary or carrier_threshold is not None
+        if not grouped:
+            self._sync_variant_summary()
+            select_columns += [
+                "s.row_count",
+                "s.frequency_sum / s.row_count",
+                "s.min_frequency",
+                "s.max_frequency",
+            ]
+            query = f"""
+                SELECT {", ".join(select_columns)}
+                FROM variant_summary AS s
+                JOIN variants AS v ON v.variant_key = s.variant_key
+                WHERE 1
+            """
         else:
-            return "User not found"
+            select_columns += [
+                "COUNT(*)",
+                "AVG(g.alternate_allele_frequency)",
+                "MIN(g.alternate_allele_frequency)",
+                "MAX(g.alternate_allele_frequency)",
+            ]
+            if carrier_threshold is not None:
+                select_columns.append(
+                    "COUNT(DISTINCT CASE WHEN g.alternate_allele_frequency > ?"
+                    " THEN g.user_id END)"
+                )
+                args.append(carrier_threshold)
+            query = f"""
+                SELECT {", ".join(select_columns)}
+                FROM variants AS v
+                JOIN genetic_data_table AS g ON g.variant_key = v.variant_key
+                WHERE 1
+            """
+
+        if variants:
+            query += " AND v.variant_id IN (SELECT value FROM json_each(?))"
+            args.append(json.dumps(variants.split(",")))
+        if region:
+            region_conditions, region_args = _region_filter(region)
+            query += region_conditions
+            args.extend(region_args)
+        if after is not None:
+            query += " AND v.variant_key > ?"
+            args.append(after)
+        if grouped:
+            query += " GROUP BY v.variant_key"
+        query += " ORDER BY v.variant_key"
+        if limit:
+            query += " LIMIT ?"
+            args.append(limit)
+
+        columns = identity_columns + COHORT_COLUMNS
+        if carrier_threshold is not None:
+            columns += ("carriers",)
+
+        conn = self._connect()
+        rows: List[Tuple[Any, ...]] = []
+        try:
+            with metrics.stage("query"):
+                rows = conn.execute(query, args).fetchall()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+        finally:
+            self._close(conn)
+
+        with metrics.stage("serialize"):
+            summary = [dict(zip(columns, row[1:])) for row in rows]
+        if limit:
+            next_cursor = rows[-1][0] if len(rows) == limit else None
+            return {"data": summary, "next_cursor": next_cursor}
+        return summary
 
     def insert_new_individual(self, new_individual_id: str) -> str:
         conn = self._connect()
@@ -195,54 +1428,372 @@ class DatabaseHandler:
         try:
             cursor.execute(insert_user_statement, args)
             conn.commit()
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return f"User {new_individual_id} already exists"
         except sqlite3.DatabaseError as e:
-            print(f"Error executing query: {e}")
+            logger.error("Error executing query: %s", e)
             conn.rollback()
         finally:
             self._close(conn)
+            self._invalidate_individual(new_individual_id)
+            self._users_state_cache.clear()
 
         return f"User {new_individual_id} created"
 
+    def insert_users(self, users: List[User]) -> None:
+        """
+        Stores users with the ids and creation times they already have, skipping
+        any that are present, for shards mirroring the users of a catalog
+        """
+        conn = self._connect()
+        try:
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO users (id, individual_id, created_at)
+                VALUES (?, ?, ?)
+                """,
+                [(user.id, user.username, user.date_created) for user in users],
+            )
+            conn.commit()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+            raise
+        finally:
+            self._close(conn)
+            self._users_state_cache.clear()
+
+    def delete_individual(self, individual_id: str) -> str:
+        """
+        Removes an individual with their genetic data, uploads and variant filter,
+        keeping variant_summary in step. Ingest jobs are kept as history.
+        """
+        id = self.get_id_for_individual_id(individual_id)
+        if not id:
+            return "Individual not found"
+
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            with metrics.stage("insert"):
+                cursor.execute(
+                    "SELECT variant_key FROM genetic_data_table WHERE user_id = ?",
+                    (id,),
+                )
+                variant_keys = json.dumps([row[0] for row in cursor.fetchall()])
+                cursor.execute(
+                    "DELETE FROM genetic_data_table WHERE user_id = ?", (id,)
+                )
+                if self.variant_summary:
+                    cursor.execute(
+                        """
+                        DELETE FROM variant_summary
+                        WHERE variant_key IN (SELECT value FROM json_each(?))
+                        """,
+                        (variant_keys,),
+                    )
+                    cursor.execute(VARIANT_SUMMARY_REBUILD_KEYS, (variant_keys,))
+                cursor.execute("DELETE FROM uploads WHERE user_id = ?", (id,))
+                cursor.execute("DELETE FROM variant_filters WHERE user_id = ?", (id,))
+                cursor.execute("DELETE FROM users WHERE id = ?", (id,))
+                conn.commit()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+            return "Failed to delete individual"
+        finally:
+            self._close(conn)
+            self._invalidate_individual(individual_id)
+            self._invalidate_variant_filter(id)
+            self._users_state_cache.clear()
+        return f"User {individual_id} deleted"
+
+    def insert_new_individuals(
+        self, new_individual_ids: List[str]
+    ) -> Optional[Dict[str, List[str]]]:
+        """
+        Creates the individuals in one transaction, returning {"created": [...],
+        "existing": [...]} with IDs that were already present (or repeated in the
+        list) reported rather than failing the batch. Returns None if nothing could
+        be created because of a database error.
+        """
+        # dict.fromkeys drops repeats while keeping the order; the repeats are
+        # reported as existing, as their first occurrence creates them
+        individual_ids = list(dict.fromkeys(new_individual_ids))
+        repeated = {
+            individual_id
+            for individual_id, count in Counter(new_individual_ids).items()
+            if count > 1
+        }
+        conn = self._connect()
+        cursor = conn.cursor()
+        try:
+            with metrics.stage("insert"):
+                cursor.execute(
+                    """
+                    SELECT individual_id FROM users
+                    WHERE individual_id IN (SELECT value FROM json_each(?))
+                    """,
+                    (json.dumps(individual_ids),),
+                )
+                existing = {row[0] for row in cursor.fetchall()}
+                created = [
+                    individual_id
+                    for individual_id in individual_ids
+                    if individual_id not in existing
+                ]
+                cursor.executemany(
+                    "INSERT INTO users (individual_id) VALUES (?)",
+                    [(individual_id,) for individual_id in created],
+                )
+                conn.commit()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+            return None
+        finally:
+            self._close(conn)
+            self._users_state_cache.clear()
+
+        return {
+            "created": created,
+            "existing": [
+                individual_id
+                for individual_id in individual_ids
+                if individual_id in existing or individual_id in repeated
+            ],
+        }
+
     def insert_genetic_data_to_db(
         self, geneticdata_array: List[GeneticData], individual_id: str
-    ) -> str:
+    ) -> int:
+        rows = [
+            (
+                geneticdata.variant_id,
+                geneticdata.chromosome.value,
+                geneticdata.position,
+                geneticdata.reference_allele.value,
+                geneticdata.alternate_allele.value,
+                geneticdata.alternate_allele_frequency,
+            )
+            for geneticdata in geneticdata_array
+        ]
+        return self.insert_genetic_rows_to_db(rows, individual_id)
+
+    def insert_genetic_rows_to_db(
+        self,
+        rows: List[Tuple[str, str, int, str, str, float]],
+        individual_id: str,
+        job_progress: Optional[Tuple[str, int]] = None,
+    ) -> int:
+        """
+        Inserts already validated rows, as produced by
+        `file_parser.parse_lines_to_rows`, without building a GeneticData per row.
+        `job_progress` is an ingest job id and the number of file lines the rows came
+        from, recorded against the job in the same transaction as the rows.
+        Returns the number of rows inserted, which leaves out variants the individual
+        already holds, and raises if the individual is unknown or the insert fails.
+        """
+        try:
+            catalog_rows = [
+                (
+                    row[0],
+                    CHROMOSOME_CODES[row[1]],
+                    row[2],
+                    ALLELE_CODES[row[3]],
+                    ALLELE_CODES[row[4]],
+                )
+                for row in rows
+            ]
+        except KeyError as e:
+            raise ValueError(f"Unsupported chromosome or allele value: {e}")
+
         id = self.get_id_for_individual_id(individual_id)
         if id:
             conn = self._connect()
             cursor = conn.cursor()
-            insert_row_statement = """
-                    INSERT INTO genetic_data_table (
+            insert_variant_statement = """
+                    INSERT OR IGNORE INTO variants (
                         variant_id,
-                        user_id,
                         chromosome,
                         position,
                         reference_allele,
-                        alternate_allele,
+                        alternate_allele
+                    ) VALUES (?, ?, ?, ?, ?)
+                """
+            # Variants the individual already holds are skipped, so a file can be
+            # resubmitted without duplicating its rows
+            insert_row_statement = """
+                    INSERT OR IGNORE INTO genetic_data_table (
+                        user_id,
+                        variant_key,
                         alternate_allele_frequency
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    )
+                    SELECT ?, variant_key, ?
+                    FROM variants
+                    WHERE variant_id = ?
+                    AND chromosome = ?
+                    AND position = ?
+                    AND reference_allele = ?
+                    AND alternate_allele = ?
                 """
 
             args = [
-                (
-                    geneticdata.variant_id,
-                    id,
-                    geneticdata.chromosome.value,
-                    geneticdata.position,
-                    geneticdata.reference_allele.value,
-                    geneticdata.alternate_allele.value,
-                    geneticdata.alternate_allele_frequency,
-                )
-                for geneticdata in geneticdata_array
+                (id, row[5], *catalog_row)
+                for row, catalog_row in zip(rows, catalog_rows)
             ]
 
             try:
-                cursor.executemany(insert_row_statement, args)
-                conn.commit()
+                with metrics.stage("insert"):
+                    cursor.executemany(insert_variant_statement, catalog_rows)
+                    # There is one writer, so the rows this batch adds are the ones
+                    # past the largest id before it
+                    cursor.execute(
+                        "SELECT COALESCE(MAX(id), 0) FROM genetic_data_table"
+                    )
+                    last_id = cursor.fetchone()[0]
+                    cursor.executemany(insert_row_statement, args)
+                    rows_inserted = cursor.rowcount
+                    if self.variant_summary:
+                        cursor.execute(VARIANT_SUMMARY_UPSERT, (last_id,))
+                    if job_progress:
+                        job_id, lines = job_progress
+                        cursor.execute(
+                            """
+                            UPDATE ingest_jobs
+                            SET lines_committed = lines_committed + ?,
+                                rows_inserted = rows_inserted + ?,
+                                updated_at = ?
+                            WHERE id = ?
+                            """,
+                            (lines, rows_inserted, time.time(), job_id),
+                        )
+                    conn.commit()
+                if rows_inserted:
+                    self._invalidate_variant_filter(id)
+                metrics.inc("sano_rows_total", rows_inserted, kind="ingested")
+                metrics.inc(
+                    "sano_rows_total", len(args) - rows_inserted, kind="duplicate"
+                )
             except sqlite3.DatabaseError as e:
-                print(f"Error executing query: {e}")
+                logger.error("Error executing query: %s", e)
                 conn.rollback()
+                raise
             finally:
                 self._close(conn)
-            return "Succesfully inserted data"
+                self._invalidate_individual(individual_id)
+            return rows_inserted
         else:
-            return "Individual not found"
+            raise ValueError("Individual not found")
+
+    def get_upload(
+        self, individual_id: str, content_hash: str
+    ) -> Optional[Dict[str, Any]]:
+        """Returns the earlier upload of a file with this content hash, if any"""
+        id = self.get_id_for_individual_id(individual_id)
+        if not id:
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                """
+                SELECT rows_inserted, rows_rejected, created_at FROM uploads
+                WHERE user_id = ? AND content_hash = ?
+                """,
+                (id, content_hash),
+            ).fetchone()
+        finally:
+            self._close(conn)
+        if row is None:
+            return None
+        return dict(zip(("rows_inserted", "rows_rejected", "created_at"), row))
+
+    def record_upload(
+        self,
+        individual_id: str,
+        content_hash: str,
+        rows_inserted: int,
+        rows_rejected: int = 0,
+    ) -> None:
+        id = self.get_id_for_individual_id(individual_id)
+        if not id:
+            return
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO uploads (
+                    user_id, content_hash, rows_inserted, rows_rejected, created_at
+                ) VALUES (?, ?, ?, ?, ?)
+                """,
+                (id, content_hash, rows_inserted, rows_rejected, time.time()),
+            )
+            conn.commit()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+        finally:
+            self._close(conn)
+
+    def create_ingest_job(
+        self,
+        job_id: str,
+        individual_id: str,
+        spool_path: str,
+        content_hash: Optional[str] = None,
+    ) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                INSERT INTO ingest_jobs (
+                    id, individual_id, spool_path, status, created_at, content_hash
+                ) VALUES (?, ?, ?, 'queued', ?, ?)
+                """,
+                (job_id, individual_id, spool_path, time.time(), content_hash),
+            )
+            conn.commit()
+        except sqlite3.DatabaseError:
+            conn.rollback()
+            raise
+        finally:
+            self._close(conn)
+
+    def update_ingest_job(self, job_id: str, **values: Any) -> None:
+        unknown = set(values) - INGEST_JOB_UPDATABLE_COLUMNS
+        if unknown:
+            raise ValueError(f"Unknown ingest job columns: {sorted(unknown)}")
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        conn = self._connect()
+        try:
+            conn.execute(
+                f"UPDATE ingest_jobs SET {assignments}, updated_at = ? WHERE id = ?",
+                (*values.values(), time.time(), job_id),
+            )
+            conn.commit()
+        except sqlite3.DatabaseError as e:
+            logger.error("Error executing query: %s", e)
+            conn.rollback()
+        finally:
+            self._close(conn)
+
+    def _get_ingest_jobs(
+        self, where: str, args: Tuple[Any, ...]
+    ) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            cursor = conn.execute(f"SELECT * FROM ingest_jobs WHERE {where}", args)
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            self._close(conn)
+
+    def get_ingest_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        jobs = self._get_ingest_jobs("id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def get_unfinished_ingest_jobs(self) -> List[Dict[str, Any]]:
+        return self._get_ingest_jobs(
+            "status IN ('queued', 'running') ORDER BY created_at", ()
+        )
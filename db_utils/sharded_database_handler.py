@@ -0,0 +1,501 @@
+import argparse
+import contextvars
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from ..models.models import CHROMOSOME_CODES, User
+from ..utils.metrics import metrics
+from .cache import MISSING, TTLCache
+from .database_handler import (
+    DEFAULT_FETCH_SIZE,
+    GENETIC_DATA_COLUMNS,
+    DatabaseHandler,
+    load_config,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD_DIR = "./data/shards"
+DEFAULT_SHARDS = 4
+
+CATALOG_FILE = "catalog.db"
+
+VARIANT_IDENTITY = GENETIC_DATA_COLUMNS[:-1]
+
+
+def shard_file(shard: int) -> str:
+    return f"shard_{shard}.db"
+
+
+def hash_shard(individual_id: str, shard_count: int) -> int:
+    """The shard an individual belongs in, stable across processes and restarts"""
+    digest = blake2b(individual_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shard_count
+
+
+def merge_cohort_summaries(
+    summaries: Iterable[List[Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
+    """
+    Combines per-shard `get_cohort_summary` results into one entry per variant,
+    ordered by chromosome, position and variant ID. Individuals are in exactly one
+    shard, so counts and carriers add up.
+    """
+    merged: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+    for summary in summaries:
+        for entry in summary:
+            key = tuple(entry[column] for column in VARIANT_IDENTITY)
+            total = merged.get(key)
+            if total is None:
+                merged[key] = dict(entry)
+                continue
+            count = total["count"] + entry["count"]
+            total["mean_frequency"] = (
+                total["mean_frequency"] * total["count"]
+                + entry["mean_frequency"] * entry["count"]
+            ) / count
+            total["count"] = count
+            total["min_frequency"] = min(total["min_frequency"], entry["min_frequency"])
+            total["max_frequency"] = max(total["max_frequency"], entry["max_frequency"])
+            if "carriers" in entry:
+                total["carriers"] += entry["carriers"]
+    return sorted(
+        merged.values(),
+        key=lambda entry: (
+            CHROMOSOME_CODES[entry["chromosome"]],
+            entry["position"],
+            entry["variant_id"],
+            entry["reference_allele"],
+            entry["alternate_allele"],
+        ),
+    )
+
+
+class ShardedDatabaseHandler:
+    """
+    Spreads individuals over `[sharding] shards` SQLite files in `shard_dir`, each
+    a DatabaseHandler of its own, so uploads for individuals in different shards
+    are written in parallel. A catalog database holds every user with the shard
+    they are stored in, and hands out user ids; shards keep copies of their users
+    under the same ids. Individuals are placed by a hash of their ID, and stay in
+    their shard until `rebalance` moves them, e.g. after shards were added.
+    Per-individual calls go to one shard, and cohort queries and exports go to all
+    of them, concurrently for cohorts.
+    """
+
+    def __init__(self, config_file: str):
+        self.shard_dir: str = load_config(config_file).get(
+            "sharding", "shard_dir", fallback=DEFAULT_SHARD_DIR
+        )
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.catalog = DatabaseHandler(
+            config_file, os.path.join(self.shard_dir, CATALOG_FILE)
+        )
+        self.config = self.catalog.config
+        self._initialise_catalog()
+
+        # New individuals are hashed over `configured_shards` shards, but shards left
+        # over from a larger count stay open until their individuals are rebalanced
+        self.configured_shards: int = self.config.getint(
+            "sharding", "shards", fallback=DEFAULT_SHARDS
+        )
+        if self.configured_shards < 1:
+            raise ValueError("At least one shard is required")
+        self.shard_count = max(
+            self.configured_shards, self._highest_assigned_shard() + 1
+        )
+        self.shards: List[DatabaseHandler] = [
+            DatabaseHandler(config_file, os.path.join(self.shard_dir, shard_file(i)))
+            for i in range(self.shard_count)
+        ]
+        # individual_id -> shard
+        self._shard_cache = TTLCache(
+            self.config.getint("cache", "id_cache_size", fallback=10_000),
+            self.config.getfloat("cache", "id_cache_ttl", fallback=300),
+        )
+        # ingest job id -> shard, as jobs are stored with their individual's rows
+        self._job_shards: Dict[str, int] = {}
+        self._fanout = ThreadPoolExecutor(
+            max_workers=len(self.shards), thread_name_prefix="db-shard"
+        )
+        self._sync_shard_users()
+
+    def _initialise_catalog(self) -> None:
+        conn = self.catalog._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_shards (
+                    user_id INTEGER PRIMARY KEY,
+                    shard INTEGER NOT NULL,
+                    FOREIGN KEY (user_id) REFERENCES users(id)
+                )
+                """
+            )
+            conn.commit()
+        finally:
+            self.catalog._close(conn)
+
+    def _highest_assigned_shard(self) -> int:
+        conn = self.catalog._connect()
+        try:
+            (shard,) = conn.execute(
+                "SELECT COALESCE(MAX(shard), -1) FROM user_shards"
+            ).fetchone()
+        finally:
+            self.catalog._close(conn)
+        return shard
+
+    def _assigned_users(self) -> List[Tuple[User, Optional[int]]]:
+        conn = self.catalog._connect()
+        try:
+            rows = conn.execute(
+                """
+                SELECT u.individual_id, u.id, u.created_at, s.shard
+                FROM users AS u
+                LEFT JOIN user_shards AS s ON s.user_id = u.id
+                ORDER BY u.id
+                """
+            ).fetchall()
+        finally:
+            self.catalog._close(conn)
+        return [
+            (User(username=row[0], id=row[1], date_created=row[2]), row[3])
+            for row in rows
+        ]
+
+    def _catalog_users(self, individual_ids: List[str]) -> List[User]:
+        conn = self.catalog._connect()
+        try:
+            rows = conn.execute(
+                """
+                SELECT individual_id, id, created_at FROM users
+                WHERE individual_id IN (SELECT value FROM json_each(?))
+                """,
+                (json.dumps(individual_ids),),
+            ).fetchall()
+        finally:
+            self.catalog._close(conn)
+        return [User(username=row[0], id=row[1], date_created=row[2]) for row in rows]
+
+    def _assign_users(self, users: List[User]) -> Dict[int, List[User]]:
+        # Records a shard for each user in the catalog and copies them into it
+        by_shard: Dict[int, List[User]] = {}
+        for user in users:
+            shard = hash_shard(user.username, self.configured_shards)
+            by_shard.setdefault(shard, []).append(user)
+        conn = self.catalog._connect()
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO user_shards (user_id, shard) VALUES (?, ?)",
+                [
+                    (user.id, shard)
+                    for shard, shard_users in by_shard.items()
+                    for user in shard_users
+                ],
+            )
+            conn.commit()
+        finally:
+            self.catalog._close(conn)
+        for shard, shard_users in by_shard.items():
+            self.shards[shard].insert_users(shard_users)
+        return by_shard
+
+    def _sync_shard_users(self) -> None:
+        # Finishes creating individuals that an interrupted insert left in the
+        # catalog only, without a shard or without their copy in it
+        unassigned, by_shard = [], {}
+        for user, shard in self._assigned_users():
+            if shard is None:
+                unassigned.append(user)
+            else:
+                by_shard.setdefault(shard, []).append(user)
+        for shard, users in by_shard.items():
+            self.shards[shard].insert_users(users)
+        if unassigned:
+            self._assign_users(unassigned)
+
+    def shard_of(self, individual_id: str) -> int:
+        """The shard holding an individual, or the one a new individual goes in"""
+        shard = self._shard_cache.get(individual_id)
+        if shard is not MISSING:
+            return shard
+        conn = self.catalog._connect()
+        try:
+            row = conn.execute(
+                """
+                SELECT s.shard FROM users AS u
+                JOIN user_shards AS s ON s.user_id = u.id
+                WHERE u.individual_id = ?
+                """,
+                (individual_id,),
+            ).fetchone()
+        finally:
+            self.catalog._close(conn)
+        if row is None:
+            return hash_shard(individual_id, self.configured_shards)
+        self._shard_cache.set(individual_id, row[0])
+        return row[0]
+
+    def _shard_for(self, individual_id: str) -> DatabaseHandler:
+        return self.shards[self.shard_of(individual_id)]
+
+    def _fan_out(self, fn: Callable[[DatabaseHandler], Any]) -> List[Any]:
+        # Each shard runs in its own copy of the context, so stage timings keep
+        # the request's endpoint
+        futures = [
+            self._fanout.submit(contextvars.copy_context().run, fn, shard)
+            for shard in self.shards
+        ]
+        return [future.result() for future in futures]
+
+    def get_all_users(self) -> Optional[List[User]]:
+        return self.catalog.get_all_users()
+
+    def get_users_page(self, *args: Any) -> Any:
+        return self.catalog.get_users_page(*args)
+
+    def get_users_state(self) -> Optional[Tuple[int, int]]:
+        return self.catalog.get_users_state()
+
+    def get_id_for_individual_id(self, individual_id: str) -> Optional[str]:
+        return self.catalog.get_id_for_individual_id(individual_id)
+
+    def get_individual_data(self, individual_id: str, *args: Any, **kwargs: Any) -> Any:
+        return self._shard_for(individual_id).get_individual_data(
+            individual_id, *args, **kwargs
+        )
+
+    def get_individual_rows(self, individual_id: str, *args: Any, **kwargs: Any) -> Any:
+        return self._shard_for(individual_id).get_individual_rows(
+            individual_id, *args, **kwargs
+        )
+
+    def iter_individual_data(
+        self, individual_id: str, *args: Any, **kwargs: Any
+    ) -> Any:
+        return self._shard_for(individual_id).iter_individual_data(
+            individual_id, *args, **kwargs
+        )
+
+    def get_present_variants(self, individual_id: str, variants: str) -> Any:
+        return self._shard_for(individual_id).get_present_variants(
+            individual_id, variants
+        )
+
+    def export_genetic_data(
+        self,
+        individual_ids: Optional[List[str]] = None,
+        batch_size: int = DEFAULT_FETCH_SIZE,
+    ) -> Any:
+        """As `DatabaseHandler.export_genetic_data`, reading the shards in turn"""
+        if individual_ids is None:
+            exports = [
+                shard.export_genetic_data(None, batch_size) for shard in self.shards
+            ]
+        else:
+            by_shard: Dict[int, List[str]] = {}
+            for individual_id in individual_ids:
+                by_shard.setdefault(self.shard_of(individual_id), []).append(
+                    individual_id
+                )
+            exports = [
+                self.shards[shard].export_genetic_data(ids, batch_size)
+                for shard, ids in by_shard.items()
+            ]
+            if any(export is None for export in exports):
+                return None
+        individuals: Dict[int, str] = {}
+        for shard_individuals, _ in exports:
+            individuals.update(shard_individuals)
+        return individuals, itertools.chain.from_iterable(
+            batches for _, batches in exports
+        )
+
+    def get_cohort_summary(
+        self,
+        variants: Optional[str] = None,
+        region: Optional[str] = None,
+        carrier_threshold: Optional[float] = None,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Any:
+        """
+        As `DatabaseHandler.get_cohort_summary`, summarising every shard at once and
+        merging the results. Variant keys differ between shards, so pages are cut
+        from the merged summary and `after` is the number of variants already seen.
+        """
+        summaries = self._fan_out(
+            lambda shard: shard.get_cohort_summary(variants, region, carrier_threshold)
+        )
+        with metrics.stage("serialize"):
+            summary = merge_cohort_summaries(summaries)
+        if not limit:
+            return summary
+        start = after or 0
+        page = summary[start : start + limit]
+        next_cursor = start + limit if start + limit < len(summary) else None
+        return {"data": page, "next_cursor": next_cursor}
+
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        stats = {"shards": self._shard_cache.stats(), **self.catalog.cache_stats()}
+        for i, shard in enumerate(self.shards):
+            for name, shard_stats in shard.cache_stats().items():
+                stats[f"shard_{i}_{name}"] = shard_stats
+        return stats
+
+    def pool_stats(self) -> Dict[str, int]:
+        return {
+            "open_connections": sum(
+                handler.pool_stats()["open_connections"]
+                for handler in [self.catalog, *self.shards]
+            ),
+            "shards": len(self.shards),
+        }
+
+    def insert_new_individual(self, new_individual_id: str) -> str:
+        result = self.insert_new_individuals([new_individual_id])
+        if result and result["existing"]:
+            return f"User {new_individual_id} already exists"
+        return f"User {new_individual_id} created"
+
+    def insert_new_individuals(
+        self, new_individual_ids: List[str]
+    ) -> Optional[Dict[str, List[str]]]:
+        """As `DatabaseHandler.insert_new_individuals`, placing each in a shard"""
+        result = self.catalog.insert_new_individuals(new_individual_ids)
+        if not result or not result["created"]:
+            return result
+        self._assign_users(self._catalog_users(result["created"]))
+        return result
+
+    def insert_genetic_data_to_db(
+        self, geneticdata_array: List[Any], individual_id: str
+    ) -> int:
+        return self._shard_for(individual_id).insert_genetic_data_to_db(
+            geneticdata_array, individual_id
+        )
+
+    def insert_genetic_rows_to_db(
+        self, rows: List[Tuple[Any, ...]], individual_id: str, *args: Any
+    ) -> int:
+        return self._shard_for(individual_id).insert_genetic_rows_to_db(
+            rows, individual_id, *args
+        )
+
+    def save_variant_filter(self, individual_id: str) -> None:
+        self._shard_for(individual_id).save_variant_filter(individual_id)
+
+    def get_upload(self, individual_id: str, content_hash: str) -> Any:
+        return self._shard_for(individual_id).get_upload(individual_id, content_hash)
+
+    def record_upload(self, individual_id: str, *args: Any) -> None:
+        self._shard_for(individual_id).record_upload(individual_id, *args)
+
+    def create_ingest_job(self, job_id: str, individual_id: str, *args: Any) -> None:
+        # Kept with the individual's rows, so progress commits alongside them
+        shard = self.shard_of(individual_id)
+        self.shards[shard].create_ingest_job(job_id, individual_id, *args)
+        self._job_shards[job_id] = shard
+
+    def _job_shard(self, job_id: str) -> Optional[DatabaseHandler]:
+        if job_id not in self._job_shards:
+            for i, shard in enumerate(self.shards):
+                if shard.get_ingest_job(job_id) is not None:
+                    self._job_shards[job_id] = i
+                    break
+            else:
+                return None
+        return self.shards[self._job_shards[job_id]]
+
+    def update_ingest_job(self, job_id: str, **values: Any) -> None:
+        shard = self._job_shard(job_id)
+        if shard is not None:
+            shard.update_ingest_job(job_id, **values)
+
+    def get_ingest_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        shard = self._job_shard(job_id)
+        return shard.get_ingest_job(job_id) if shard is not None else None
+
+    def get_unfinished_ingest_jobs(self) -> List[Dict[str, Any]]:
+        return [
+            job for shard in self.shards for job in shard.get_unfinished_ingest_jobs()
+        ]
+
+    def rebalance(self, batch_size: int = DEFAULT_FETCH_SIZE) -> int:
+        """
+        Moves every individual whose shard no longer matches their hash, e.g. after
+        `shards` was changed, and returns how many were moved. Rows are copied,
+        then the catalog is switched over, then the old copy is deleted, so an
+        interrupted rebalance can simply be run again. Upload records are not
+        moved, so a file resent afterwards is ingested again, though its rows are
+        still deduplicated. Run it while nothing else writes to the shards.
+        """
+        moved = 0
+        for user, shard in self._assigned_users():
+            target = hash_shard(user.username, self.configured_shards)
+            if shard is None or shard == target:
+                continue
+            source, destination = self.shards[shard], self.shards[target]
+            destination.insert_users([user])
+            batches = source.iter_individual_data(user.username, batch_size=batch_size)
+            for rows in batches or []:
+                destination.insert_genetic_rows_to_db(rows, user.username)
+            self._set_shard(user.id, target)
+            self._shard_cache.discard(user.username)
+            source.delete_individual(user.username)
+            logger.info("Moved %s from shard %d to %d", user.username, shard, target)
+            moved += 1
+        self._delete_stale_copies()
+        return moved
+
+    def _set_shard(self, user_id: int, shard: int) -> None:
+        conn = self.catalog._connect()
+        try:
+            conn.execute(
+                "UPDATE user_shards SET shard = ? WHERE user_id = ?", (shard, user_id)
+            )
+            conn.commit()
+        finally:
+            self.catalog._close(conn)
+
+    def _delete_stale_copies(self) -> None:
+        # Copies a rebalance interrupted after switching the catalog left behind
+        assigned = {user.id: shard for user, shard in self._assigned_users()}
+        for i, shard in enumerate(self.shards):
+            for user in shard.get_all_users() or []:
+                if assigned.get(user.id) != i:
+                    shard.delete_individual(user.username)
+
+    def close(self) -> None:
+        self._fanout.shutdown(wait=True)
+        for handler in [self.catalog, *self.shards]:
+            handler.close()
+
+
+def open_database_handler(
+    config_file: str,
+) -> Union[DatabaseHandler, ShardedDatabaseHandler]:
+    """A ShardedDatabaseHandler if `[sharding] enabled`, else a DatabaseHandler"""
+    if load_config(config_file).getboolean("sharding", "enabled", fallback=False):
+        return ShardedDatabaseHandler(config_file)
+    return DatabaseHandler(config_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Move individuals to the shard their ID hashes to"
+    )
+    parser.add_argument("--config", default="config/config.ini")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_FETCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sharded_handler = ShardedDatabaseHandler(args.config)
+    print(f"Moved {sharded_handler.rebalance(args.batch_size)} individuals")
+    sharded_handler.close()
@@ -1,55 +1,536 @@
-from typing import Optional
+import codecs
+import hashlib
+import os
+import time
+from typing import List, Optional
 
-from fastapi import APIRouter, File, Query
-from pydantic import BaseModel
+from fastapi import (
+    APIRouter,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
-from ..utils import file_parser
+from ..db_utils.async_database_handler import (
+    AsyncDatabaseHandler,
+    IngestError,
+    InvalidFileError,
+)
+from ..utils import export, file_parser, streaming
+from ..utils.metrics import metrics
+from ..utils.profiler import profiler
+from ..utils.query_profiler import query_profiler
 
 router = APIRouter()
 
+MAX_PAGE_SIZE = 10_000
+MAX_BATCH_INDIVIDUALS = 100_000
+
+# Sent with responses whose body format is negotiated from the Accept header, so
+# shared caches keep one copy per format
+VARY_ACCEPT = {"Vary": "Accept"}
+
 
 class Individual(BaseModel):
     individual_id: str
 
 
+class Individuals(BaseModel):
+    individual_ids: List[str] = Field(..., max_length=MAX_BATCH_INDIVIDUALS)
+
+
 db_handler = None # Initialize to None
 
 def set_db_handler(db):
     global db_handler
+    # Endpoints await the database, so blocking handlers are run on its threads
+    if db is not None and not isinstance(db, AsyncDatabaseHandler):
+        db = AsyncDatabaseHandler(db)
     db_handler = db
 
 
+job_queue = None
+
+
+def set_job_queue(queue):
+    global job_queue
+    job_queue = queue
+
+
+startup_error: Optional[str] = None
+
+
+def set_startup_error(error):
+    global startup_error
+    startup_error = error
+
+
+def require_ready():
+    """Dependency answering 503 until the database handler has been set up"""
+    if db_handler is None:
+        raise HTTPException(status_code=503, detail=startup_error or "Starting up")
+
+
+# Routes that must answer while the application is still starting
+probe_router = APIRouter()
+
+
+@probe_router.get("/ready")
+async def read_readiness():
+    """
+    GET /ready: 200 once the database is open and requests can be served, 503 while
+    starting up or if startup failed
+    """
+    if db_handler is None:
+        status = "failed" if startup_error else "starting"
+        return JSONResponse(
+            {"status": status, "error": startup_error}, status_code=503
+        )
+    return {"status": "ready"}
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # Weak comparison, as compression changes the bytes but not the listing
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
 @router.get("/individuals")
-def read_all_users():
-    """GET /individuals: returns a list of individual IDs"""
-    return db_handler.get_all_users()
+async def read_all_users(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = Query(None, ge=0),
+):
+    """
+    GET /individuals: returns a list of individual IDs. Sent as JSON, or as column-
+    oriented JSON or MessagePack when the Accept header asks for those.
+    limit=N returns one page with a next_cursor to pass back as after= for the
+    following page. The total is sent as X-Total-Count, and an ETag that changes
+    when individuals are added, so If-None-Match answers 304 for unchanged listings.
+    """
+    media_type = streaming.negotiate_media_type(request.headers.get("accept", ""))
+    state = await db_handler.get_users_state()
+    headers = dict(VARY_ACCEPT)
+    if state is not None:
+        count, last_id = state
+        version = repr((count, last_id, media_type)).encode()
+        headers["ETag"] = f'W/"{hashlib.sha1(version).hexdigest()[:16]}"'
+        headers["X-Total-Count"] = str(count)
+        if _etag_matches(request.headers.get("if-none-match", ""), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+    next_cursor = None
+    if limit:
+        page = await db_handler.get_users_page(limit, after)
+        users, next_cursor = page or ([], None)
+    else:
+        users = await db_handler.get_all_users()
+    if media_type == streaming.JSON:
+        if limit:
+            data = {"data": users, "next_cursor": next_cursor}
+            return JSONResponse(jsonable_encoder(data), headers=headers)
+        return JSONResponse(jsonable_encoder(users), headers=headers)
+    rows = [(user.username, user.date_created, user.id) for user in users or []]
+    body = streaming.encode_rows(
+        ("username", "date_created", "id"), rows, media_type, bool(limit), next_cursor
+    )
+    return Response(body, media_type=media_type, headers=headers)
 
 
 @router.get("/individuals/{individual}/genetic-data")
-def read_individual(
-    individual: str, variants: Optional[str] = Query(None, alias="variants")
+async def read_individual(
+    request: Request,
+    individual: str,
+    variants: Optional[str] = Query(None, alias="variants"),
+    stream: Optional[str] = Query(None, pattern="^(ndjson|json)$"),
+    fields: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = Query(None, ge=0),
+    region: Optional[str] = Query(None),
 ):
     """
     GET /individuals/<individual_id>/genetic-data?variants=rs123,rs456:
-    returns all the genetic data for a single individual, optionally filtered by variant IDs
+    returns all the genetic data for a single individual, optionally filtered by variant IDs.
+    With stream=ndjson or stream=json the rows are written out as they are read from the
+    database, as newline delimited JSON or a chunked JSON array respectively.
+    fields=variant_id,alternate_allele_frequency returns only those columns, and limit=N
+    returns one page with a next_cursor to pass back as after= for the following page.
+    region=1:100000-250000,X:5000-6000 restricts the rows to those chromosome ranges.
+    Rows are sent as JSON objects, or as column-oriented JSON
+    (application/vnd.sano.columns+json) or MessagePack (application/msgpack) when
+    the Accept header asks for those.
     """
-    return db_handler.get_individual_data(individual, variants)
+    try:
+        if not stream:
+            result = await db_handler.get_individual_rows(
+                individual,
+                variants,
+                fields=fields,
+                limit=limit,
+                after=after,
+                region=region,
+            )
+            if result is None:
+                return "User not found"
+            columns, rows, next_cursor = result
+            media_type = streaming.negotiate_media_type(
+                request.headers.get("accept", "")
+            )
+            body = await run_in_threadpool(
+                streaming.encode_rows,
+                columns,
+                rows,
+                media_type,
+                bool(limit),
+                next_cursor,
+            )
+            return Response(body, media_type=media_type, headers=VARY_ACCEPT)
+        batches = await db_handler.iter_individual_data(
+            individual, variants, fields=fields, region=region
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if batches is None:
+        return "User not found"
+    columns = (
+        [field.strip() for field in fields.split(",")]
+        if fields
+        else file_parser.ROW_FIELDS
+    )
+    if stream == "ndjson":
+        return StreamingResponse(
+            streaming.iter_ndjson(batches, columns),
+            media_type="application/x-ndjson",
+            headers=VARY_ACCEPT,
+        )
+    return StreamingResponse(
+        streaming.iter_json_array(batches, columns),
+        media_type="application/json",
+        headers=VARY_ACCEPT,
+    )
+
+
+@router.head("/individuals/{individual}/genetic-data")
+async def check_individual_variants(
+    individual: str, variants: Optional[str] = Query(None, alias="variants")
+):
+    """
+    HEAD /individuals/<individual_id>/genetic-data?variants=rs123,rs456:
+    200 if the individual holds any of the variants (or exists, without variants=),
+    404 otherwise. Most misses are answered from the individual's variant filter
+    without querying the genetic data.
+    """
+    if variants:
+        present = await db_handler.get_present_variants(individual, variants)
+        found = present is not None and any(present.values())
+    else:
+        found = await db_handler.get_id_for_individual_id(individual) is not None
+    return Response(status_code=200 if found else 404)
+
+
+@router.get("/individuals/{individual}/variants/exists")
+async def read_individual_variants_exist(
+    individual: str, variants: str = Query(..., alias="variants")
+):
+    """
+    GET /individuals/<individual_id>/variants/exists?variants=rs123,rs456:
+    returns {"rs123": true, "rs456": false}, whether the individual holds each variant.
+    """
+    present = await db_handler.get_present_variants(individual, variants)
+    if present is None:
+        return "User not found"
+    return present
+
+
+@router.get("/cohort/variants")
+async def read_cohort_variants(
+    variants: Optional[str] = Query(None),
+    region: Optional[str] = Query(None),
+    carrier_threshold: Optional[float] = Query(None, ge=0, le=1),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[int] = Query(None, ge=0),
+):
+    """
+    GET /cohort/variants?variants=rs123,rs456:
+    returns, for each variant, the number of rows across all individuals and the mean,
+    min and max alternate allele frequency, optionally filtered by variant IDs and/or
+    region=1:100000-250000. carrier_threshold=0.5 also counts the individuals whose
+    frequency is above it. limit and after page through the variants as for
+    genetic-data.
+    """
+    try:
+        return await db_handler.get_cohort_summary(
+            variants,
+            region,
+            carrier_threshold=carrier_threshold,
+            limit=limit,
+            after=after,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/export")
+async def export_genetic_data(
+    individuals: Optional[str] = Query(None),
+    export_format: Optional[str] = Query(
+        None, alias="format", pattern="^(arrow|parquet|binary)$"
+    ),
+):
+    """
+    GET /export?individuals=id1,id2&format=arrow:
+    streams the genetic data of the given individuals, or of everyone, as an Arrow IPC
+    stream, a Parquet file or the compact sano binary format. Arrow is the default
+    when pyarrow is installed, and binary otherwise.
+    """
+    export_format = export_format or export.default_format()
+    if export_format not in export.available_formats():
+        raise HTTPException(
+            status_code=400, detail=f"{export_format} export requires pyarrow"
+        )
+    result = await db_handler.export_genetic_data(
+        individuals.split(",") if individuals else None
+    )
+    if result is None:
+        return "Individual not found"
+    return StreamingResponse(
+        export.iter_export(*result, export_format),
+        media_type=export.MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f"attachment; filename=genetic_data.{export_format}"
+        },
+    )
+
+
+@router.get("/cache/stats")
+async def read_cache_stats():
+    """GET /cache/stats: returns hit/miss counters and sizes of the lookup caches"""
+    return await db_handler.cache_stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """GET /metrics: latency histograms, row and byte counters, cache and pool stats"""
+    cache_stats = await db_handler.cache_stats()
+    pool_stats = await db_handler.pool_stats()
+    gauges = {
+        f"sano_cache_{stat}": [
+            ({"cache": cache}, value)
+            for cache, stats in cache_stats.items()
+            for name, value in stats.items()
+            if name == stat and value is not None
+        ]
+        for stat in ("hits", "misses", "size", "max_size")
+    }
+    gauges.update(
+        {f"sano_pool_{name}": [({}, value)] for name, value in pool_stats.items()}
+    )
+    return PlainTextResponse(
+        metrics.render(gauges), media_type="text/plain; version=0.0.4"
+    )
+
+
+@router.post("/debug/profiler/start")
+async def start_profiler(interval_ms: float = Query(5, gt=0, le=1000)):
+    """POST /debug/profiler/start: starts sampling the stacks of all threads"""
+    profiler.start(interval_ms / 1000)
+    return profiler.report(top=0)
+
+
+@router.post("/debug/profiler/stop")
+async def stop_profiler():
+    """POST /debug/profiler/stop: stops sampling, keeping the collected stacks"""
+    profiler.stop()
+    return profiler.report(top=0)
+
+
+@router.get("/debug/profiler")
+async def read_profiler(top: int = Query(50, ge=0), collapsed: bool = Query(False)):
+    """
+    GET /debug/profiler: the most sampled stacks, or with collapsed=true every stack in
+    the collapsed format flame graph tools read
+    """
+    if collapsed:
+        return PlainTextResponse(profiler.collapsed())
+    return profiler.report(top=top)
+
+
+@router.get("/debug/queries")
+async def read_query_profile(top: int = Query(20, ge=0)):
+    """
+    GET /debug/queries: the statements taking the most total time, with their
+    parameter shapes, captured plans and full scans of genetic_data_table. Empty
+    unless [profiling] is enabled in the config
+    """
+    return query_profiler.report(top=top)
+
+
+@router.post("/debug/queries/reset")
+async def reset_query_profile():
+    """POST /debug/queries/reset: clears the collected statement timings"""
+    query_profiler.reset()
+    return query_profiler.report(top=0)
 
 
 @router.post("/individuals")
-def create_individual(new_individual: Individual):
+async def create_individual(new_individual: Individual):
     """POST /individuals: creates a new individual given an ID"""
-    db_handler.insert_new_individual(new_individual.individual_id)
+    await db_handler.insert_new_individual(new_individual.individual_id)
     return "Succesfully added new individual"
 
 
+@router.post("/individuals/batch")
+async def create_individuals(new_individuals: Individuals):
+    """
+    POST /individuals/batch: creates every individual of {"individual_ids": [...]} in
+    one transaction, returning {"created": [...], "existing": [...]}. IDs that
+    already exist, or repeat in the list, are reported in "existing", so a batch
+    can safely be resent.
+    """
+    result = await db_handler.insert_new_individuals(new_individuals.individual_ids)
+    if result is None:
+        return "Failed to add individuals"
+    return result
+
+
 @router.post("/individuals/{individual_id}/genetic_data")
-def insert_individual_data(individual_id: str, file: bytes = File(...)):
+async def insert_individual_data(
+    individual_id: str,
+    response: Response,
+    file: UploadFile = File(...),
+    background: bool = Query(False),
+    partial: bool = Query(False),
+):
     """
     POST /individuals/<individual_id>/genetic-data:
-    takes a sano file and stores the genetic data for that individual to be queried later
+    takes a sano file and stores the genetic data for that individual to be queried later.
+    The file is read line by line and committed in bounded batches, so memory use does
+    not grow with the size of the upload. Parsing runs off the event loop and the
+    batches are committed by the single database writer.
+    With background=true the file is queued as an ingest job and its id is returned
+    straight away, to be followed with GET /jobs/<job_id>.
+    With partial=true the valid rows are stored and the rejected ones are reported with
+    their line numbers, so a file holding only the corrected rows can be sent next.
+    A file already uploaded for the individual is not ingested again, and variants the
+    individual already holds are skipped.
     """
-    content = file.decode("utf-8")
-    lines = content.split("\n")
-    file_parser.batch_insert_genetic_data_to_db(lines, individual_id, db_handler)
-    return "Successfully uploaded data"
+    if not await db_handler.get_id_for_individual_id(individual_id):
+        return "Individual not found"
+
+    content_hash = await run_in_threadpool(file_parser.hash_file, file.file)
+    previous_upload = await db_handler.get_upload(individual_id, content_hash)
+    if previous_upload:
+        return {
+            "message": "File already uploaded",
+            "rows_ingested": 0,
+            "previous_upload": previous_upload,
+        }
+
+    if background:
+        if job_queue is None:
+            raise HTTPException(
+                status_code=400, detail="Background ingest is not enabled"
+            )
+        if partial:
+            # Jobs have nowhere to report rejected rows, so they reject whole files
+            raise HTTPException(
+                status_code=400, detail="partial=true is not supported with background"
+            )
+        job_id = await run_in_threadpool(
+            job_queue.submit, individual_id, file.file, content_hash
+        )
+        metrics.inc("sano_bytes_ingested_total", file.size or 0)
+        response.status_code = 202
+        return {"job_id": job_id, "status": "queued"}
+
+    start = time.perf_counter()
+    lines = codecs.iterdecode(file.file, "utf-8")
+    report = {}
+    try:
+        if partial:
+            report = await db_handler.ingest_file_partially(lines, individual_id)
+            rows_ingested = report["rows_ingested"]
+        else:
+            rows_ingested = await db_handler.ingest_file(lines, individual_id)
+    except InvalidFileError as e:
+        # Rows before the bad line stay committed, so the count is reported
+        raise HTTPException(
+            status_code=400,
+            detail={"message": str(e), "rows_ingested": e.rows_ingested},
+        )
+    except IngestError as e:
+        # Nothing is recorded against the file's hash, so it can be sent again
+        raise HTTPException(
+            status_code=500,
+            detail={"message": str(e), "rows_ingested": e.rows_ingested},
+        )
+    elapsed = time.perf_counter() - start
+    metrics.inc("sano_bytes_ingested_total", file.size or 0)
+    await db_handler.record_upload(
+        individual_id, content_hash, rows_ingested, report.get("rows_rejected", 0)
+    )
+
+    return {
+        "message": "Successfully uploaded data",
+        **report,
+        "rows_ingested": rows_ingested,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(rows_ingested / elapsed) if elapsed else None,
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def read_job(job_id: str):
+    """GET /jobs/<job_id>: returns the status and progress of a background ingest job"""
+    job = None
+    if job_queue is not None:
+        # On the database's own reader threads, whose connections are reused
+        job = await job_queue.read(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/genetic_data/bulk")
+async def bulk_insert_genetic_data(
+    files: List[UploadFile] = File(...),
+    individual_ids: Optional[List[str]] = Form(None),
+):
+    """
+    POST /genetic_data/bulk:
+    takes several sano files, for one or many individuals, and stores them in one request.
+    Each file is stored for the matching entry of individual_ids, or for the individual
+    named by its filename without the extension. Files are parsed in parallel processes.
+    """
+    if individual_ids is None:
+        individual_ids = [os.path.splitext(file.filename or "")[0] for file in files]
+    if len(individual_ids) != len(files):
+        raise HTTPException(
+            status_code=400, detail="individual_ids must match the uploaded files"
+        )
+
+    start = time.perf_counter()
+    uploads = [
+        (file.filename, individual_id, codecs.iterdecode(file.file, "utf-8"))
+        for file, individual_id in zip(files, individual_ids)
+    ]
+    results = await db_handler.bulk_ingest(uploads)
+    elapsed = time.perf_counter() - start
+    metrics.inc("sano_bytes_ingested_total", sum(file.size or 0 for file in files))
+
+    rows_ingested = sum(result["rows_ingested"] for result in results)
+    return {
+        "files": results,
+        "rows_ingested": rows_ingested,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(rows_ingested / elapsed) if elapsed else None,
+    }
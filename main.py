@@ -1,10 +1,87 @@
-from fastapi import FastAPI, Depends
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
 
-from .db_utils.database_handler import DatabaseHandler
-from .endpoints.endpoints import router, set_db_handler
+from fastapi import Depends, FastAPI
+from fastapi.concurrency import run_in_threadpool
 
-db_handler = DatabaseHandler("config/config.ini")
-app = FastAPI()
+from .db_utils.async_database_handler import (
+    DEFAULT_READER_THREADS,
+    AsyncDatabaseHandler,
+)
+from .db_utils.sharded_database_handler import open_database_handler
+from .endpoints.endpoints import (
+    probe_router,
+    require_ready,
+    router,
+    set_db_handler,
+    set_job_queue,
+    set_startup_error,
+)
+from .utils.compression import CompressionMiddleware
+from .utils.ingest_jobs import DEFAULT_SPOOL_DIR, DEFAULT_WORKERS, IngestJobQueue
+from .utils.metrics import MetricsMiddleware
 
-set_db_handler(db_handler)
-app.include_router(router, dependencies=[Depends(lambda: db_handler)]) 
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = "config/config.ini"
+
+
+def open_services(config_file: str) -> Tuple[AsyncDatabaseHandler, IngestJobQueue]:
+    """Opens the database and starts the ingest workers, resuming unfinished jobs"""
+    sync_db_handler = open_database_handler(config_file)
+    db_handler = AsyncDatabaseHandler(
+        sync_db_handler,
+        reader_threads=sync_db_handler.config.getint(
+            "database", "reader_threads", fallback=DEFAULT_READER_THREADS
+        ),
+        parse_processes=sync_db_handler.config.getint(
+            "database", "parse_processes", fallback=0
+        ),
+    )
+    job_queue = IngestJobQueue(
+        db_handler,
+        spool_dir=sync_db_handler.config.get(
+            "ingest", "spool_dir", fallback=DEFAULT_SPOOL_DIR
+        ),
+        workers=sync_db_handler.config.getint(
+            "ingest", "workers", fallback=DEFAULT_WORKERS
+        ),
+    )
+    job_queue.start()
+    return db_handler, job_queue
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Nothing is opened at import time. The database is opened off the event loop
+    # while the server already answers, with 503 until /ready reports it is done
+    services: Optional[Tuple[AsyncDatabaseHandler, IngestJobQueue]] = None
+
+    async def start() -> None:
+        nonlocal services
+        try:
+            services = await run_in_threadpool(open_services, CONFIG_FILE)
+        except Exception as e:
+            logger.exception("Startup failed")
+            set_startup_error(str(e))
+            return
+        set_db_handler(services[0])
+        set_job_queue(services[1])
+
+    startup = asyncio.create_task(start())
+    yield
+    await startup
+    if services is not None:
+        db_handler, job_queue = services
+        job_queue.stop()
+        db_handler.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+app.include_router(probe_router)
+app.include_router(router, dependencies=[Depends(require_ready)])
@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from datetime import date
 from enum import Enum
-from typing import Set
+from typing import Any, Sequence
 
 
 class ChromosomeEnum(Enum):
@@ -18,7 +18,20 @@ class AlleleEnum(Enum):
     T = "T"
 
 
-@dataclass
+# Integer codes used for storage. They are persisted, so new enum members must only
+# ever be appended.
+CHROMOSOME_CODES = {member.value: code for code, member in enumerate(ChromosomeEnum)}
+ALLELE_CODES = {member.value: code for code, member in enumerate(AlleleEnum)}
+
+SUPPORTED_CHROMOSOMES = frozenset(ChromosomeEnum)
+SUPPORTED_ALLELES = frozenset(AlleleEnum)
+
+# Value -> member, a dict lookup being much cheaper than calling the enum
+CHROMOSOMES = {member.value: member for member in ChromosomeEnum}
+ALLELES = {member.value: member for member in AlleleEnum}
+
+
+@dataclass(slots=True)
 class GeneticData:
     variant_id: str
     chromosome: ChromosomeEnum
@@ -28,25 +41,30 @@ class GeneticData:
     alternate_allele_frequency: float
 
     def __post_init__(self) -> None:
-        supported_chromosomes: Set[ChromosomeEnum] = set()
-        supported_alleles: Set[AlleleEnum] = set()
-
-        for memberC in ChromosomeEnum.__members__.values():
-            if memberC is not None:
-                supported_chromosomes.add(memberC)
-
-        for member in AlleleEnum.__members__.values():
-            if member is not None:
-                supported_alleles.add(member)
-
-        if self.chromosome not in supported_chromosomes:
+        if self.chromosome not in SUPPORTED_CHROMOSOMES:
             raise ValueError(f"Unsupported chromosome value: {self.chromosome}")
 
-        if self.reference_allele not in supported_alleles:
+        if self.reference_allele not in SUPPORTED_ALLELES:
             raise ValueError(f"Unsupported allele value: {self.reference_allele}")
 
-        if self.alternate_allele not in supported_alleles:
-            raise ValueError(f"Unsupported allele value: {self.reference_allele}")
+        if self.alternate_allele not in SUPPORTED_ALLELES:
+            raise ValueError(f"Unsupported allele value: {self.alternate_allele}")
+
+    @classmethod
+    def from_row(cls, row: Sequence[Any]) -> "GeneticData":
+        """
+        Builds a GeneticData from a (variant_id, chromosome, position,
+        reference_allele, alternate_allele, alternate_allele_frequency) row of
+        values the database has already validated, skipping `__post_init__`
+        """
+        record = object.__new__(cls)
+        record.variant_id = row[0]
+        record.chromosome = CHROMOSOMES[row[1]]
+        record.position = row[2]
+        record.reference_allele = ALLELES[row[3]]
+        record.alternate_allele = ALLELES[row[4]]
+        record.alternate_allele_frequency = row[5]
+        return record
 
 
 @dataclass
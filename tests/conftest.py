@@ -0,0 +1,12 @@
+import pytest
+
+from ..db_utils.database_handler import DatabaseHandler
+
+
+@pytest.fixture
+def db_handler(tmp_path):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(f"[database]\ndb_path = {tmp_path / 'data' / 'test.db'}\n")
+    handler = DatabaseHandler(str(config_file))
+    yield handler
+    handler.close()
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+
+from ..db_utils.async_database_handler import AsyncDatabaseHandler
+
+
+def test_reads_and_writes_round_trip(db_handler):
+    async_handler = AsyncDatabaseHandler(db_handler)
+
+    async def scenario():
+        await async_handler.insert_new_individual("individual123")
+        with open("tests/individual123.sano") as f:
+            rows_inserted = await async_handler.ingest_file(
+                f, "individual123", batch_size=3
+            )
+        return rows_inserted, await async_handler.get_individual_data("individual123")
+
+    rows_inserted, genetic_data = asyncio.run(scenario())
+
+    assert rows_inserted == 4
+    assert sorted(data.variant_id for data in genetic_data) == [
+        "rs12345",
+        "rs13579",
+        "rs24680",
+        "rs67890",
+    ]
+    async_handler.close()
+
+
+def test_writes_are_serialised_on_one_thread(db_handler):
+    async_handler = AsyncDatabaseHandler(db_handler)
+    writer_threads = set()
+    insert_new_individual = db_handler.insert_new_individual
+
+    def record_thread(individual_id):
+        writer_threads.add(threading.get_ident())
+        return insert_new_individual(individual_id)
+
+    db_handler.insert_new_individual = record_thread
+
+    async def scenario():
+        await asyncio.gather(
+            *(async_handler.insert_new_individual(f"individual{i}") for i in range(20))
+        )
+
+    asyncio.run(scenario())
+
+    assert len(writer_threads) == 1
+    assert len(db_handler.get_all_users()) == 20
+    async_handler.close()
+
+
+def test_bulk_ingest_reports_each_file(db_handler):
+    async_handler = AsyncDatabaseHandler(db_handler, parse_processes=2)
+    db_handler.insert_new_individual("individual123")
+    db_handler.insert_new_individual("individual456")
+
+    with open("tests/individual123.sano") as f:
+        lines = f.read().split("\n")
+    with open("tests/wrong_individual123.sano") as f:
+        wrong_lines = f.read().split("\n")
+    uploads = [
+        ("individual123.sano", "individual123", lines),
+        ("individual456.sano", "individual456", lines),
+        ("wrong.sano", "individual123", wrong_lines),
+        ("unknown.sano", "unknown", lines),
+    ]
+
+    results = asyncio.run(async_handler.bulk_ingest(uploads, batch_size=3))
+
+    assert [result["rows_ingested"] for result in results] == [4, 4, 0, 0]
+    assert "chromosome" in results[2]["error"]
+    assert results[3]["error"] == "Individual not found"
+    assert len(db_handler.get_individual_data("individual456")) == 4
+    async_handler.close()
@@ -0,0 +1,47 @@
+from ..benchmarks.generate_sano import generate_sano_lines
+from ..benchmarks.load import run_load_test
+from ..benchmarks.micro import run_micro_benchmarks
+from ..benchmarks.report import build_report, compare_reports
+from ..utils import file_parser
+
+
+def test_generated_sano_lines_parse():
+    lines = list(generate_sano_lines(100, seed=1))
+
+    rows = file_parser.parse_lines_to_rows(
+        lines[1:], file_parser.get_header_order(lines[0])
+    )
+
+    assert len(rows) == 100
+    assert rows[0][0] == "rs0"
+
+
+def test_generated_individuals_share_variants():
+    first = [line.rsplit(",", 1)[0] for line in generate_sano_lines(10, seed=1)]
+    second = [line.rsplit(",", 1)[0] for line in generate_sano_lines(10, seed=2)]
+
+    assert first == second
+
+
+def test_micro_benchmarks_report_throughput():
+    results = run_micro_benchmarks(200, n_individuals=2, repeat=1)
+
+    assert results["parse_columnar"]["rows"] == 200
+    assert results["insert_rows"]["rows"] == 400
+    assert results["get_individual_data"]["rows_per_second"] > 0
+
+
+def test_load_test_against_local_server():
+    results = run_load_test(100, n_individuals=2, n_reads=10, concurrency=4)
+
+    assert results["uploads"]["requests"] == 1
+    assert results["reads"]["requests"] == 10
+
+
+def test_compare_reports():
+    baseline = build_report({}, {"micro": {"parse": {"rows_per_second": 100.0}}})
+    candidate = build_report({}, {"micro": {"parse": {"rows_per_second": 250.0}}})
+
+    comparison = compare_reports(baseline, candidate)
+
+    assert comparison["micro.parse.rows_per_second"]["ratio"] == 2.5
@@ -0,0 +1,37 @@
+from ..db_utils.bloom import BloomFilter
+
+
+def test_added_items_are_always_found():
+    bloom = BloomFilter.for_capacity(1_000, 0.01)
+    bloom.update(f"rs{i}" for i in range(1_000))
+
+    assert all(f"rs{i}" in bloom for i in range(1_000))
+    assert not bloom.is_full()
+
+
+def test_false_positive_rate_is_near_the_error_rate():
+    bloom = BloomFilter.for_capacity(10_000, 0.01)
+    bloom.update(f"rs{i}" for i in range(10_000))
+
+    false_positives = sum(f"missing{i}" in bloom for i in range(10_000))
+
+    assert false_positives < 200
+
+
+def test_round_trips_through_bytes():
+    bloom = BloomFilter.for_capacity(10, 0.01)
+    bloom.update(["rs1", "rs2"])
+
+    copy = BloomFilter.from_bytes(
+        bloom.capacity, bloom.num_hashes, bytes(bloom.bits), bloom.count
+    )
+
+    assert "rs1" in copy and "rs2" in copy
+    assert copy.count == 2
+
+
+def test_is_full_past_capacity():
+    bloom = BloomFilter.for_capacity(2, 0.01)
+    bloom.update(["rs1", "rs2", "rs3"])
+
+    assert bloom.is_full()
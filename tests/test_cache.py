@@ -0,0 +1,53 @@
+from unittest.mock import patch
+
+from ..db_utils.cache import MISSING, TTLCache
+
+
+def test_get_and_set():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is MISSING
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(max_size=2, ttl=10)
+    with patch("time.monotonic", return_value=100):
+        cache.set("a", 1)
+    with patch("time.monotonic", return_value=111):
+        assert cache.get("a") is MISSING
+    assert cache.stats()["size"] == 0
+
+
+def test_discard_where():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set(("user1", None), 1)
+    cache.set(("user1", "rs123"), 2)
+    cache.set(("user2", None), 3)
+
+    cache.discard_where(lambda key: key[0] == "user1")
+
+    assert cache.stats()["size"] == 1
+    assert cache.get(("user2", None)) == 3
+
+
+def test_zero_size_disables_caching():
+    cache = TTLCache(max_size=0, ttl=60)
+    cache.set("a", 1)
+
+    assert cache.get("a") is MISSING
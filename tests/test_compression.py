@@ -0,0 +1,58 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from ..utils import compression
+from ..utils.compression import CompressionMiddleware, negotiate_encoding
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware)
+
+
+@app.get("/stream")
+def stream():
+    return StreamingResponse(iter([b"a" * 100, b"b" * 100]), media_type="text/plain")
+
+
+@app.get("/small")
+def small():
+    return "ok"
+
+
+client = TestClient(app)
+
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "_import_zstandard", lambda: None)
+
+    assert negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert negotiate_encoding("zstd") is None
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("*") == "gzip"
+    assert negotiate_encoding("") is None
+
+
+def test_streamed_response_is_compressed_chunk_by_chunk():
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert response.text == "a" * 100 + "b" * 100
+
+
+def test_small_response_is_not_compressed():
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+    assert response.json() == "ok"
+
+
+def test_zstd_is_preferred_when_available():
+    pytest.importorskip("zstandard")
+
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip, zstd"})
+
+    # The test client decodes zstd itself when zstandard is installed
+    assert response.headers["content-encoding"] == "zstd"
+    assert response.text == "a" * 100 + "b" * 100
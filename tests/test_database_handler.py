@@ -0,0 +1,463 @@
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from ..db_utils.database_handler import (
+    MAX_POSITION,
+    SCHEMA_VERSION,
+    VARIANT_SUMMARY_UPSERT,
+    DatabaseHandler,
+    parse_regions,
+)
+from ..utils.query_profiler import ProfilingConnection, query_profiler
+
+
+def test_connection_is_reused_within_a_thread(db_handler):
+    assert db_handler._connect() is db_handler._connect()
+
+
+def test_connection_is_not_shared_between_threads(db_handler):
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(db_handler._connect()))
+    thread.start()
+    thread.join()
+
+    assert connections[0] is not db_handler._connect()
+
+
+def test_connection_pragmas(db_handler):
+    conn = db_handler._connect()
+
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert conn.execute("PRAGMA cache_size").fetchone()[0] == -64000
+
+
+def test_close_releases_all_connections(db_handler):
+    conn = db_handler._connect()
+    db_handler.close()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    assert db_handler._connect() is not conn
+
+
+def test_insert_and_read_individual_data(db_handler):
+    db_handler.insert_new_individual("individual123")
+    db_handler.insert_genetic_rows_to_db(
+        [("rs12345", "1", 1234567, "A", "G", 0.12)], "individual123"
+    )
+
+    result = db_handler.get_individual_data("individual123")
+
+    assert len(result) == 1
+    assert result[0].variant_id == "rs12345"
+    assert result[0].position == 1234567
+
+
+def test_schema_is_migrated_to_latest_version(db_handler):
+    conn = db_handler._connect()
+    indexes = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    }
+
+    assert db_handler.schema_version == SCHEMA_VERSION
+    assert db_handler.get_schema_version() == SCHEMA_VERSION
+    assert {"idx_users_individual_id", "idx_genetic_data_user_variant"} <= indexes
+
+
+def test_legacy_database_is_upgraded_in_place(tmp_path):
+    db_path = tmp_path / "legacy.db"
+    conn = sqlite3.connect(db_path)
+    conn.executescript(
+        """
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            individual_id TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE genetic_data_table (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            variant_id TEXT NOT NULL,
+            chromosome TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            reference_allele TEXT NOT NULL,
+            alternate_allele TEXT NOT NULL,
+            alternate_allele_frequency FLOAT NOT NULL
+        );
+        INSERT INTO users (individual_id) VALUES ('individual123'), ('individual123');
+        INSERT INTO genetic_data_table (
+            user_id, variant_id, chromosome, position,
+            reference_allele, alternate_allele, alternate_allele_frequency
+        ) VALUES
+            (2, 'rs12345', '1', 1234567, 'A', 'G', 0.12),
+            (2, 'rs12345', '1', 1234567, 'A', 'G', 0.12);
+        """
+    )
+    conn.close()
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(f"[database]\ndb_path = {db_path}\n")
+
+    handler = DatabaseHandler(str(config_file))
+
+    assert handler.schema_version == SCHEMA_VERSION
+    assert len(handler.get_all_users()) == 1
+    assert len(handler.get_individual_data("individual123")) == 1
+    assert handler.insert_new_individual("individual123") == (
+        "User individual123 already exists"
+    )
+    handler.close()
+
+
+def test_iter_individual_data_yields_bounded_batches(db_handler):
+    db_handler.insert_new_individual("individual123")
+    db_handler.insert_genetic_rows_to_db(
+        [(f"rs{i}", "1", i, "A", "G", 0.5) for i in range(5)], "individual123"
+    )
+
+    batches = list(db_handler.iter_individual_data("individual123", batch_size=2))
+
+    assert [len(rows) for rows in batches] == [2, 2, 1]
+    assert batches[0][0] == ("rs0", "1", 0, "A", "G", 0.5)
+    assert db_handler.iter_individual_data("unknown") is None
+
+
+def test_iter_individual_data_raises_when_a_read_fails(db_handler):
+    db_handler.insert_new_individual("individual123")
+    db_handler.insert_genetic_rows_to_db(
+        [(f"rs{i}", "1", i, "A", "G", 0.5) for i in range(5)], "individual123"
+    )
+    # Fails on the fourth row, once the first batch has been yielded
+    batches = db_handler._iter_query_batches(
+        "SELECT CASE WHEN id > 3 THEN json('bad') ELSE id END"
+        " FROM genetic_data_table ORDER BY id",
+        (),
+        2,
+    )
+
+    assert len(next(batches)) == 2
+    with pytest.raises(sqlite3.OperationalError):
+        next(batches)
+
+
+def test_get_individual_data_keyset_pages(db_handler):
+    db_handler.insert_new_individual("individual123")
+    db_handler.insert_genetic_rows_to_db(
+        [(f"rs{i}", "1", i, "A", "G", 0.5) for i in range(5)], "individual123"
+    )
+
+    first_page = db_handler.get_individual_data("individual123", limit=3)
+    second_page = db_handler.get_individual_data(
+        "individual123", limit=3, after=first_page["next_cursor"]
+    )
+
+    assert [data.variant_id for data in first_page["data"]] == ["rs0", "rs1", "rs2"]
+    assert [data.variant_id for data in second_page["data"]] == ["rs3", "rs4"]
+    assert second_page["next_cursor"] is None
+
+
+def test_get_individual_data_projection(db_handler):
+    db_handler.insert_new_individual("individual123")
+    db_handler.insert_genetic_rows_to_db(
+        [("rs12345", "1", 1234567, "A", "G", 0.12)], "individual123"
+    )
+
+    result = db_handler.get_individual_data(
+        "individual123", fields="variant_id,alternate_allele_frequency"
+    )
+
+    assert result == [{"variant_id": "rs12345", "alternate_allele_frequency": 0.12}]
+    with pytest.raises(ValueError):
+        db_handler.get_individual_data("individual123", fields="id; DROP TABLE users")
+
+
+def test_parse_regions():
+    assert parse_regions("1:100-250,X:5-10") == [("1", 100, 250), ("X", 5, 10)]
+    assert parse_regions("Y") == [("Y", 0, MAX_POSITION)]
+    for invalid in ["3:1-10", "1:10", "1:a-b", "1:10-1"]:
+        with pytest.raises(ValueError):
+            parse_regions(invalid)
+
+
+def test_get_individual_data_by_region(db_handler):
+    db_handler.insert_new_individual("individual123")
+    db_handler.insert_genetic_rows_to_db(
+        [
+            ("rs1", "1", 100, "A", "G", 0.5),
+            ("rs2", "1", 300, "A", "G", 0.5),
+            ("rs3", "2", 150, "A", "G", 0.5),
+            ("rs4", "X", 150, "A", "G", 0.5),
+        ],
+        "individual123",
+    )
+
+    result = db_handler.get_individual_data("individual123", region="1:50-200,2")
+
+    assert [data.variant_id for data in result] == ["rs1", "rs3"]
+
+
+def test_get_individual_data_long_variant_list(db_handler):
+    db_handler.insert_new_individual("individual123")
+    db_handler.insert_genetic_rows_to_db(
+        [(f"rs{i}", "1", i, "A", "G", 0.5) for i in range(10)], "individual123"
+    )
+    variants = ",".join(f"rs{i}" for i in range(0, 100_000, 3))
+
+    result = db_handler.get_individual_data("individual123", variants)
+
+    assert [data.variant_id for data in result] == ["rs0", "rs3", "rs6", "rs9"]
+
+
+def test_get_individual_data_is_cached_until_new_data_is_inserted(db_handler):
+    db_handler.insert_new_individual("individual123")
+    db_handler.insert_genetic_rows_to_db(
+        [("rs1", "1", 100, "A", "G", 0.5)], "individual123"
+    )
+
+    first = db_handler.get_individual_data("individual123")
+    second = db_handler.get_individual_data("individual123")
+    db_handler.insert_genetic_rows_to_db(
+        [("rs2", "1", 200, "A", "G", 0.5)], "individual123"
+    )
+    third = db_handler.get_individual_data("individual123")
+
+    assert second is first
+    assert len(third) == 2
+    assert db_handler.cache_stats()["genetic_data"]["hits"] == 1
+
+
+@pytest.mark.parametrize("read", ["get_individual_data", "get_individual_rows"])
+def test_result_read_during_an_insert_is_not_cached(db_handler, monkeypatch, read):
+    db_handler.insert_new_individual("a")
+    db_handler.insert_genetic_rows_to_db([("rs1", "1", 100, "A", "G", 0.5)], "a")
+    fetch = db_handler._fetch_individual_rows
+
+    def fetch_then_insert(*args):
+        # The insert commits after the read's query but before it is cached
+        fetched = fetch(*args)
+        db_handler.insert_genetic_rows_to_db([("rs2", "1", 200, "A", "G", 0.5)], "a")
+        return fetched
+
+    monkeypatch.setattr(db_handler, "_fetch_individual_rows", fetch_then_insert)
+    getattr(db_handler, read)("a")
+    monkeypatch.undo()
+
+    assert len(db_handler.get_individual_data("a")) == 2
+    assert len(db_handler.get_individual_rows("a")[1]) == 2
+
+
+def test_individual_id_lookup_is_cached(db_handler):
+    assert db_handler.get_id_for_individual_id("individual123") is None
+    db_handler.insert_new_individual("individual123")
+
+    user_id = db_handler.get_id_for_individual_id("individual123")
+
+    assert user_id is not None
+    assert db_handler.get_id_for_individual_id("individual123") == user_id
+    assert db_handler.cache_stats()["individual_ids"]["hits"] == 1
+
+
+def insert_cohort(db_handler):
+    for individual_id, frequencies in [("a", (0.2, 0.9)), ("b", (0.6, 0.1))]:
+        db_handler.insert_new_individual(individual_id)
+        db_handler.insert_genetic_rows_to_db(
+            [
+                ("rs1", "1", 100, "A", "G", frequencies[0]),
+                ("rs2", "2", 200, "C", "T", frequencies[1]),
+            ],
+            individual_id,
+        )
+
+
+@pytest.mark.parametrize("variant_summary", [True, False])
+def test_get_cohort_summary(db_handler, variant_summary):
+    db_handler.variant_summary = variant_summary
+    insert_cohort(db_handler)
+
+    result = db_handler.get_cohort_summary()
+
+    assert [row["variant_id"] for row in result] == ["rs1", "rs2"]
+    assert result[0]["count"] == 2
+    assert result[0]["mean_frequency"] == pytest.approx(0.4)
+    assert (result[0]["min_frequency"], result[0]["max_frequency"]) == (0.2, 0.6)
+    assert db_handler.get_cohort_summary(region="2")[0]["variant_id"] == "rs2"
+    assert db_handler.get_cohort_summary("rs2,rs9")[0]["mean_frequency"] == 0.5
+
+
+def test_get_cohort_summary_carriers_and_pages(db_handler):
+    insert_cohort(db_handler)
+
+    result = db_handler.get_cohort_summary(carrier_threshold=0.5)
+    first_page = db_handler.get_cohort_summary(limit=1)
+    second_page = db_handler.get_cohort_summary(limit=1, after=first_page["next_cursor"])
+
+    assert [row["carriers"] for row in result] == [1, 1]
+    assert first_page["data"][0]["variant_id"] == "rs1"
+    assert second_page["data"][0]["variant_id"] == "rs2"
+
+
+def test_variant_summary_is_rebuilt_when_behind(db_handler, tmp_path):
+    db_handler.variant_summary = False
+    insert_cohort(db_handler)
+    db_handler.close()
+
+    handler = DatabaseHandler(str(tmp_path / "config.ini"))
+
+    assert handler.get_cohort_summary()[0]["count"] == 2
+    handler.close()
+
+
+def test_variant_summary_upsert_reads_only_new_rows(db_handler):
+    plan = db_handler._connect().execute(
+        f"EXPLAIN QUERY PLAN {VARIANT_SUMMARY_UPSERT}", (0,)
+    )
+    details = [row[-1] for row in plan]
+
+    assert any(
+        detail.startswith("SEARCH genetic_data_table USING INTEGER PRIMARY KEY")
+        for detail in details
+    )
+    assert not any(detail.startswith("SCAN genetic_data_table") for detail in details)
+    assert "USE TEMP B-TREE FOR GROUP BY" in details
+
+
+def test_inserting_a_variant_twice_keeps_one_row(db_handler):
+    insert_cohort(db_handler)
+    db_handler.insert_genetic_rows_to_db(
+        [("rs1", "1", 100, "A", "G", 0.7), ("rs3", "1", 300, "A", "G", 0.7)], "a"
+    )
+
+    assert len(db_handler.get_individual_data("a")) == 3
+    assert db_handler.get_cohort_summary("rs1")[0]["count"] == 2
+
+
+def test_uploads_are_recorded_by_content_hash(db_handler):
+    db_handler.insert_new_individual("individual123")
+
+    assert db_handler.get_upload("individual123", "abc") is None
+    db_handler.record_upload("individual123", "abc", 4, 1)
+
+    upload = db_handler.get_upload("individual123", "abc")
+    assert (upload["rows_inserted"], upload["rows_rejected"]) == (4, 1)
+    assert db_handler.get_upload("individual123", "def") is None
+
+
+def test_variant_filter_skips_queries_for_absent_variants(db_handler):
+    insert_cohort(db_handler)
+
+    user_id = db_handler.get_id_for_individual_id("a")
+
+    assert db_handler._may_hold_any(user_id, "rs9,rs1")
+    assert not db_handler._may_hold_any(user_id, "rs9,rs8")
+    assert db_handler.get_individual_data("a", "rs9") == []
+    assert list(db_handler.iter_individual_data("a", "rs9")) == []
+    assert db_handler.get_present_variants("a", "rs1,rs9") == {
+        "rs1": True,
+        "rs9": False,
+    }
+    assert db_handler.get_present_variants("missing", "rs1") is None
+
+
+def test_variant_filter_is_saved_and_topped_up(db_handler, tmp_path):
+    db_handler.variant_filter_min_capacity = 2
+    db_handler.insert_new_individual("a")
+    db_handler.insert_genetic_rows_to_db(
+        [(f"rs{i}", "1", i, "A", "G", 0.5) for i in range(1, 6)], "a"
+    )
+    db_handler.save_variant_filter("a")
+    user_id = db_handler.get_id_for_individual_id("a")
+    assert not db_handler._may_hold_any(user_id, "rs6")
+    # Rows added after the filter was saved or cached are still found
+    db_handler.insert_genetic_rows_to_db(
+        [(f"rs{i}", "1", i, "A", "G", 0.5) for i in range(6, 30)], "a"
+    )
+    assert db_handler._may_hold_any(user_id, "rs6")
+    db_handler.close()
+
+    handler = DatabaseHandler(str(tmp_path / "config.ini"))
+    variant_filter = handler._get_variant_filter(user_id)
+    assert variant_filter.capacity >= 29
+    assert all(f"rs{i}" in variant_filter for i in range(1, 30))
+    assert handler.get_present_variants("a", "rs29,rs30") == {
+        "rs29": True,
+        "rs30": False,
+    }
+
+    handler.save_variant_filter("a")
+    stored = handler._connect().execute(
+        "SELECT item_count, max_row_id FROM variant_filters WHERE user_id = ?",
+        (user_id,),
+    )
+    assert stored.fetchone() == (29, 29)
+    handler.close()
+
+
+def test_insert_new_individuals_reports_existing_and_repeated(db_handler):
+    db_handler.insert_new_individual("a")
+
+    result = db_handler.insert_new_individuals(["b", "a", "c", "b", "b"])
+
+    assert result == {"created": ["b", "c"], "existing": ["b", "a"]}
+    assert db_handler.get_id_for_individual_id("c")
+    assert db_handler.get_users_state()[0] == 3
+
+
+def test_users_are_listed_in_pages(db_handler):
+    assert db_handler.get_users_state() == (0, 0)
+    db_handler.insert_new_individuals(["a", "b", "c"])
+
+    first_users, cursor = db_handler.get_users_page(2)
+    last_users, last_cursor = db_handler.get_users_page(2, cursor)
+
+    assert [user.username for user in first_users] == ["a", "b"]
+    assert [user.username for user in last_users] == ["c"]
+    assert last_cursor is None
+    assert db_handler.get_users_state()[0] == 3
+
+
+@pytest.fixture
+def profiled_db_handler(tmp_path):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        f"[database]\ndb_path = {tmp_path / 'test.db'}\n"
+        "[cohort]\nvariant_summary = false\n"
+        f"[profiling]\nenabled = true\nslow_query_ms = 0\n"
+        f"slow_log = {tmp_path / 'slow.log'}\n"
+    )
+    query_profiler.reset()
+    handler = DatabaseHandler(str(config_file))
+    yield handler
+    handler.close()
+    query_profiler.configure(slow_log_path=None)
+    query_profiler.enabled = False
+    query_profiler.reset()
+
+
+def test_statements_are_profiled_without_values(profiled_db_handler, tmp_path):
+    assert isinstance(profiled_db_handler._connect(), ProfilingConnection)
+    insert_cohort(profiled_db_handler)
+    profiled_db_handler.get_individual_data("a", "rs1,rs2,rs3")
+    profiled_db_handler.get_cohort_summary()
+
+    report = query_profiler.report(top=1_000)
+    statements = report["top_statements"]
+    shapes = [
+        shape["shape"]
+        for statement in statements
+        for shape in statement["parameter_shapes"]
+    ]
+    slow_log = (tmp_path / "slow.log").read_text().splitlines()
+
+    assert report["enabled"] and report["threshold_ms"] == 0
+    assert [s["total_ms"] for s in statements] == sorted(
+        (s["total_ms"] for s in statements), reverse=True
+    )
+    assert any("json[3]" in shape for shape in shapes)
+    assert any(statement["full_scans"] for statement in statements)
+    assert all(statement["plan"] is not None for statement in statements)
+    assert slow_log and "rs1" not in "".join(slow_log)
+    assert {"statement", "parameters", "plan", "ms"} <= set(json.loads(slow_log[0]))
@@ -1,7 +1,13 @@
-from unittest.mock import MagicMock
-from ..endpoints.endpoints import set_db_handler
+import json
+import sqlite3
+import time
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from ..endpoints.endpoints import set_db_handler, set_job_queue, set_startup_error
 from pydantic import BaseModel
 from fastapi.testclient import TestClient
+from .. import main
 from ..main import app
 
 
@@ -11,6 +17,7 @@ client = TestClient(app)
 def test_read_all_users():
     mock_db_handler = MagicMock()
     mock_db_handler.get_all_users.return_value = ["user1", "user2", "user3"]
+    mock_db_handler.get_users_state.return_value = (3, 3)
     set_db_handler(mock_db_handler)
 
     response = client.get("/individuals")
@@ -18,14 +25,134 @@ def test_read_all_users():
     assert response.json() == ["user1", "user2", "user3"]
 
 
+def test_read_all_users_page_and_etag():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_users_page.return_value = (["user1", "user2"], 2)
+    mock_db_handler.get_users_state.return_value = (3, 3)
+    set_db_handler(mock_db_handler)
+
+    response = client.get("/individuals?limit=2")
+    assert response.json() == {"data": ["user1", "user2"], "next_cursor": 2}
+    assert response.headers["x-total-count"] == "3"
+    mock_db_handler.get_users_page.assert_called_once_with(2, None)
+
+    etag = response.headers["etag"]
+    response = client.get("/individuals?limit=2", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    mock_db_handler.get_users_page.assert_called_once()
+
+    mock_db_handler.get_users_state.return_value = (4, 4)
+    response = client.get("/individuals?limit=2", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_create_individuals_batch():
+    mock_db_handler = MagicMock()
+    mock_db_handler.insert_new_individuals.return_value = {
+        "created": ["a"],
+        "existing": ["b"],
+    }
+    set_db_handler(mock_db_handler)
+
+    response = client.post("/individuals/batch", json={"individual_ids": ["a", "b"]})
+    assert response.json() == {"created": ["a"], "existing": ["b"]}
+    mock_db_handler.insert_new_individuals.assert_called_once_with(["a", "b"])
+
+
 def test_read_individual():
     mock_db_handler = MagicMock()
-    mock_db_handler.get_individual_data.return_value = {"variant": "rs123", "value": "A"}
+    mock_db_handler.get_individual_rows.return_value = (
+        ("variant", "value"),
+        [("rs123", "A")],
+        None,
+    )
     set_db_handler(mock_db_handler)
 
     response = client.get("/individuals/user1/genetic-data?variants=rs123")
     assert response.status_code == 200
-    assert response.json() == {"variant": "rs123", "value": "A"}
+    assert response.json() == [{"variant": "rs123", "value": "A"}]
+
+
+def test_read_individual_unknown_individual():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_individual_rows.return_value = None
+    set_db_handler(mock_db_handler)
+
+    response = client.get("/individuals/user1/genetic-data")
+    assert response.text == "\"User not found\""
+
+
+def test_read_individual_compact_encodings():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_individual_rows.return_value = (
+        ("variant_id", "position"),
+        [("rs123", 100), ("rs456", 200)],
+        None,
+    )
+    set_db_handler(mock_db_handler)
+
+    response = client.get(
+        "/individuals/user1/genetic-data",
+        headers={"Accept": "application/vnd.sano.columns+json"},
+    )
+    assert response.json() == {"variant_id": ["rs123", "rs456"], "position": [100, 200]}
+    assert "Accept" in response.headers["vary"].split(", ")
+
+    msgpack = pytest.importorskip("msgpack")
+    response = client.get(
+        "/individuals/user1/genetic-data", headers={"Accept": "application/msgpack"}
+    )
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == {
+        "fields": ["variant_id", "position"],
+        "rows": [["rs123", 100], ["rs456", 200]],
+    }
+
+
+def test_read_individual_is_compressed_when_accepted():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_individual_rows.return_value = (
+        ("variant_id",),
+        [(f"rs{i}",) for i in range(1000)],
+        None,
+    )
+    set_db_handler(mock_db_handler)
+
+    response = client.get(
+        "/individuals/user1/genetic-data", headers={"Accept-Encoding": "gzip"}
+    )
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < 5000
+    assert len(response.json()) == 1000
+
+
+def test_read_cohort_variants():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_cohort_summary.return_value = [{"variant_id": "rs123", "count": 2}]
+    set_db_handler(mock_db_handler)
+
+    response = client.get("/cohort/variants?region=1:1-10&carrier_threshold=0.5")
+
+    assert response.json() == [{"variant_id": "rs123", "count": 2}]
+    mock_db_handler.get_cohort_summary.assert_called_once_with(
+        None, "1:1-10", carrier_threshold=0.5, limit=None, after=None
+    )
+
+
+def test_export_binary():
+    mock_db_handler = MagicMock()
+    mock_db_handler.export_genetic_data.return_value = (
+        {1: "user1"},
+        iter([[(1, "rs123", 0, 100, 0, 1, 0.5)]]),
+    )
+    set_db_handler(mock_db_handler)
+
+    response = client.get("/export?individuals=user1&format=binary")
+
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.content.startswith(b"SANOBIN1")
+    mock_db_handler.export_genetic_data.assert_called_once_with(["user1"])
 
 
 def test_create_individual():
@@ -40,8 +167,14 @@ def test_create_individual():
     mock_db_handler.insert_new_individual.assert_called_once_with("user123")
 
 
+def inserted_rows(rows, individual_id):
+    return len(rows)
+
+
 def test_insert_individual_data():
     mock_db_handler = MagicMock()
+    mock_db_handler.get_upload.return_value = None
+    mock_db_handler.insert_genetic_rows_to_db.side_effect = inserted_rows
     set_db_handler(mock_db_handler)
 
     file_content = open("tests/individual123.sano").read()
@@ -52,4 +185,336 @@ def test_insert_individual_data():
     )
 
     assert response.status_code == 200
-    assert response.text == "\"Successfully uploaded data\""
\ No newline at end of file
+    assert response.json()["message"] == "Successfully uploaded data"
+    assert response.json()["rows_ingested"] == 4
+    assert mock_db_handler.insert_genetic_rows_to_db.call_count == 1
+
+
+def test_insert_individual_data_counts_inserted_rows_and_failures():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_upload.return_value = None
+    mock_db_handler.insert_genetic_rows_to_db.return_value = 0
+    set_db_handler(mock_db_handler)
+    file_content = open("tests/individual123.sano").read()
+
+    response = client.post(
+        "/individuals/user123/genetic_data",
+        files={"file": ("test_file.txt", file_content)}
+    )
+    assert response.json()["rows_ingested"] == 0
+
+    mock_db_handler.record_upload.reset_mock()
+    mock_db_handler.insert_genetic_rows_to_db.side_effect = sqlite3.OperationalError(
+        "disk I/O error"
+    )
+    response = client.post(
+        "/individuals/user123/genetic_data",
+        files={"file": ("test_file.txt", file_content)}
+    )
+    assert response.status_code == 500
+    assert response.json()["detail"]["rows_ingested"] == 0
+    mock_db_handler.record_upload.assert_not_called()
+
+
+def test_insert_individual_data_rejects_invalid_files():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_upload.return_value = None
+    mock_db_handler.insert_genetic_rows_to_db.side_effect = inserted_rows
+    set_db_handler(mock_db_handler)
+    header, row = open("tests/individual123.sano").read().splitlines()[:2]
+
+    for file_content in ["", "rs1,1,1,A,G,0.5\n", "#id,chromosome\n"]:
+        for query in ["", "?partial=true"]:
+            response = client.post(
+                f"/individuals/user123/genetic_data{query}",
+                files={"file": ("test_file.txt", file_content)}
+            )
+            assert response.status_code == 400
+            assert response.json()["detail"] == {
+                "message": "Invalid or missing header line",
+                "rows_ingested": 0,
+            }
+
+    # The first batch is committed before the bad row in the second is reached
+    file_content = "\n".join([header] + [row] * 10_000 + ["rs2,1,1,A,G"])
+    response = client.post(
+        "/individuals/user123/genetic_data",
+        files={"file": ("test_file.txt", file_content)}
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"]["rows_ingested"] == 10_000
+    assert "Expected 6 fields" in response.json()["detail"]["message"]
+    mock_db_handler.record_upload.assert_not_called()
+
+
+def test_insert_individual_data_unknown_individual():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_id_for_individual_id.return_value = None
+    set_db_handler(mock_db_handler)
+
+    file_content = open("tests/individual123.sano").read()
+
+    response = client.post(
+        "/individuals/user123/genetic_data",
+        files={"file": ("test_file.txt", file_content)}
+    )
+
+    assert response.status_code == 200
+    assert response.text == "\"Individual not found\""
+    mock_db_handler.insert_genetic_rows_to_db.assert_not_called()
+
+
+def test_insert_individual_data_in_background():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_upload.return_value = None
+    set_db_handler(mock_db_handler)
+    mock_job_queue = MagicMock()
+    mock_job_queue.submit.return_value = "job1"
+    set_job_queue(mock_job_queue)
+
+    response = client.post(
+        "/individuals/user123/genetic_data?background=true",
+        files={"file": ("test_file.txt", open("tests/individual123.sano").read())}
+    )
+
+    assert response.status_code == 202
+    assert response.json() == {"job_id": "job1", "status": "queued"}
+    assert mock_job_queue.submit.call_args[0][0] == "user123"
+
+    response = client.post(
+        "/individuals/user123/genetic_data?background=true&partial=true",
+        files={"file": ("test_file.txt", open("tests/individual123.sano").read())}
+    )
+    assert response.status_code == 400
+    assert mock_job_queue.submit.call_count == 1
+
+
+def test_insert_individual_data_partially():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_upload.return_value = None
+    mock_db_handler.insert_genetic_rows_to_db.side_effect = inserted_rows
+    set_db_handler(mock_db_handler)
+    file_content = (
+        open("tests/individual123.sano").read() + "\nrs99999,3,1,A,G,0.5\n"
+    )
+
+    response = client.post(
+        "/individuals/user123/genetic_data?partial=true",
+        files={"file": ("test_file.txt", file_content)}
+    )
+
+    assert response.json()["rows_ingested"] == 4
+    assert response.json()["rows_rejected"] == 1
+    assert response.json()["errors"][0]["line"] == 6
+    mock_db_handler.record_upload.assert_called_once()
+    assert mock_db_handler.record_upload.call_args[0][2:] == (4, 1)
+
+
+def test_insert_individual_data_already_uploaded():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_upload.return_value = {"rows_inserted": 4}
+    set_db_handler(mock_db_handler)
+
+    response = client.post(
+        "/individuals/user123/genetic_data",
+        files={"file": ("test_file.txt", open("tests/individual123.sano").read())}
+    )
+
+    assert response.json()["message"] == "File already uploaded"
+    mock_db_handler.insert_genetic_rows_to_db.assert_not_called()
+
+
+def test_read_job():
+    mock_job_queue = MagicMock()
+    mock_job_queue.read = AsyncMock(
+        side_effect=lambda job_id: (
+            {"job_id": "job1", "status": "running"} if job_id == "job1" else None
+        )
+    )
+    set_job_queue(mock_job_queue)
+
+    assert client.get("/jobs/job1").json()["status"] == "running"
+    assert client.get("/jobs/missing").status_code == 404
+
+
+def test_read_individual_stream_ndjson():
+    mock_db_handler = MagicMock()
+    mock_db_handler.iter_individual_data.return_value = iter(
+        [[("rs123", "1", 100, "A", "G", 0.5)], [("rs456", "X", 200, "C", "T", 0.25)]]
+    )
+    set_db_handler(mock_db_handler)
+
+    response = client.get("/individuals/user1/genetic-data?stream=ndjson")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "Accept" in response.headers["vary"].split(", ")
+    lines = response.text.splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1]) == {
+        "variant_id": "rs456",
+        "chromosome": "X",
+        "position": 200,
+        "reference_allele": "C",
+        "alternate_allele": "T",
+        "alternate_allele_frequency": 0.25,
+    }
+
+
+def test_read_individual_stream_json_array():
+    mock_db_handler = MagicMock()
+    mock_db_handler.iter_individual_data.return_value = iter(
+        [[("rs123", "1", 100, "A", "G", 0.5)], [("rs456", "X", 200, "C", "T", 0.25)]]
+    )
+    set_db_handler(mock_db_handler)
+
+    response = client.get("/individuals/user1/genetic-data?stream=json")
+
+    assert response.status_code == 200
+    assert [row["variant_id"] for row in response.json()] == ["rs123", "rs456"]
+
+
+def test_read_individual_stream_unknown_individual():
+    mock_db_handler = MagicMock()
+    mock_db_handler.iter_individual_data.return_value = None
+    set_db_handler(mock_db_handler)
+
+    response = client.get("/individuals/user1/genetic-data?stream=ndjson")
+
+    assert response.json() == "User not found"
+
+
+def test_read_individual_page_and_fields():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_individual_rows.return_value = (
+        ("variant_id",),
+        [("rs123",)],
+        7,
+    )
+    set_db_handler(mock_db_handler)
+
+    response = client.get(
+        "/individuals/user1/genetic-data?fields=variant_id&limit=1&after=3"
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"data": [{"variant_id": "rs123"}], "next_cursor": 7}
+    mock_db_handler.get_individual_rows.assert_called_once_with(
+        "user1", None, fields="variant_id", limit=1, after=3, region=None
+    )
+
+
+def test_read_individual_unknown_fields():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_individual_rows.side_effect = ValueError("Unknown fields")
+    set_db_handler(mock_db_handler)
+
+    response = client.get("/individuals/user1/genetic-data?fields=password")
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown fields"
+
+
+def test_bulk_insert_genetic_data():
+    mock_db_handler = MagicMock()
+    mock_db_handler.insert_genetic_rows_to_db.side_effect = inserted_rows
+    set_db_handler(mock_db_handler)
+
+    file_content = open("tests/individual123.sano").read()
+
+    response = client.post(
+        "/genetic_data/bulk",
+        files=[
+            ("files", ("individual123.sano", file_content)),
+            ("files", ("individual456.sano", file_content)),
+        ],
+    )
+
+    assert response.status_code == 200
+    assert response.json()["rows_ingested"] == 8
+    assert [result["individual_id"] for result in response.json()["files"]] == [
+        "individual123",
+        "individual456",
+    ]
+
+
+def test_read_metrics():
+    mock_db_handler = MagicMock()
+    mock_db_handler.cache_stats.return_value = {
+        "individual_ids": {"hits": 3, "misses": 1, "size": 1, "max_size": 10}
+    }
+    mock_db_handler.pool_stats.return_value = {"open_connections": 2}
+    mock_db_handler.get_users_state.return_value = (0, 0)
+    set_db_handler(mock_db_handler)
+    client.get("/individuals")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'sano_cache_hits{cache="individual_ids"} 3' in response.text
+    assert "sano_pool_open_connections 2" in response.text
+    assert 'endpoint="/individuals"' in response.text
+
+
+def test_read_query_profile():
+    set_db_handler(MagicMock())
+
+    response = client.get("/debug/queries?top=5")
+    assert response.status_code == 200
+    assert {"enabled", "threshold_ms", "top_statements"} <= set(response.json())
+
+    response = client.post("/debug/queries/reset")
+    assert response.json()["distinct_statements"] == 0
+
+
+def test_head_individual_variants():
+    mock_db_handler = MagicMock()
+    mock_db_handler.get_present_variants.return_value = {"rs123": True, "rs9": False}
+    set_db_handler(mock_db_handler)
+
+    response = client.head("/individuals/user1/genetic-data?variants=rs123,rs9")
+    assert response.status_code == 200
+    mock_db_handler.get_present_variants.return_value = {"rs9": False}
+    response = client.head("/individuals/user1/genetic-data?variants=rs9")
+    assert response.status_code == 404
+    response = client.get("/individuals/user1/variants/exists?variants=rs9")
+    assert response.json() == {"rs9": False}
+
+
+def test_requests_wait_for_startup():
+    set_db_handler(None)
+
+    assert client.get("/individuals").status_code == 503
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "starting"
+
+
+def test_lifespan_opens_database_off_the_event_loop(tmp_path, monkeypatch):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        f"[database]\ndb_path = {tmp_path / 'data' / 'test.db'}\n"
+        f"[ingest]\nspool_dir = {tmp_path / 'spool'}\n"
+    )
+    monkeypatch.setattr(main, "CONFIG_FILE", str(config_file))
+    set_db_handler(None)
+
+    with TestClient(app) as lifespan_client:
+        deadline = time.time() + 10
+        while lifespan_client.get("/ready").status_code != 200:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        assert lifespan_client.get("/individuals").json() is None
+
+
+def test_failed_startup_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "CONFIG_FILE", str(tmp_path / "missing.ini"))
+    set_db_handler(None)
+
+    with TestClient(app) as lifespan_client:
+        deadline = time.time() + 10
+        while lifespan_client.get("/ready").json()["status"] == "starting":
+            assert time.time() < deadline
+            time.sleep(0.01)
+        assert lifespan_client.get("/ready").json()["status"] == "failed"
+    set_startup_error(None)
@@ -0,0 +1,76 @@
+import io
+
+import pytest
+
+from ..utils import export
+
+
+def insert_individuals(db_handler):
+    for individual_id in ("a", "b"):
+        db_handler.insert_new_individual(individual_id)
+        db_handler.insert_genetic_rows_to_db(
+            [("rs1", "1", 100, "A", "G", 0.25), ("rs2", "X", 200, "C", "T", 0.5)],
+            individual_id,
+        )
+
+
+def test_binary_export_round_trips(db_handler):
+    insert_individuals(db_handler)
+    individuals, batches = db_handler.export_genetic_data(["b"], batch_size=1)
+
+    data = b"".join(export.iter_export(individuals, batches, "binary"))
+    decoded = list(export.read_binary(io.BytesIO(data)))
+
+    assert len(decoded) == 2
+    assert decoded[1] == {
+        "individual_id": ["b"],
+        "variant_id": ["rs2"],
+        "chromosome": ["X"],
+        "position": [200],
+        "reference_allele": ["C"],
+        "alternate_allele": ["T"],
+        "alternate_allele_frequency": [0.5],
+    }
+
+
+def test_export_of_everyone_ignores_individuals_created_while_streaming(db_handler):
+    insert_individuals(db_handler)
+    individuals, batches = db_handler.export_genetic_data(batch_size=1)
+    db_handler.insert_new_individual("c")
+    db_handler.insert_genetic_rows_to_db([("rs3", "2", 300, "G", "A", 0.75)], "c")
+
+    data = b"".join(export.iter_export(individuals, batches, "binary"))
+    decoded = list(export.read_binary(io.BytesIO(data)))
+
+    assert sorted(row["individual_id"][0] for row in decoded) == ["a", "a", "b", "b"]
+
+
+def test_export_of_unknown_individual(db_handler):
+    assert db_handler.export_genetic_data(["missing"]) is None
+
+
+@pytest.mark.parametrize("export_format", ["arrow", "parquet"])
+def test_arrow_exports(db_handler, export_format):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    insert_individuals(db_handler)
+    individuals, batches = db_handler.export_genetic_data(batch_size=3)
+
+    data = b"".join(export.iter_export(individuals, batches, export_format))
+    if export_format == "arrow":
+        table = pa.ipc.open_stream(data).read_all()
+    else:
+        table = pq.read_table(io.BytesIO(data))
+
+    assert table.num_rows == 4
+    assert table.column("individual_id").to_pylist() == ["a", "a", "b", "b"]
+    assert table.column("chromosome").to_pylist() == ["1", "X", "1", "X"]
+
+
+def test_binary_is_the_only_format_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(export, "_import_pyarrow", lambda: None)
+
+    assert export.available_formats() == ["binary"]
+    with pytest.raises(ValueError):
+        export.iter_export({}, [], "parquet")
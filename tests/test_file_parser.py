@@ -1,4 +1,5 @@
 from datetime import date
+from unittest.mock import MagicMock
 
 import pytest
 
@@ -46,3 +47,84 @@ def test_invalid_parse_file_to_genetic_data():
             expected_line_one_data = GeneticData(variant_id="rs12345",chromosome=ChromosomeEnum.CHR1,position=1234567,reference_allele=AlleleEnum.A,alternate_allele=AlleleEnum.G,alternate_allele_frequency=0.12)
             result = list(file_parser.parse_file_to_genetic_data(contents))
             assert result[0] == expected_line_one_data
+
+
+def test_batch_insert_genetic_data_to_db_commits_in_batches():
+    mock_db_handler = MagicMock()
+    mock_db_handler.insert_genetic_rows_to_db.side_effect = lambda rows, _: len(rows)
+    with open("tests/individual123.sano") as f:
+        rows_inserted = file_parser.batch_insert_genetic_data_to_db(
+            f, "individual123", mock_db_handler, batch_size=3
+        )
+
+    assert rows_inserted == 4
+    batch_sizes = [
+        len(call.args[0])
+        for call in mock_db_handler.insert_genetic_rows_to_db.call_args_list
+    ]
+    assert batch_sizes == [3, 1]
+
+
+def test_parse_lines_to_rows():
+    with open("tests/individual123.sano") as f:
+        contents = f.read().split("\n")
+    header_order = file_parser.get_header_order(contents[0])
+
+    rows = file_parser.parse_lines_to_rows(contents[1:], header_order)
+
+    assert len(rows) == 4
+    assert rows[0] == ("rs12345", "1", 1234567, "A", "G", 0.12)
+
+
+def test_parse_lines_to_rows_matches_dataclass_parser():
+    with open("tests/individual123.sano") as f:
+        contents = f.read().split("\n")
+    header_order = file_parser.get_header_order(contents[0])
+
+    rows = file_parser.parse_lines_to_rows(contents[1:], header_order)
+    genetic_data = list(file_parser.parse_file_to_genetic_data(contents))
+
+    assert rows == [
+        (
+            data.variant_id,
+            data.chromosome.value,
+            data.position,
+            data.reference_allele.value,
+            data.alternate_allele.value,
+            data.alternate_allele_frequency,
+        )
+        for data in genetic_data
+    ]
+
+
+def test_invalid_parse_lines_to_rows():
+    with open("tests/wrong_individual123.sano") as f:
+        contents = f.read().split("\n")
+    header_order = file_parser.get_header_order(contents[0])
+
+    with pytest.raises(ValueError):
+        file_parser.parse_lines_to_rows(contents[1:], header_order)
+
+
+def test_iter_checked_row_batches_keeps_valid_rows():
+    lines = open("tests/individual123.sano").read().splitlines()
+    lines[2] = "rs67890,3,2345678,C,T,0.34"
+    lines.append("")
+    lines.append("rs11111,1,abc,A,G,0.5")
+
+    batches = list(file_parser.iter_checked_row_batches(lines, batch_size=2))
+
+    rows = [row for batch_rows, _ in batches for row in batch_rows]
+    errors = [error for _, batch_errors in batches for error in batch_errors]
+    assert [row[0] for row in rows] == ["rs12345", "rs13579", "rs24680"]
+    assert [error["line"] for error in errors] == [3, 7]
+    assert "chromosome" in errors[0]["reason"]
+    assert errors[1]["content"] == "rs11111,1,abc,A,G,0.5"
+
+
+def test_hash_file_rewinds():
+    with open("tests/individual123.sano", "rb") as f:
+        digest = file_parser.hash_file(f, chunk_size=16)
+        assert f.read(1) == b"#"
+
+    assert len(digest) == 64
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import shutil
+import time
+
+from ..db_utils.async_database_handler import AsyncDatabaseHandler
+from ..utils.ingest_jobs import IngestJobQueue
+
+
+def wait_for(job_queue, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_queue.get(job_id)
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_background_ingest_completes(db_handler, tmp_path):
+    db_handler.insert_new_individual("individual123")
+    async_handler = AsyncDatabaseHandler(db_handler)
+    job_queue = IngestJobQueue(
+        async_handler, spool_dir=str(tmp_path / "spool"), workers=1, batch_size=3
+    )
+    job_queue.start()
+
+    with open("tests/individual123.sano", "rb") as f:
+        job_id = job_queue.submit("individual123", f)
+    job = wait_for(job_queue, job_id)
+    job_queue.stop()
+
+    assert job["status"] == "completed"
+    assert job["lines_committed"] == 4
+    assert job["rows_inserted"] == 4
+    assert asyncio.run(job_queue.read(job_id)) == job
+    assert len(db_handler.get_individual_data("individual123")) == 4
+    assert os.listdir(tmp_path / "spool") == []
+    assert job_queue.get("missing") is None
+
+
+def test_background_ingest_resumes_after_committed_lines(db_handler, tmp_path):
+    db_handler.insert_new_individual("individual123")
+    spool_path = str(tmp_path / "interrupted.sano")
+    shutil.copy("tests/individual123.sano", spool_path)
+    # As left by a worker that committed the first batch of three lines and stopped
+    db_handler.create_ingest_job("interrupted", "individual123", spool_path)
+    rows = [("rs12345", "1", 1234567, "A", "G", 0.12)]
+    db_handler.insert_genetic_rows_to_db(rows, "individual123", ("interrupted", 3))
+    db_handler.update_ingest_job("interrupted", status="running")
+
+    job_queue = IngestJobQueue(
+        AsyncDatabaseHandler(db_handler), spool_dir=str(tmp_path / "spool"), workers=1
+    )
+    job_queue.start()
+    job = wait_for(job_queue, "interrupted")
+    job_queue.stop()
+
+    assert job["status"] == "completed"
+    assert job["lines_committed"] == 4
+    genetic_data = db_handler.get_individual_data("individual123")
+    assert sorted(data.variant_id for data in genetic_data) == ["rs12345", "rs24680"]
+
+
+def test_background_ingest_fails_on_invalid_file(db_handler, tmp_path):
+    db_handler.insert_new_individual("individual123")
+    job_queue = IngestJobQueue(
+        AsyncDatabaseHandler(db_handler), spool_dir=str(tmp_path / "spool"), workers=1
+    )
+    job_queue.start()
+
+    with open("tests/wrong_individual123.sano", "rb") as f:
+        job_id = job_queue.submit("individual123", f)
+    job = wait_for(job_queue, job_id)
+    job_queue.stop()
+
+    assert job["status"] == "failed"
+    assert job["error"]
+    assert os.listdir(tmp_path / "spool") == []
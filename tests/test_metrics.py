@@ -0,0 +1,76 @@
+import time
+
+from ..utils.metrics import MetricsRegistry, current_endpoint
+from ..utils.profiler import SamplingProfiler
+from ..utils.query_profiler import full_scans, parameter_shape
+
+
+def test_counters_and_histograms_render():
+    registry = MetricsRegistry(buckets=(0.1, 1.0, float("inf")))
+    registry.describe("requests_total", "Requests served")
+    registry.inc("requests_total", endpoint="/individuals")
+    registry.inc("requests_total", endpoint="/individuals")
+    registry.observe("latency_seconds", 0.5, endpoint="/individuals")
+
+    rendered = registry.render({"pool_open_connections": [({}, 3)]})
+
+    assert "# HELP requests_total Requests served" in rendered
+    assert 'requests_total{endpoint="/individuals"} 2' in rendered
+    assert 'latency_seconds_bucket{endpoint="/individuals",le="0.1"} 0' in rendered
+    assert 'latency_seconds_bucket{endpoint="/individuals",le="1.0"} 1' in rendered
+    assert 'latency_seconds_bucket{endpoint="/individuals",le="+Inf"} 1' in rendered
+    assert 'latency_seconds_count{endpoint="/individuals"} 1' in rendered
+    assert "pool_open_connections 3" in rendered
+
+
+def test_stage_is_labelled_with_current_endpoint():
+    registry = MetricsRegistry()
+    token = current_endpoint.set("/individuals")
+    with registry.stage("query"):
+        pass
+    current_endpoint.reset(token)
+
+    rendered = registry.render()
+
+    assert (
+        'sano_stage_duration_seconds_count{endpoint="/individuals",stage="query"} 1'
+        in rendered
+    )
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.inc("requests_total", endpoint='say "hi"\n')
+
+    assert 'requests_total{endpoint="say \\"hi\\"\\n"} 1' in registry.render()
+
+
+def test_sampling_profiler_collects_stacks():
+    profiler = SamplingProfiler()
+    profiler.start(interval=0.001)
+    deadline = time.time() + 1
+    while profiler.samples < 5 and time.time() < deadline:
+        time.sleep(0.01)
+    profiler.stop()
+
+    report = profiler.report()
+
+    assert not report["running"]
+    assert report["samples"] >= 5
+    assert report["top_stacks"]
+    assert "test_sampling_profiler_collects_stacks" in profiler.collapsed()
+
+
+def test_parameter_shape_keeps_no_values():
+    assert parameter_shape((7, '["rs1", "rs2"]', "rs3", None)) == (
+        "(int, json[2], str, null)"
+    )
+    assert parameter_shape({"user_id": 1.5}) == "{user_id: float}"
+
+
+def test_full_scans_of_genetic_data_table_are_flagged():
+    sql = "SELECT * FROM variants AS v JOIN genetic_data_table AS g WHERE 1"
+    plan = ["SCAN v", "SCAN g USING COVERING INDEX idx_genetic_data_variant"]
+
+    assert full_scans(sql, plan) == [plan[1]]
+    assert full_scans(sql, ["SEARCH g USING INDEX idx (user_id=?)"]) == []
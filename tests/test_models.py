@@ -42,3 +42,17 @@ def test_user_init():
     assert user.username == "john_doe"
     assert user.date_created == date(2022, 1, 1)
     assert user.id == 123
+
+
+def test_genetic_data_from_row():
+    genetic_data = GeneticData.from_row(("some_variant", "X", 100, "A", "C", 0.5))
+
+    assert genetic_data == GeneticData(
+        variant_id="some_variant",
+        chromosome=ChromosomeEnum.CHRX,
+        position=100,
+        reference_allele=AlleleEnum.A,
+        alternate_allele=AlleleEnum.C,
+        alternate_allele_frequency=0.5,
+    )
+    assert not hasattr(genetic_data, "__dict__")
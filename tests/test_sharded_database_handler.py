@@ -0,0 +1,186 @@
+import threading
+import time
+
+import pytest
+
+from ..db_utils.async_database_handler import AsyncDatabaseHandler
+from ..db_utils.sharded_database_handler import (
+    ShardedDatabaseHandler,
+    hash_shard,
+    merge_cohort_summaries,
+    open_database_handler,
+)
+from ..utils.ingest_jobs import IngestJobQueue
+
+
+def write_config(tmp_path, shards):
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(
+        f"[database]\ndb_path = {tmp_path / 'data' / 'test.db'}\n"
+        f"[sharding]\nenabled = true\nshards = {shards}\n"
+        f"shard_dir = {tmp_path / 'shards'}\n"
+    )
+    return str(config_file)
+
+
+@pytest.fixture
+def sharded_handler(tmp_path):
+    handler = ShardedDatabaseHandler(write_config(tmp_path, 3))
+    yield handler
+    handler.close()
+
+
+INDIVIDUALS = [f"individual{i}" for i in range(8)]
+
+
+def insert_individuals(handler):
+    handler.insert_new_individuals(INDIVIDUALS)
+    for i, individual_id in enumerate(INDIVIDUALS):
+        handler.insert_genetic_rows_to_db(
+            [
+                ("rs1", "1", 100, "A", "G", i / 10),
+                (f"rs{i + 2}", "2", 200 + i, "C", "T", 0.5),
+            ],
+            individual_id,
+        )
+
+
+def test_individuals_are_stored_in_their_hashed_shard(sharded_handler):
+    insert_individuals(sharded_handler)
+
+    for individual_id in INDIVIDUALS:
+        shard = hash_shard(individual_id, 3)
+        assert sharded_handler.shard_of(individual_id) == shard
+        assert sharded_handler.shards[shard].get_id_for_individual_id(individual_id)
+        assert len(sharded_handler.get_individual_data(individual_id)) == 2
+    assert sorted(user.username for user in sharded_handler.get_all_users()) == (
+        sorted(INDIVIDUALS)
+    )
+    assert sharded_handler.get_users_state()[0] == len(INDIVIDUALS)
+    assert sharded_handler.insert_new_individual(INDIVIDUALS[0]) == (
+        f"User {INDIVIDUALS[0]} already exists"
+    )
+
+
+def test_cohort_summary_merges_shards(sharded_handler):
+    insert_individuals(sharded_handler)
+
+    summary = sharded_handler.get_cohort_summary(carrier_threshold=0.25)
+    first_page = sharded_handler.get_cohort_summary(limit=5)
+    second_page = sharded_handler.get_cohort_summary(
+        limit=5, after=first_page["next_cursor"]
+    )
+
+    rs1 = summary[0]
+    assert (rs1["variant_id"], rs1["count"], rs1["carriers"]) == ("rs1", 8, 5)
+    assert rs1["mean_frequency"] == pytest.approx(0.35)
+    assert (rs1["min_frequency"], rs1["max_frequency"]) == (0.0, 0.7)
+    assert len(summary) == 9
+    assert len(first_page["data"]) + len(second_page["data"]) == 9
+    assert second_page["next_cursor"] is None
+
+
+def test_merge_cohort_summaries_weights_means():
+    def entry(count, mean, low, high):
+        return {
+            "variant_id": "rs1",
+            "chromosome": "1",
+            "position": 1,
+            "reference_allele": "A",
+            "alternate_allele": "G",
+            "count": count,
+            "mean_frequency": mean,
+            "min_frequency": low,
+            "max_frequency": high,
+        }
+
+    merged = merge_cohort_summaries(
+        [[entry(1, 0.2, 0.2, 0.2)], [entry(3, 0.6, 0.4, 0.8)]]
+    )
+
+    assert merged[0]["count"] == 4
+    assert merged[0]["mean_frequency"] == pytest.approx(0.5)
+    assert (merged[0]["min_frequency"], merged[0]["max_frequency"]) == (0.2, 0.8)
+
+
+def test_export_reads_every_shard(sharded_handler):
+    insert_individuals(sharded_handler)
+
+    individuals, batches = sharded_handler.export_genetic_data()
+    rows = [row for batch in batches for row in batch]
+
+    assert sorted(individuals.values()) == sorted(INDIVIDUALS)
+    assert len(rows) == 16
+    assert sharded_handler.export_genetic_data(["missing"]) is None
+
+
+def test_rebalance_moves_individuals_to_added_shards(tmp_path):
+    handler = ShardedDatabaseHandler(write_config(tmp_path, 2))
+    insert_individuals(handler)
+    handler.close()
+
+    handler = ShardedDatabaseHandler(write_config(tmp_path, 5))
+    expected = sum(
+        hash_shard(individual_id, 2) != hash_shard(individual_id, 5)
+        for individual_id in INDIVIDUALS
+    )
+
+    assert handler.rebalance() == expected
+    for individual_id in INDIVIDUALS:
+        shard = hash_shard(individual_id, 5)
+        assert handler.shard_of(individual_id) == shard
+        assert len(handler.get_individual_data(individual_id)) == 2
+        for other, shard_handler in enumerate(handler.shards):
+            holds = shard_handler.get_id_for_individual_id(individual_id) is not None
+            assert holds == (other == shard)
+    assert handler.get_cohort_summary("rs1")[0]["count"] == 8
+    assert handler.rebalance() == 0
+    handler.close()
+
+
+def test_writes_run_on_one_writer_per_shard(sharded_handler):
+    async_handler = AsyncDatabaseHandler(sharded_handler)
+    sharded_handler.insert_new_individuals(INDIVIDUALS)
+
+    writers = {
+        async_handler._writer_for(individual_id) for individual_id in INDIVIDUALS
+    }
+
+    assert len(async_handler._writers) == 3
+    assert len(writers) == len({hash_shard(i, 3) for i in INDIVIDUALS})
+    async_handler.close()
+
+
+def test_job_writes_run_on_their_shards_writer(sharded_handler, tmp_path):
+    # individual0 is not in the first shard, whose writer also serves the catalog
+    sharded_handler.insert_new_individual("individual0")
+    shard = sharded_handler.shard_of("individual0")
+    update_threads = []
+    update_ingest_job = sharded_handler.update_ingest_job
+
+    def record_thread(*args, **kwargs):
+        update_threads.append(threading.current_thread().name)
+        return update_ingest_job(*args, **kwargs)
+
+    sharded_handler.update_ingest_job = record_thread
+    async_handler = AsyncDatabaseHandler(sharded_handler)
+    job_queue = IngestJobQueue(async_handler, spool_dir=str(tmp_path / "spool"))
+    job_queue.start()
+    with open("tests/individual123.sano", "rb") as f:
+        job_id = job_queue.submit("individual0", f)
+    deadline = time.time() + 10
+    while job_queue.get(job_id)["status"] != "completed" and time.time() < deadline:
+        time.sleep(0.01)
+    job_queue.stop()
+
+    assert job_queue.get(job_id)["status"] == "completed"
+    assert update_threads
+    assert all(name.startswith(f"db-writer-{shard}_") for name in update_threads)
+
+
+def test_open_database_handler_follows_config(tmp_path):
+    handler = open_database_handler(write_config(tmp_path, 2))
+
+    assert isinstance(handler, ShardedDatabaseHandler)
+    assert len(handler.shards) == 2
+    handler.close()
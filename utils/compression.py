@@ -0,0 +1,151 @@
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from .metrics import metrics
+
+DEFAULT_MINIMUM_SIZE = 1024
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_ZSTD_LEVEL = 3
+
+
+@lru_cache(maxsize=None)
+def _import_zstandard() -> Optional[Any]:
+    # zstandard is optional; without it responses are only gzip compressed. Cached
+    # like the other optional imports, as negotiation asks on every request
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def available_encodings() -> List[str]:
+    """Content codings the server can produce, most preferred first"""
+    if _import_zstandard() is None:
+        return ["gzip"]
+    return ["zstd", "gzip"]
+
+
+def parse_quality_list(header: str) -> List[Tuple[str, float]]:
+    """
+    Parses an Accept or Accept-Encoding header into (value, quality) pairs, highest
+    quality first and in header order among equals, dropping refused (q=0) values
+    """
+    values = []
+    for index, part in enumerate(header.split(",")):
+        value, *params = (piece.strip() for piece in part.split(";"))
+        if not value:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            values.append((index, value.lower(), quality))
+    values.sort(key=lambda value: (-value[2], value[0]))
+    return [(value, quality) for _, value, quality in values]
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Picks the content coding for an Accept-Encoding header, or None for identity.
+    Among codings the client rates equally the server's preference wins.
+    """
+    qualities = dict(parse_quality_list(accept_encoding))
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "zstd":
+            zstandard = _import_zstandard()
+            self._compressor = zstandard.ZstdCompressor(
+                level=DEFAULT_ZSTD_LEVEL
+            ).compressobj()
+            self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            # wbits 31 writes the gzip header and trailer
+            self._compressor = zlib.compressobj(DEFAULT_GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._flush_block = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        with metrics.stage("compress"):
+            compressed = self._compressor.compress(data)
+            if final:
+                return compressed + self._compressor.flush()
+            # Flushed per chunk, so a streamed response reaches the client as it goes
+            return compressed + self._compressor.flush(self._flush_block)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with zstd or gzip, whichever the client's
+    Accept-Encoding prefers among those available. Bodies sent in one piece are
+    compressed whole once they reach `minimum_size`; streamed bodies are
+    compressed chunk by chunk.
+    """
+
+    def __init__(self, app: Any, minimum_size: int = DEFAULT_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Dict[str, Any] = {}
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_compressed(message: Dict[str, Any]) -> None:
+            nonlocal compressor, passthrough
+            if message["type"] == "http.response.start":
+                start_message.update(message)
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(scope=start_message)
+                if "content-encoding" in headers or (
+                    not more_body and len(body) < self.minimum_size
+                ):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                del headers["content-length"]
+                body = compressor.compress(body, final=not more_body)
+                if not more_body:
+                    headers["Content-Length"] = str(len(body))
+                await send(start_message)
+            else:
+                body = compressor.compress(body, final=not more_body)
+            await send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,304 @@
+import argparse
+import io
+import json
+import struct
+import sys
+from array import array
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..models.models import ALLELE_CODES, CHROMOSOME_CODES
+from .metrics import metrics
+
+EXPORT_COLUMNS = (
+    "individual_id",
+    "variant_id",
+    "chromosome",
+    "position",
+    "reference_allele",
+    "alternate_allele",
+    "alternate_allele_frequency",
+)
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "binary": "application/octet-stream",
+}
+
+BINARY_MAGIC = b"SANOBIN1"
+
+# Column layouts of the binary format, little-endian: individual index, variant ID
+# offsets, then position, chromosome, alleles and frequency as fixed-width arrays
+_BATCH_HEADER = struct.Struct("<II")
+
+Batch = List[Tuple[Any, ...]]
+
+
+@lru_cache(maxsize=None)
+def _import_pyarrow() -> Optional[Any]:
+    # pyarrow is optional and slow to import, so it is only loaded for an export
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def available_formats() -> List[str]:
+    if _import_pyarrow() is None:
+        return ["binary"]
+    return ["arrow", "parquet", "binary"]
+
+
+def default_format() -> str:
+    return available_formats()[0]
+
+
+def _le(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def iter_binary(
+    individuals: Dict[int, str], batches: Iterable[Batch]
+) -> Iterator[bytes]:
+    """
+    Encodes the batches of `DatabaseHandler.export_genetic_data` as a header, with
+    the individual, chromosome and allele dictionaries as JSON, followed by one
+    columnar block per batch. See `read_binary` for the layout.
+    """
+    index_of = {user_id: index for index, user_id in enumerate(individuals)}
+    header = json.dumps(
+        {
+            "columns": EXPORT_COLUMNS,
+            "individuals": list(individuals.values()),
+            "chromosomes": list(CHROMOSOME_CODES),
+            "alleles": list(ALLELE_CODES),
+        }
+    ).encode()
+    yield BINARY_MAGIC + struct.pack("<I", len(header)) + header
+
+    for batch in batches:
+        with metrics.stage("serialize"):
+            (
+                user_ids,
+                variant_ids,
+                chromosomes,
+                positions,
+                references,
+                alternates,
+                frequencies,
+            ) = zip(*batch)
+            encoded_ids = [variant_id.encode() for variant_id in variant_ids]
+            offsets = array("I", [0])
+            for encoded_id in encoded_ids:
+                offsets.append(offsets[-1] + len(encoded_id))
+            yield b"".join(
+                (
+                    _BATCH_HEADER.pack(len(batch), offsets[-1]),
+                    _le(array("I", [index_of[user_id] for user_id in user_ids])),
+                    _le(offsets),
+                    b"".join(encoded_ids),
+                    _le(array("q", positions)),
+                    bytes(chromosomes),
+                    bytes(references),
+                    bytes(alternates),
+                    _le(array("d", frequencies)),
+                )
+            )
+
+
+def read_binary(stream: BinaryIO) -> Iterator[Dict[str, List[Any]]]:
+    """Decodes the binary format back into one dict of columns per batch"""
+    if stream.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("Not a sano binary export")
+    (header_size,) = struct.unpack("<I", stream.read(4))
+    header = json.loads(stream.read(header_size))
+
+    def read_array(typecode: str, count: int) -> array:
+        values = array(typecode)
+        values.frombytes(stream.read(values.itemsize * count))
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    while batch_header := stream.read(_BATCH_HEADER.size):
+        count, ids_size = _BATCH_HEADER.unpack(batch_header)
+        individuals = read_array("I", count)
+        offsets = read_array("I", count + 1)
+        ids = stream.read(ids_size)
+        positions = read_array("q", count)
+        chromosomes, references, alternates = (stream.read(count) for _ in range(3))
+        frequencies = read_array("d", count)
+        yield {
+            "individual_id": [header["individuals"][i] for i in individuals],
+            "variant_id": [
+                ids[start:end].decode() for start, end in zip(offsets, offsets[1:])
+            ],
+            "chromosome": [header["chromosomes"][code] for code in chromosomes],
+            "position": positions.tolist(),
+            "reference_allele": [header["alleles"][code] for code in references],
+            "alternate_allele": [header["alleles"][code] for code in alternates],
+            "alternate_allele_frequency": frequencies.tolist(),
+        }
+
+
+def _record_batches(
+    pa: Any, individuals: Dict[int, str], batches: Iterable[Batch]
+) -> Iterator[Any]:
+    # The individual, chromosome and allele columns are dictionary encoded, with
+    # the stored integer codes as the indices
+    index_of = {user_id: index for index, user_id in enumerate(individuals)}
+    individual_dictionary = pa.array(list(individuals.values()), pa.string())
+    chromosome_dictionary = pa.array(list(CHROMOSOME_CODES), pa.string())
+    allele_dictionary = pa.array(list(ALLELE_CODES), pa.string())
+
+    def dictionary(indices: Iterable[int], values: Any) -> Any:
+        return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), values)
+
+    for batch in batches:
+        with metrics.stage("serialize"):
+            (
+                user_ids,
+                variant_ids,
+                chromosomes,
+                positions,
+                references,
+                alternates,
+                frequencies,
+            ) = zip(*batch)
+            yield pa.RecordBatch.from_arrays(
+                [
+                    dictionary(
+                        [index_of[user_id] for user_id in user_ids],
+                        individual_dictionary,
+                    ),
+                    pa.array(variant_ids, pa.string()),
+                    dictionary(chromosomes, chromosome_dictionary),
+                    pa.array(positions, pa.int64()),
+                    dictionary(references, allele_dictionary),
+                    dictionary(alternates, allele_dictionary),
+                    pa.array(frequencies, pa.float64()),
+                ],
+                names=list(EXPORT_COLUMNS),
+            )
+
+
+def _schema(pa: Any) -> Any:
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            ("individual_id", dictionary),
+            ("variant_id", pa.string()),
+            ("chromosome", dictionary),
+            ("position", pa.int64()),
+            ("reference_allele", dictionary),
+            ("alternate_allele", dictionary),
+            ("alternate_allele_frequency", pa.float64()),
+        ]
+    )
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    A write-only file that hands back what was written since the last `drain`.
+    Its position keeps counting across drains, as the Parquet footer records
+    absolute offsets.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_arrow(
+    individuals: Dict[int, str], batches: Iterable[Batch]
+) -> Iterator[bytes]:
+    """Encodes the batches as an Arrow IPC stream, one record batch per batch"""
+    pa = _import_pyarrow()
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, _schema(pa)) as writer:
+        for record_batch in _record_batches(pa, individuals, batches):
+            writer.write_batch(record_batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_parquet(
+    individuals: Dict[int, str], batches: Iterable[Batch]
+) -> Iterator[bytes]:
+    """Encodes the batches as a Parquet file, one row group per batch"""
+    pa = _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, _schema(pa)) as writer:
+        for record_batch in _record_batches(pa, individuals, batches):
+            writer.write_batch(record_batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+ENCODERS = {"arrow": iter_arrow, "parquet": iter_parquet, "binary": iter_binary}
+
+
+def iter_export(
+    individuals: Dict[int, str], batches: Iterable[Batch], export_format: str
+) -> Iterator[bytes]:
+    """Encodes export batches in `export_format`, one of `available_formats`"""
+    if export_format not in available_formats():
+        raise ValueError(
+            f"Unsupported export format {export_format}, "
+            f"expected one of {available_formats()}"
+        )
+    return ENCODERS[export_format](individuals, batches)
+
+
+if __name__ == "__main__":
+    from ..db_utils.database_handler import DEFAULT_FETCH_SIZE
+    from ..db_utils.sharded_database_handler import open_database_handler
+
+    parser = argparse.ArgumentParser(
+        description="Export genetic data as Arrow IPC, Parquet or the sano binary format"
+    )
+    parser.add_argument("output", help="file to write, or - for stdout")
+    parser.add_argument("--config", default="config/config.ini")
+    parser.add_argument(
+        "--individuals", help="comma separated individual IDs, defaults to everyone"
+    )
+    parser.add_argument("--format", choices=list(ENCODERS), default=default_format())
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_FETCH_SIZE)
+    args = parser.parse_args()
+
+    # The shards rather than db_path when sharding is enabled, as the server reads
+    handler = open_database_handler(args.config)
+    export = handler.export_genetic_data(
+        args.individuals.split(",") if args.individuals else None, args.batch_size
+    )
+    if export is None:
+        sys.exit("Individual not found")
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    with output:
+        for chunk in iter_export(*export, args.format):
+            output.write(chunk)
+    handler.close()
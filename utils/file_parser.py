@@ -1,7 +1,22 @@
+import hashlib
+import logging
 from dataclasses import fields
 from enum import Enum
+from itertools import islice
 
-from ..models.models import GeneticData, HeaderOrder
+from ..models.models import AlleleEnum, ChromosomeEnum, GeneticData, HeaderOrder
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10_000
+
+SUPPORTED_CHROMOSOMES = frozenset(member.value for member in ChromosomeEnum)
+SUPPORTED_ALLELES = frozenset(member.value for member in AlleleEnum)
+
+# Order of the values in a row produced by `parse_lines_to_rows`, which is also the
+# column order `DatabaseHandler.insert_genetic_rows_to_db` expects
+ROW_FIELDS = tuple(member.name for member in HeaderOrder)
 
 
 def get_header_order(line):
@@ -19,6 +34,17 @@ def get_header_order(line):
     }
 
 
+def read_header_order(lines):
+    """
+    Reads the header from an iterator of lines, raising ValueError when the file is
+    empty or its header is malformed
+    """
+    try:
+        return get_header_order(next(lines))
+    except (AssertionError, KeyError, StopIteration) as e:
+        raise ValueError("Invalid or missing header line") from e
+
+
 def convert_to_expected_types(data, data_class):
     converted_data = {}
     for field, value in data.items():
@@ -31,15 +57,21 @@ def convert_to_expected_types(data, data_class):
             else:
                 converted_data[field] = field_type(value)
         except ValueError:
-            print(
-                f"The {field} is not a supported type of {field_type}. It's value is {value} whcih is not supported"
+            logger.warning(
+                "The %s is not a supported type of %s. Its value is %s which is not supported",
+                field,
+                field_type,
+                value,
             )
     return converted_data
 
 
 def parse_file_to_genetic_data(file_contents):
-    header_order = get_header_order(file_contents[0])
-    for line in file_contents[1:]:
+    lines = iter(file_contents)
+    header_order = get_header_order(next(lines))
+    for line in lines:
+        if not line.strip():
+            continue
         line_parts = line.strip().split(",")
         data = {field: line_parts[idx] for field, idx in header_order.items()}
         converted_data = convert_to_expected_types(data, GeneticData)
@@ -47,6 +79,115 @@ def parse_file_to_genetic_data(file_contents):
         yield genetic_data
 
 
-def batch_insert_genetic_data_to_db(file_contents, individual_id, db_handler):
-    genetic_data_list = list(parse_file_to_genetic_data(file_contents))
-    db_handler.insert_genetic_data_to_db(genetic_data_list, individual_id)
+def _check_supported(values, supported, name):
+    unsupported = set(values) - supported
+    if unsupported:
+        raise ValueError(f"Unsupported {name} value(s): {sorted(unsupported)}")
+
+
+def parse_lines_to_columns(lines, header_order):
+    """
+    Splits a chunk of data lines into one tuple per column, keyed by field name.
+    Chromosome and allele codes are validated with one set difference per column
+    and positions and frequencies are converted a column at a time.
+    """
+    with metrics.stage("parse"):
+        split_lines = [line.strip().split(",") for line in lines if line.strip()]
+        n_fields = len(header_order)
+        for parts in split_lines:
+            if len(parts) != n_fields:
+                raise ValueError(
+                    f"Expected {n_fields} fields but got {len(parts)}: {parts}"
+                )
+        raw_columns = list(zip(*split_lines)) or [()] * n_fields
+        columns = {field: raw_columns[index] for field, index in header_order.items()}
+
+    with metrics.stage("validate"):
+        _check_supported(columns["chromosome"], SUPPORTED_CHROMOSOMES, "chromosome")
+        _check_supported(columns["reference_allele"], SUPPORTED_ALLELES, "allele")
+        _check_supported(columns["alternate_allele"], SUPPORTED_ALLELES, "allele")
+
+    with metrics.stage("parse"):
+        columns["position"] = tuple(map(int, columns["position"]))
+        columns["alternate_allele_frequency"] = tuple(
+            map(float, columns["alternate_allele_frequency"])
+        )
+    return columns
+
+
+def parse_lines_to_rows(lines, header_order):
+    """Parses a chunk of data lines into tuples ordered as ROW_FIELDS"""
+    columns = parse_lines_to_columns(lines, header_order)
+    return list(zip(*(columns[field] for field in ROW_FIELDS)))
+
+
+def parse_numbered_lines(numbered_lines, header_order):
+    """
+    Parses a chunk of (line number, line) pairs, keeping the valid rows. Returns the
+    rows and one {"line", "reason", "content"} error per rejected line. The chunk is
+    parsed as a whole first, and line by line only when it holds a bad row.
+    """
+    lines = [line for _, line in numbered_lines]
+    try:
+        return parse_lines_to_rows(lines, header_order), []
+    except ValueError:
+        pass
+
+    rows, errors = [], []
+    for number, line in numbered_lines:
+        if not line.strip():
+            continue
+        try:
+            rows.extend(parse_lines_to_rows([line], header_order))
+        except ValueError as e:
+            errors.append({"line": number, "reason": str(e), "content": line.strip()})
+    return rows, errors
+
+
+def iter_batches(iterable, batch_size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def iter_row_batches(file_contents, batch_size=DEFAULT_BATCH_SIZE):
+    lines = iter(file_contents)
+    header_order = read_header_order(lines)
+    for chunk in iter_batches(lines, batch_size):
+        rows = parse_lines_to_rows(chunk, header_order)
+        if rows:
+            yield rows
+
+
+def iter_checked_row_batches(file_contents, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Like `iter_row_batches`, but yields (rows, errors) instead of raising on the
+    first bad row. Errors carry the line number in the file, the header being line 1.
+    """
+    lines = iter(file_contents)
+    header_order = read_header_order(lines)
+    for chunk in iter_batches(enumerate(lines, start=2), batch_size):
+        yield parse_numbered_lines(chunk, header_order)
+
+
+def hash_file(fileobj, chunk_size=1 << 20):
+    """Returns the SHA-256 of a seekable binary file, leaving it rewound"""
+    digest = hashlib.sha256()
+    while chunk := fileobj.read(chunk_size):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def batch_insert_genetic_data_to_db(
+    file_contents, individual_id, db_handler, batch_size=DEFAULT_BATCH_SIZE
+):
+    """
+    Parses the lines of a sano file lazily and inserts them in batches of
+    `batch_size`, so only one batch is held in memory at a time.
+    Returns the number of rows inserted.
+    """
+    rows_inserted = 0
+    for rows in iter_row_batches(file_contents, batch_size):
+        rows_inserted += db_handler.insert_genetic_rows_to_db(rows, individual_id)
+    return rows_inserted
@@ -0,0 +1,188 @@
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from functools import partial
+from itertools import islice
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from ..db_utils.async_database_handler import AsyncDatabaseHandler
+from . import file_parser
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_DIR = "./data/spool"
+DEFAULT_WORKERS = 2
+
+
+class IngestJobQueue:
+    """
+    Ingests uploads in the background. An upload is spooled to disk and recorded as a
+    job in the database, and a pool of worker threads parses it in batches, committing
+    each batch through the database writer together with the job's progress. A job
+    interrupted by a shutdown or crash is picked up again on start, after the lines
+    whose rows were already committed.
+    """
+
+    def __init__(
+        self,
+        db_handler: AsyncDatabaseHandler,
+        spool_dir: str = DEFAULT_SPOOL_DIR,
+        workers: int = DEFAULT_WORKERS,
+        batch_size: int = file_parser.DEFAULT_BATCH_SIZE,
+    ):
+        self.db_handler = db_handler
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.batch_size = batch_size
+        self._jobs: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def start(self) -> None:
+        self._stopping.clear()
+        for job in self.db_handler.handler.get_unfinished_ingest_jobs():
+            logger.info("Resuming ingest job %s", job["id"])
+            self._jobs.put(job["id"])
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"ingest-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        # Workers finish the batch they are on; unfinished jobs resume on next start
+        self._stopping.set()
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(
+        self, individual_id: str, fileobj: BinaryIO, content_hash: Optional[str] = None
+    ) -> str:
+        """
+        Spools the upload to disk, queues it and returns the job id. The upload's
+        `content_hash` is recorded once the job completes.
+        """
+        job_id = uuid.uuid4().hex
+        spool_path = os.path.join(self.spool_dir, f"{job_id}.sano")
+        with open(spool_path, "wb") as spool:
+            shutil.copyfileobj(fileobj, spool)
+        self.db_handler.write(
+            self.db_handler.handler.create_ingest_job,
+            job_id,
+            individual_id,
+            spool_path,
+            content_hash,
+            individual_id=individual_id,
+        )
+        self._jobs.put(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the job with its progress, or None if there is no such job"""
+        return self._describe(self.db_handler.handler.get_ingest_job(job_id))
+
+    async def read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """As `get`, reading the job on the database handler's reader threads"""
+        return self._describe(await self.db_handler.get_ingest_job(job_id))
+
+    @staticmethod
+    def _describe(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if job is None:
+            return None
+        elapsed = (job["finished_at"] or time.time()) - (job["started_at"] or 0)
+        started = job["started_at"] is not None
+        return {
+            "job_id": job["id"],
+            "individual_id": job["individual_id"],
+            "status": job["status"],
+            "lines_committed": job["lines_committed"],
+            "rows_inserted": job["rows_inserted"],
+            "error": job["error"],
+            "elapsed_seconds": round(elapsed, 3) if started else None,
+            "rows_per_second": (
+                round(job["rows_inserted"] / elapsed) if started and elapsed else None
+            ),
+        }
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            job_id = self._jobs.get()
+            if job_id is None:
+                return
+            job = self.db_handler.handler.get_ingest_job(job_id)
+            if job is None or job["status"] not in ("queued", "running"):
+                continue
+            interrupted = False
+            try:
+                interrupted = not self._run_job(job)
+            except Exception as e:
+                logger.exception("Ingest job %s failed", job_id)
+                self._update(job, status="failed", error=str(e), finished_at=time.time())
+            finally:
+                # Only a job interrupted by a shutdown is resumed from its spool file
+                if not interrupted:
+                    self._remove_spool(job["spool_path"])
+
+    @staticmethod
+    def _remove_spool(spool_path: str) -> None:
+        try:
+            os.remove(spool_path)
+        except FileNotFoundError:
+            pass
+
+    def _update(self, job: Dict[str, Any], **values: Any) -> None:
+        # Through the writer of the shard holding the job, like its rows
+        self.db_handler.write(
+            partial(self.db_handler.handler.update_ingest_job, job["id"], **values),
+            individual_id=job["individual_id"],
+        )
+
+    def _run_job(self, job: Dict[str, Any]) -> bool:
+        """Runs the job, returning False if a shutdown stopped it before the end"""
+        handler = self.db_handler.handler
+        job_id = job["id"]
+        started_at = job["started_at"] or time.time()
+        self._update(job, status="running", started_at=started_at)
+
+        with open(job["spool_path"], encoding="utf-8") as spool:
+            # Blank lines are dropped before counting so resumed offsets line up
+            lines = (line for line in spool if line.strip())
+            header_order = file_parser.read_header_order(lines)
+            lines = islice(lines, job["lines_committed"], None)
+            for chunk in file_parser.iter_batches(lines, self.batch_size):
+                if self._stopping.is_set():
+                    return False
+                rows = file_parser.parse_lines_to_rows(chunk, header_order)
+                self.db_handler.write(
+                    handler.insert_genetic_rows_to_db,
+                    rows,
+                    job["individual_id"],
+                    (job_id, len(chunk)),
+                    individual_id=job["individual_id"],
+                )
+
+        self.db_handler.write(
+            handler.save_variant_filter,
+            job["individual_id"],
+            individual_id=job["individual_id"],
+        )
+        self._update(job, status="completed", finished_at=time.time())
+        if job["content_hash"]:
+            completed = handler.get_ingest_job(job_id) or job
+            self.db_handler.write(
+                handler.record_upload,
+                job["individual_id"],
+                job["content_hash"],
+                completed["rows_inserted"],
+                individual_id=job["individual_id"],
+            )
+        return True
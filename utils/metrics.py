@@ -0,0 +1,196 @@
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from starlette.routing import Match
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    math.inf,
+)
+
+# Route template of the request being served, used to label stage timings
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_endpoint", default="none"
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms, rendered in the Prometheus text
+    exposition format
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, List[float]]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # Per-bucket counts followed by the sum and the count of observations
+            histogram = series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stage(self, stage: str) -> Any:
+        """Times one stage (parse, validate, db_connect, query, ...) of the request"""
+        return self.timer(
+            "sano_stage_duration_seconds", endpoint=current_endpoint.get(), stage=stage
+        )
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(
+        self, gauges: Optional[Dict[str, List[Tuple[Dict[str, Any], float]]]] = None
+    ) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, counter_series in sorted(self._counters.items()):
+                self._render_header(lines, name, "counter")
+                for labels, value in counter_series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name, histogram_series in sorted(self._histograms.items()):
+                self._render_header(lines, name, "histogram")
+                for labels, histogram in histogram_series.items():
+                    cumulative = 0.0
+                    for bound, count in zip(self.buckets, histogram):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        bucket_labels = _format_labels(labels + (("le", le),))
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]}")
+                    lines.append(
+                        f"{name}_count{_format_labels(labels)} {histogram[-1]}"
+                    )
+        for name, gauge_series in sorted((gauges or {}).items()):
+            self._render_header(lines, name, "gauge")
+            for gauge_labels, value in gauge_series:
+                lines.append(f"{name}{_format_labels(_labels(gauge_labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _render_header(self, lines: List[str], name: str, metric_type: str) -> None:
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+
+metrics = MetricsRegistry()
+metrics.describe(
+    "sano_request_duration_seconds", "Request latency by endpoint and status"
+)
+metrics.describe(
+    "sano_stage_duration_seconds",
+    "Time spent in each stage of a request: parse, validate, db_connect, query, "
+    "insert and serialize",
+)
+metrics.describe("sano_rows_total", "Genetic data rows read or ingested")
+metrics.describe("sano_bytes_ingested_total", "Bytes of sano files uploaded")
+
+
+def _route_template(scope: Dict[str, Any]) -> str:
+    app = scope.get("app")
+    for route in getattr(app, "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return str(route.path)
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every request by route template and making the template
+    available to stage timings through `current_endpoint`
+    """
+
+    def __init__(self, app: Any, registry: MetricsRegistry = metrics):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = _route_template(scope)
+        token = current_endpoint.set(endpoint)
+        status = 500
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.registry.observe(
+                "sano_request_duration_seconds",
+                time.perf_counter() - start,
+                endpoint=endpoint,
+                method=scope["method"],
+                status=status,
+            )
+            current_endpoint.reset(token)
@@ -0,0 +1,88 @@
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+DEFAULT_INTERVAL = 0.005
+MAX_STACK_DEPTH = 64
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every other thread at a fixed interval from a background
+    thread, so it can be switched on under real load with little overhead and
+    without restarting the server. Stacks are aggregated in the collapsed format
+    used by flame graph tools.
+    """
+
+    def __init__(self) -> None:
+        self.interval = DEFAULT_INTERVAL
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._stacks: Counter[str] = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stacks_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = DEFAULT_INTERVAL) -> None:
+        with self._lock:
+            if self.running:
+                return
+            self.interval = interval
+            self.samples = 0
+            self.started_at = time.time()
+            self._stacks = Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename}:{code.co_name}")
+                    frame = frame.f_back
+                with self._stacks_lock:
+                    self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def report(self, top: int = 50) -> Dict[str, Any]:
+        with self._stacks_lock:
+            stacks = self._stacks.most_common(top)
+        return {
+            "running": self.running,
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "started_at": self.started_at,
+            "top_stacks": [{"stack": stack, "count": count} for stack, count in stacks],
+        }
+
+    def collapsed(self) -> str:
+        with self._stacks_lock:
+            lines: List[str] = [
+                f"{stack} {count}" for stack, count in self._stacks.items()
+            ]
+        return "\n".join(lines) + "\n"
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,348 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .metrics import current_endpoint, metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_SLOW_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_SLOW_LOG_BACKUPS = 5
+# Statements beyond this many distinct texts are counted together, so a query
+# built with varying text cannot grow the profile without bound
+MAX_STATEMENTS = 1_000
+OTHER_STATEMENTS = "<other>"
+MAX_SHAPES = 5
+
+SCANNED_TABLE = "genetic_data_table"
+_ALIAS_KEYWORDS = {"WHERE", "JOIN", "INNER", "LEFT", "ON", "GROUP", "ORDER", "LIMIT"}
+_TABLE_ALIAS = re.compile(rf"\b{SCANNED_TABLE}\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+
+
+def normalise_statement(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+def _value_shape(value: Any) -> str:
+    # Only the type, and the length of JSON lists bound for json_each, so the
+    # profile never holds individuals' data
+    if value is None:
+        return "null"
+    if isinstance(value, str) and value[:1] == "[":
+        try:
+            return f"json[{len(json.loads(value))}]"
+        except ValueError:
+            pass
+    return type(value).__name__
+
+
+def parameter_shape(parameters: Any) -> str:
+    if isinstance(parameters, dict):
+        return (
+            "{"
+            + ", ".join(f"{key}: {_value_shape(v)}" for key, v in parameters.items())
+            + "}"
+        )
+    return "(" + ", ".join(_value_shape(value) for value in parameters) + ")"
+
+
+def scanned_aliases(sql: str) -> List[str]:
+    """Names genetic_data_table goes by in `sql`, as they appear in query plans"""
+    aliases = [SCANNED_TABLE]
+    for alias in _TABLE_ALIAS.findall(sql):
+        if alias.upper() not in _ALIAS_KEYWORDS:
+            aliases.append(alias)
+    return aliases
+
+
+def full_scans(sql: str, plan: List[str]) -> List[str]:
+    """Steps of `plan` reading all of genetic_data_table or one of its indexes"""
+    aliases = scanned_aliases(sql)
+    scans = []
+    for detail in plan:
+        words = detail.split()
+        if len(words) > 1 and words[0] == "SCAN" and words[1] in aliases:
+            scans.append(detail)
+    return scans
+
+
+class _StatementStats:
+    __slots__ = ("count", "total", "max", "slow", "shapes", "plan", "full_scans")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.shapes: Counter[str] = Counter()
+        self.plan: Optional[List[str]] = None
+        self.full_scans: List[str] = []
+
+
+class QueryProfiler:
+    """
+    Times every statement run on a ProfilingConnection, keyed by its whitespace
+    normalised text, with the shapes of its parameters but never their values.
+    Statements taking `threshold` seconds or more have their query plan captured,
+    once per statement, and are written to the slow-query log; plans scanning
+    genetic_data_table are flagged.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.threshold = DEFAULT_THRESHOLD
+        self.slow_log_path: Optional[str] = None
+        self.started_at = time.time()
+        self._stats: Dict[str, _StatementStats] = {}
+        self._lock = threading.Lock()
+        self._slow_log = logging.getLogger(f"{__name__}.slow")
+        self._slow_log_handler: Optional[logging.Handler] = None
+
+    def configure(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        slow_log_path: Optional[str] = None,
+        max_bytes: int = DEFAULT_SLOW_LOG_MAX_BYTES,
+        backups: int = DEFAULT_SLOW_LOG_BACKUPS,
+    ) -> None:
+        with self._lock:
+            self.enabled = True
+            self.threshold = threshold
+            if slow_log_path == self.slow_log_path:
+                return
+            if self._slow_log_handler is not None:
+                self._slow_log.removeHandler(self._slow_log_handler)
+                self._slow_log_handler.close()
+                self._slow_log_handler = None
+            self.slow_log_path = slow_log_path
+            if slow_log_path:
+                # Slow queries go to their own rotating file rather than the
+                # application log; without one they propagate as warnings
+                os.makedirs(os.path.dirname(slow_log_path) or ".", exist_ok=True)
+                self._slow_log_handler = RotatingFileHandler(
+                    slow_log_path, maxBytes=max_bytes, backupCount=backups
+                )
+                self._slow_log_handler.setFormatter(logging.Formatter("%(message)s"))
+                self._slow_log.addHandler(self._slow_log_handler)
+            self._slow_log.propagate = self._slow_log_handler is None
+
+    def record(
+        self,
+        conn: sqlite3.Connection,
+        sql: str,
+        parameters: Any,
+        shape: str,
+        seconds: float,
+    ) -> None:
+        statement = normalise_statement(sql)
+        with self._lock:
+            stats = self._stats.get(statement)
+            if stats is None:
+                if len(self._stats) >= MAX_STATEMENTS:
+                    statement = OTHER_STATEMENTS
+                stats = self._stats.setdefault(statement, _StatementStats())
+            stats.count += 1
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            stats.shapes[shape] += 1
+            if seconds < self.threshold:
+                return
+            stats.slow += 1
+            needs_plan = stats.plan is None and statement != OTHER_STATEMENTS
+
+        if needs_plan:
+            plan = self._explain(conn, sql, parameters)
+            with self._lock:
+                stats.plan = plan
+                stats.full_scans = full_scans(sql, plan)
+        metrics.inc("sano_slow_queries_total", full_scan=bool(stats.full_scans))
+        self._slow_log.warning(
+            json.dumps(
+                {
+                    "time": time.time(),
+                    "endpoint": current_endpoint.get(),
+                    "ms": round(seconds * 1000, 3),
+                    "statement": statement,
+                    "parameters": shape,
+                    "plan": stats.plan,
+                    "full_scans": stats.full_scans,
+                }
+            )
+        )
+
+    def _explain(
+        self, conn: sqlite3.Connection, sql: str, parameters: Any
+    ) -> List[str]:
+        # Through the base class's execute, so explaining is not itself recorded
+        try:
+            rows = sqlite3.Connection.execute(
+                conn, f"EXPLAIN QUERY PLAN {sql}", parameters
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.debug("Could not explain %s: %s", normalise_statement(sql), e)
+            return []
+        return [row[-1] for row in rows]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = {}
+            self.started_at = time.time()
+
+    def report(self, top: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            ranked = sorted(
+                self._stats.items(), key=lambda item: item[1].total, reverse=True
+            )
+            statements = [
+                {
+                    "statement": statement,
+                    "count": stats.count,
+                    "total_ms": stats.total * 1000,
+                    "mean_ms": stats.total / stats.count * 1000,
+                    "max_ms": stats.max * 1000,
+                    "slow_count": stats.slow,
+                    "parameter_shapes": [
+                        {"shape": shape, "count": count}
+                        for shape, count in stats.shapes.most_common(MAX_SHAPES)
+                    ],
+                    "plan": stats.plan,
+                    "full_scans": stats.full_scans,
+                }
+                for statement, stats in ranked[:top]
+            ]
+            distinct = len(self._stats)
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold * 1000,
+            "started_at": self.started_at,
+            "distinct_statements": distinct,
+            "top_statements": statements,
+        }
+
+
+query_profiler = QueryProfiler()
+
+
+class _CountedRows:
+    # Passes executemany's rows through, keeping the first to describe them all
+    def __init__(self, rows: Iterable[Any]):
+        self._rows = rows
+        self.first: Any = None
+        self.count = 0
+
+    def __iter__(self) -> Iterator[Any]:
+        for row in self._rows:
+            if self.count == 0:
+                self.first = row
+            self.count += 1
+            yield row
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """
+    Cursor timing each statement from execute until its rows are fetched. A
+    statement's time is recorded once its results are exhausted, fetchone has
+    returned, or the cursor runs its next statement, is closed or is released.
+    """
+
+    _pending: Optional[Tuple[str, Any, str, float]] = None
+
+    def _finish(self) -> None:
+        if self._pending is not None:
+            sql, parameters, shape, seconds = self._pending
+            self._pending = None
+            query_profiler.record(self.connection, sql, parameters, shape, seconds)
+
+    def _add(self, seconds: float) -> None:
+        if self._pending is not None:
+            sql, parameters, shape, elapsed = self._pending
+            self._pending = (sql, parameters, shape, elapsed + seconds)
+
+    def execute(self, sql: str, parameters: Any = ()) -> "ProfilingCursor":
+        self._finish()
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._pending = (
+                sql,
+                parameters,
+                parameter_shape(parameters),
+                time.perf_counter() - start,
+            )
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> "ProfilingCursor":
+        self._finish()
+        rows = _CountedRows(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, rows)
+        finally:
+            seconds = time.perf_counter() - start
+            first = rows.first if rows.first is not None else ()
+            shape = f"{rows.count} x {parameter_shape(first)}"
+            self._pending = (sql, first, shape, seconds)
+            self._finish()
+        return self
+
+    def fetchone(self) -> Any:
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add(time.perf_counter() - start)
+        self._finish()
+        return row
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._add(time.perf_counter() - start)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self) -> List[Any]:
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add(time.perf_counter() - start)
+        self._finish()
+        return rows
+
+    def close(self) -> None:
+        self._finish()
+        super().close()
+
+    def __del__(self) -> None:
+        # Statements whose rows were never read, such as PRAGMAs reporting a value
+        self._finish()
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """Connection factory whose statements and commits are timed by query_profiler"""
+
+    def cursor(self, factory: Any = ProfilingCursor) -> Any:  # type: ignore[override]
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = ()) -> Any:  # type: ignore[override]
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(  # type: ignore[override]
+        self, sql: str, seq_of_parameters: Any
+    ) -> Any:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self) -> None:
+        start = time.perf_counter()
+        super().commit()
+        query_profiler.record(self, "COMMIT", (), "()", time.perf_counter() - start)
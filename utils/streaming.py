@@ -0,0 +1,85 @@
+import json
+from functools import lru_cache
+
+from .compression import parse_quality_list
+from .file_parser import ROW_FIELDS
+from .metrics import metrics
+
+JSON = "application/json"
+# Column-oriented JSON, {"<field>": [values...]}, naming each field once
+COLUMNS_JSON = "application/vnd.sano.columns+json"
+MSGPACK = "application/msgpack"
+
+_MEDIA_TYPE_ALIASES = {"application/x-msgpack": MSGPACK}
+
+
+@lru_cache(maxsize=None)
+def _import_msgpack():
+    # msgpack is optional; without it clients asking for it are sent JSON. Looked
+    # up once, as a failed import searches the whole path again every time
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+
+def available_media_types():
+    if _import_msgpack() is None:
+        return [JSON, COLUMNS_JSON]
+    return [JSON, COLUMNS_JSON, MSGPACK]
+
+
+def negotiate_media_type(accept):
+    """Picks the response encoding for an Accept header, JSON by default"""
+    for value, _ in parse_quality_list(accept):
+        value = _MEDIA_TYPE_ALIASES.get(value, value)
+        if value in available_media_types():
+            return value
+        if value in ("*/*", "application/*"):
+            return JSON
+    return JSON
+
+
+def encode_rows(fields, rows, media_type, paginated=False, next_cursor=None):
+    """
+    Serialises row tuples straight to bytes: JSON as one object per row, column-
+    oriented JSON, or MessagePack as {"fields": [...], "rows": [[...], ...]}.
+    Paginated results are wrapped as {"data": ..., "next_cursor": ...}.
+    """
+    with metrics.stage("serialize"):
+        if media_type == MSGPACK:
+            data = {"fields": list(fields), "rows": rows}
+        elif media_type == COLUMNS_JSON:
+            columns = zip(*rows) if rows else ((),) * len(fields)
+            data = {field: list(values) for field, values in zip(fields, columns)}
+        else:
+            data = [dict(zip(fields, row)) for row in rows]
+        if paginated:
+            data = {"data": data, "next_cursor": next_cursor}
+        if media_type == MSGPACK:
+            return _import_msgpack().packb(data)
+        return json.dumps(data, separators=(",", ":")).encode()
+
+
+def _row_to_json(row, fields):
+    return json.dumps(dict(zip(fields, row)))
+
+
+def iter_ndjson(batches, fields=ROW_FIELDS):
+    """Serialises batches of genetic data rows as newline delimited JSON"""
+    for rows in batches:
+        with metrics.stage("serialize"):
+            chunk = "".join(f"{_row_to_json(row, fields)}\n" for row in rows)
+        yield chunk
+
+
+def iter_json_array(batches, fields=ROW_FIELDS):
+    """Serialises batches of genetic data rows as a JSON array, one batch at a time"""
+    separator = "["
+    for rows in batches:
+        with metrics.stage("serialize"):
+            chunk = separator + ",".join(_row_to_json(row, fields) for row in rows)
+        yield chunk
+        separator = ","
+    yield "[]" if separator == "[" else "]"